@@ -0,0 +1,183 @@
+"""Parser throughput on synthetic sources of increasing size.
+
+Every shape generates a program of a given size, the program is parsed with
+`parser.parse_str` and the best time of a few runs and the peak traced memory
+are recorded. A power law `time = c * chars ** exponent` is fitted to each
+shape, an exponent well above 1 means that some part of the parser is
+superlinear in the size of the input, e.g. slicing the remaining text at every
+position.
+
+    python -m bench.parse [--output FILE] [--compare FILE] [--shape NAME]...
+
+Results are written as JSON so that runs of different commits can be compared.
+"""
+
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+
+import parser
+
+# Exponent above which a shape is reported as superlinear
+superlinear = 1.3
+# Relative throughput loss reported as a regression by `compare`
+regression = 0.2
+
+
+def nested(n):
+    expr = "a"
+    for i in range(n):
+        expr = f"({expr} + {i})"
+    return f"func f(a: i32) -> i32:\n    {expr}\n"
+
+
+def match(n):
+    cases = "".join(f"        case {i}: g({i})\n" for i in range(n))
+    return f"func f(a: i32) -> ():\n    match a:\n{cases}        case _: g(0)\n"
+
+
+def functions(n):
+    return "".join(f"func f{i}(a: i32, b: i32) -> i32:\n    let c: i32 = a * {i}\n    c + b\n\n" for i in range(n))
+
+
+def wide_tuple(n):
+    values = ", ".join(str(i) for i in range(n))
+    return f"let t: () = ({values})\n"
+
+
+def asm(n):
+    body = "".join(f"        (local.set $x (i32.add (local.get $x) (i32.const {i})))\n" for i in range(n))
+    return f"func f(x: i32) -> i32:\n    asm:\n{body}        (local.get $x)\n"
+
+
+# Generator and sizes of each shape
+shapes = {
+    "nested": (nested, [16, 32, 64, 128, 256]),
+    "match": (match, [100, 200, 400, 800, 1600]),
+    "functions": (functions, [50, 100, 200, 400, 800]),
+    "tuple": (wide_tuple, [250, 500, 1000, 2000, 4000]),
+    "asm": (asm, [100, 200, 400, 800, 1600]),
+}
+
+
+def fit(sizes, times):
+    """Exponent and coefficient of the least squares fit of `times = c * sizes ** exponent`."""
+    xs = [math.log(x) for x in sizes]
+    ys = [math.log(y) for y in times]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    exponent = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sum((x - mx) ** 2 for x in xs)
+    return exponent, math.exp(my - exponent * mx)
+
+
+def measure(text, repeat=3):
+    """Best parse time of `text` in seconds and peak traced memory in bytes."""
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser.parse_str(text)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        parser.parse_str(text)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run(names=None, repeat=3, scale=1.0):
+    results = {}
+    for name in names or shapes:
+        generate, sizes = shapes[name]
+        runs = []
+        for size in sizes:
+            text = generate(max(1, int(size * scale)))
+            seconds, peak = measure(text, repeat)
+            lines = text.count("\n")
+            runs.append(
+                {
+                    "size": size,
+                    "chars": len(text),
+                    "lines": lines,
+                    "seconds": seconds,
+                    "lines_per_second": lines / seconds,
+                    "chars_per_second": len(text) / seconds,
+                    "peak_bytes": peak,
+                }
+            )
+
+        exponent, _ = fit([r["chars"] for r in runs], [r["seconds"] for r in runs])
+        results[name] = {"runs": runs, "exponent": exponent, "superlinear": exponent > superlinear}
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(baseline, current):
+    """Messages for the shapes whose throughput at the largest size regressed, or that became superlinear."""
+    messages = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        # Single line shapes have no meaningful line rate
+        before = baseline["results"][name]["runs"][-1]["chars_per_second"]
+        after = result["runs"][-1]["chars_per_second"]
+        if after < before * (1 - regression):
+            messages.append(f"{name}: {after:.0f} chars/s, baseline {before:.0f} chars/s")
+        if result["superlinear"] and not baseline["results"][name]["superlinear"]:
+            messages.append(f"{name}: exponent {result['exponent']:.2f}")
+    return messages
+
+
+def report(results):
+    lines = [f"{'shape':<10} {'lines':>8} {'lines/s':>10} {'chars/s':>10} {'peak MiB':>10} {'exponent':>9}"]
+    for name, result in results["results"].items():
+        last = result["runs"][-1]
+        flag = "  superlinear" if result["superlinear"] else ""
+        lines.append(
+            f"{name:<10} {last['lines']:>8} {last['lines_per_second']:>10.0f} {last['chars_per_second']:>10.0f}"
+            f" {last['peak_bytes'] / 2**20:>10.2f} {result['exponent']:>9.2f}{flag}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv):
+    args = argparse.ArgumentParser(prog="python -m bench.parse")
+    args.add_argument("--shape", action="append", choices=list(shapes), help="shapes to run, all by default")
+    args.add_argument("--repeat", type=int, default=3, help="timed runs of each size")
+    args.add_argument("--scale", type=float, default=1.0, help="factor applied to every size")
+    args.add_argument("--output", help="write the results as JSON")
+    args.add_argument("--compare", help="compare with the results of a previous run")
+    args = args.parse_args(argv)
+
+    # Deeply nested expressions recurse through several rules per level
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    results = run(args.shape, args.repeat, args.scale)
+    print(report(results))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+
+    status = 1 if any(r["superlinear"] for r in results["results"].values()) else 0
+    if args.compare:
+        with open(args.compare, encoding="utf8") as f:
+            messages = compare(json.load(f), results)
+        for message in messages:
+            print(message)
+        status = 1 if messages else status
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,4 +2,5 @@ import typing
 
 from .ast import *
 
+from .pass_manager import PassManager
 from .passes import run as semantic_pass
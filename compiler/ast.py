@@ -214,9 +214,19 @@ class GetAttr(Node):
 @dataclass
 class Module(Node):
     stmts: list[Node]
+    # Registered source files of the statements, see `compiler.span`
+    sources = ()
 
-    def __init__(self, stmts: list[Node]):
+    def __init__(self, stmts: list[Node], sources=()):
         self.stmts = stmts
+        self.sources = list(sources)
+
+    def __iter__(self):
+        return (name for name in self.__dict__ if name != "sources")
+
+    def __getstate__(self):
+        # Files are registered again by the process loading the module
+        return {name: value for name, value in self.__dict__.items() if name != "sources"}
 
 
 @dataclass
@@ -0,0 +1,153 @@
+"""Debug dumps of the IR module after selected passes.
+
+Dumps are off unless a `Dump` is given to the `PassManager`. The module is
+written node by node to the output as it is visited, either as indented text or
+as JSON lines with one line for each attribute of each scope, which keeps the
+dumps of consecutive passes easy to diff.
+
+    manager = PassManager(dump=Dump(["propagate_types"], format="jsonl", directory="dumps"))
+"""
+
+import collections
+import json
+import os
+
+from . import ir
+
+formats = {"text": ".ir", "jsonl": ".jsonl"}
+
+
+def _is_ref(node):
+    # References are written by name, their targets are dumped where they are defined
+    return type(node).__name__.endswith("Ref")
+
+
+def _fields(node):
+    return [name for name in node if name != "info"]
+
+
+def write_text(node, out):
+    """Write the indented representation of `node` to the stream `out`."""
+    seen = set()
+
+    def write(value, pad):
+        if isinstance(value, ir.Node) and not _is_ref(value):
+            name = type(value).__name__
+            if id(value) in seen and not isinstance(value, ir.InternedType):
+                out.write(f"{name}(...)")
+                return
+            seen.add(id(value))
+
+            out.write(f"{name}(")
+            if isinstance(value, ir.Scope):
+                out.write(repr(value.name))
+            fields = _fields(value)
+            for field in fields:
+                out.write(f"\n{pad}  {field}=")
+                write(getattr(value, field, None), pad + "  ")
+                out.write(",")
+            out.write(f"\n{pad})" if fields else ")")
+
+        elif isinstance(value, list) and any(isinstance(item, (ir.Node, list, dict)) for item in value):
+            out.write("[")
+            for item in value:
+                out.write(f"\n{pad}  ")
+                write(item, pad + "  ")
+                out.write(",")
+            out.write(f"\n{pad}]")
+
+        elif isinstance(value, dict) and value:
+            out.write("{")
+            for key, item in value.items():
+                out.write(f"\n{pad}  {key!r}: ")
+                write(item, pad + "  ")
+                out.write(",")
+            out.write(f"\n{pad}}}")
+
+        else:
+            out.write(repr(value))
+
+    write(node, "")
+    out.write("\n")
+
+
+def write_jsonl(module: ir.Module, out, pass_name=None):
+    """Write `module` to the stream `out` as JSON lines.
+
+    The first line holds the module, then each line holds one attribute of a scope
+    under its path. Scopes list the names of their attributes instead of containing them.
+    """
+    scopes = collections.deque()
+    seen = set()
+
+    def convert(value):
+        if isinstance(value, ir.Node):
+            if _is_ref(value) or id(value) in seen and not isinstance(value, ir.InternedType):
+                return {"_": type(value).__name__, "ref": repr(value)}
+            seen.add(id(value))
+
+            result = {"_": type(value).__name__}
+            if isinstance(value, ir.Scope):
+                scopes.append(value)
+                result["name"] = value.name
+            for field in _fields(value):
+                if isinstance(value, ir.Scope) and field == "attrs":
+                    result[field] = list(value.attrs)
+                else:
+                    result[field] = convert(getattr(value, field, None))
+            return result
+        if isinstance(value, (list, tuple)):
+            return [convert(item) for item in value]
+        if isinstance(value, dict):
+            return {str(key): convert(item) for key, item in value.items()}
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return repr(value)
+
+    def line(path, node):
+        out.write(json.dumps({"pass": pass_name, "path": path, "node": convert(node)}, separators=(",", ":")))
+        out.write("\n")
+
+    line("", module)
+    while scopes:
+        scope = scopes.popleft()
+        for name, attr in scope.attrs.items():
+            line(f"{scope.name}/{name}", attr)
+
+
+class Dump:
+    """Writer of the module after the passes named in `passes`, or after every pass if `None`.
+
+    Each dump is written to its own file in `directory`, named after the index and
+    name of the pass, or appended to the stream `stream`.
+    """
+
+    def __init__(self, passes=None, format="text", directory=".", stream=None):
+        if format not in formats:
+            raise ValueError(f"Unknown dump format '{format}', expected one of {', '.join(formats)}")
+        self.passes = None if passes is None else set(passes)
+        self.format = format
+        self.directory = directory
+        self.stream = stream
+
+    def selected(self, name):
+        return self.passes is None or name in self.passes
+
+    def write(self, index, name, module):
+        if not self.selected(name):
+            return
+        if self.stream is not None:
+            self._write(self.stream, name, module)
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{index:02}-{name}{formats[self.format]}")
+        with open(path, "w", encoding="utf8") as out:
+            self._write(out, name, module)
+
+    def _write(self, out, name, module):
+        if self.format == "jsonl":
+            write_jsonl(module, out, name)
+        else:
+            out.write(f"# after {name}\n")
+            write_text(module, out)
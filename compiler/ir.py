@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import copy
-import itertools
 
 from collections import OrderedDict
 from dataclasses import dataclass, field
@@ -12,7 +11,8 @@ from . import ast
 
 @dataclass
 class Node:
-    info: object
+    # Source span of the node, see `compiler.span`
+    info: object = field(compare=False)
 
     def __iter__(self):
         return iter(self.__dataclass_fields__.keys())
@@ -33,6 +33,33 @@ class Node:
     #     return f"{self.__class__.__name__}({fields})"
 
 
+# Number of scopes each name was added to, a cached lookup of a name is valid while this does not change
+_additions: dict[str, int] = {}
+
+
+class ScopeAttrs(OrderedDict):
+    """Attributes of a scope, counting the names added in `_additions`."""
+
+    def __setitem__(self, name, value):
+        if name not in self:
+            _additions[name] = _additions.get(name, 0) + 1
+        super().__setitem__(name, value)
+
+
+def _free_name(base: str, taken, suffixes: dict[str, int], start=1) -> str:
+    """The first name `base$i` not in `taken`, from the suffix following the last one allocated for `base`.
+
+    The suffixes before the last allocated one were all taken when it was
+    allocated, `suffixes` holds the next one to try for each base so that
+    allocating a name does not probe all of its siblings.
+    """
+    i = suffixes.get(base, start)
+    while f"{base}${i}" in taken:
+        i += 1
+    suffixes[base] = i + 1
+    return f"{base}${i}"
+
+
 @dataclass(init=False)
 class Scope(Node):
     # Do not annotate parent scope to avoid infinite loops when traversing tree
@@ -55,12 +82,17 @@ class Scope(Node):
         self.root: Scope = parent.root if parent else self
         self.module_scope: Scope | None = parent.module_scope if parent else None
         self.name: str = f"{parent.name}.{name}" if parent else name
-        self.attrs = OrderedDict()
+        self.attrs = ScopeAttrs()
         self.body = body or list()
         self.func = func
         self.children_names: set[str] = set()
+        # Next suffix to try for the names of children and of attributes with each base name, see `_free_name`
+        self._child_suffixes: dict[str, int] = {}
+        self._attr_suffixes: dict[str, int] = {}
         self.name = parent.new_child_name(name) if parent else name
         self.break_scope: str | None = parent.break_scope if parent else None
+        # Scope defining each name looked up from this scope, with the number of additions of the name at the time
+        self._lookups: dict[str, tuple[int, Scope]] = {}
 
     def __deepcopy__(self, memo):
         new_scope = Scope(
@@ -76,10 +108,7 @@ class Scope(Node):
     def new_child_name(self, name):
         name = f"{self.name}.{name}"
         if name in self.children_names or name in self.attrs:
-            for i in itertools.count(1):
-                if f"{name}${i}" not in self.children_names:
-                    name = f"{name}${i}"
-                    break
+            name = _free_name(name, self.children_names, self._child_suffixes)
         self.children_names.add(name)
         return name
 
@@ -102,18 +131,15 @@ class Scope(Node):
     def register_local(self, name: str, var: VarDecl):
         if name in self.attrs:
             # Shadow previously declared local var
-            for i in itertools.count():
-                if f"__local.{name}${i}" not in self.attrs:
-                    shadowed_name = f"__local.{name}${i}"
-                    shadowed_var = self.attrs[name]
-                    if isinstance(shadowed_var, VarRef):
-                        assert hasattr(shadowed_var.var, "name"), shadowed_var
-                        shadowed_var.var.name = shadowed_name
-                    else:
-                        assert hasattr(shadowed_var, "name"), shadowed_var
-                        shadowed_var.name = shadowed_name
-                    self.attrs[shadowed_name] = shadowed_var
-                    break
+            shadowed_name = _free_name(f"__local.{name}", self.attrs, self._attr_suffixes, start=0)
+            shadowed_var = self.attrs[name]
+            if isinstance(shadowed_var, VarRef):
+                assert hasattr(shadowed_var.var, "name"), shadowed_var
+                shadowed_var.var.name = shadowed_name
+            else:
+                assert hasattr(shadowed_var, "name"), shadowed_var
+                shadowed_var.name = shadowed_name
+            self.attrs[shadowed_name] = shadowed_var
 
         if self.func:
             self.attrs[name] = var
@@ -123,10 +149,7 @@ class Scope(Node):
 
             local_name = f"{func_scope.name}.{name}"
             if local_name in func_scope.attrs:
-                for i in itertools.count(1):
-                    if f"{local_name}${i}" not in func_scope.attrs:
-                        local_name = f"{local_name}${i}"
-                        break
+                local_name = _free_name(local_name, func_scope.attrs, func_scope._attr_suffixes)
 
             var.name = local_name
             func_scope.attrs[local_name] = var
@@ -141,10 +164,7 @@ class Scope(Node):
         else:
             global_name = f"{self.name}.{name}"
             if global_name in self.root.attrs:
-                for i in itertools.count(1):
-                    if f"{global_name}${i}" not in self.root.attrs:
-                        global_name = f"{global_name}${i}"
-                        break
+                global_name = _free_name(global_name, self.root.attrs, self.root._attr_suffixes)
 
             if isinstance(type_, (TypeDef, TemplateDef)):
                 type_.name = global_name
@@ -155,25 +175,44 @@ class Scope(Node):
     def has_member(self, name: str) -> bool:
         return name in self.attrs
 
+    def resolve(self, name: str) -> Scope | None:
+        """The innermost scope from this one outwards that defines `name`, if any.
+
+        The result is cached in every scope on the way, until `name` is added to
+        any scope, which may shadow it. Lookups from nested scopes stop at the
+        first enclosing scope with a cached result.
+        """
+        additions = _additions.get(name, 0)
+        path = []
+        scope: Scope | None = self
+        while scope is not None and name not in scope.attrs:
+            cached = scope._lookups.get(name)
+            if cached is not None and cached[0] == additions and name in cached[1].attrs:
+                scope = cached[1]
+                break
+            path.append(scope)
+            scope = scope.parent
+
+        if scope is not None:
+            for inner in path:
+                inner._lookups[name] = (additions, scope)
+        return scope
+
     def lookup_type(self, name: str) -> Type:
-        if name in self.attrs:
-            res = self.attrs[name]
-            assert isinstance(res, Type)
-            if isinstance(res, TypeRef):
-                res = res.type_
-            return res
-        elif self.parent:
-            return self.parent.lookup_type(name)
-        else:
+        scope = self.resolve(name)
+        if scope is None:
             raise KeyError(f"Type '{name}' not found")
+        res = scope.attrs[name]
+        assert isinstance(res, Type)
+        if isinstance(res, TypeRef):
+            res = res.type_
+        return res
 
     def lookup(self, name: str) -> Node:
-        if name in self.attrs:
-            return self.attrs[name]
-        elif self.parent:
-            return self.parent.lookup(name)
-        else:
+        scope = self.resolve(name)
+        if scope is None:
             raise KeyError(f"Attribute '{name}' not found")
+        return scope.attrs[name]
 
     def current_func(self) -> FunctionRef:
         func = self.func
@@ -252,6 +291,43 @@ class Type(Node):
                 raise NotImplementedError
 
 
+class TypeTable(type):
+    """Metaclass of the types with a single instance for each distinct value.
+
+    Calling an interned type class returns the instance registered in `types`
+    under the key computed by `key` from the arguments, creating it on first use.
+    """
+
+    def __call__(cls, *args):
+        key = (cls, cls.key(*args))
+        type_ = types.get(key)
+        if type_ is None:
+            type_ = types[key] = super().__call__(*args)
+        return type_
+
+
+# Canonical instance of each interned type by class and key
+types: dict[tuple, Type] = {}
+
+
+@dataclass(eq=False)
+class InternedType(Type, metaclass=TypeTable):
+    """Type compared and hashed by identity, its instances are never copied."""
+
+    @staticmethod
+    def key(*args):
+        return ()
+
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __copy__(self):
+        return self
+
+
 @dataclass
 class UntranslatedType(Type):
     ast_node: ast.Node
@@ -278,6 +354,10 @@ class TypeDef(Type):
     name: str
     scope: Scope
 
+    # Cached inheritance chain, and `primitive` with the chain it was computed for
+    _primitive = None
+    _chain = None
+
     def __init__(self, info, super_: Type | None, name: str, scope: Scope):
         super().__init__(info)
         assert not isinstance(super_, TypeDef)
@@ -290,20 +370,33 @@ class TypeDef(Type):
         # self.scope.register_type(name, self_ref)
 
     def primitive(self):
-        return self.super_.primitive() if self.super_ else self
+        chain = self.chain()
+        if self._primitive is None or self._primitive[0] is not chain:
+            self._primitive = (chain, self.super_.primitive() if self.super_ else self)
+        return self._primitive[1]
+
+    def chain(self) -> tuple[Type, ...]:
+        """The type followed by its base classes, ending with the first base that is not a `TypeDef`."""
+        chain = self._chain
+        if chain is None or not _chain_valid(chain):
+            super_ = _base(self)
+            if isinstance(super_, TypeDef):
+                chain = (self, *super_.chain())
+            else:
+                chain = (self, super_) if super_ is not None else (self,)
+            self._chain = chain
+        return chain
 
     def has_base_class(self, cls: Type):
-        current: Type | None = self
-        while True:
-            if current == cls:
+        if isinstance(cls, TypeRef):
+            cls = cls.type_
+        chain = self.chain()
+        for base in chain:
+            if base is cls:
                 return True
-
-            if isinstance(current, TypeDef):
-                current = current.super_
-                if isinstance(current, TypeRef):
-                    current = current.type_
-            else:
-                return False
+        # Structural types are not interned and compare by value
+        last = chain[-1]
+        return not isinstance(last, (TypeDef, InternedType)) and last == cls
 
     def get_attr(self, attr):
         if attr in self.scope.attrs:
@@ -313,9 +406,9 @@ class TypeDef(Type):
     def __eq__(self, value):
         if isinstance(value, TypeRef):
             value = value.type_
-        if not isinstance(value, TypeDef):
-            return False
-        return self.name == value.name
+        return self is value
+
+    __hash__ = object.__hash__
 
     def __deepcopy__(self, memo):
         raise RuntimeError
@@ -327,12 +420,31 @@ class TypeDef(Type):
         return TypeRef(info, self)
 
 
-@dataclass
-class IntegralType(Type):
+def _base(type_: TypeDef) -> Type | None:
+    return type_.super_.type_ if isinstance(type_.super_, TypeRef) else type_.super_
+
+
+def _chain_valid(chain: tuple[Type, ...]) -> bool:
+    # Any type along the chain may have had its `super_` resolved or replaced since it was cached
+    for i, type_ in enumerate(chain):
+        if not isinstance(type_, TypeDef):
+            break
+        base = chain[i + 1] if i + 1 < len(chain) else None
+        if _base(type_) is not base:
+            return False
+    return True
+
+
+@dataclass(eq=False)
+class IntegralType(InternedType):
     native_type: str
     array_packed: str
     array_get: str
 
+    @staticmethod
+    def key(info, native_type, array_packed, array_get):
+        return native_type, array_packed, array_get
+
     @staticmethod
     def translate(node: ast.IntegralType, _scope):
         return IntegralType(node.info, node.native_type, node.array_packed, node.array_get)
@@ -365,15 +477,15 @@ class NamedTupleType(TupleType):
         self.field_names = field_names
 
 
-@dataclass
-class VoidType(Type):
+@dataclass(eq=False)
+class VoidType(InternedType):
+    def __init__(self, info):
+        super().__init__(None)
+
     @staticmethod
     def translate(node: ast.VoidType, _scope):
         return VoidType(node)
 
-    def __eq__(self, value):
-        return isinstance(value, VoidType)
-
 
 @dataclass
 class FunctionType(Type):
@@ -390,13 +502,13 @@ class FunctionType(Type):
         return FunctionType(node.info, args, ret_type)
 
 
-@dataclass
+@dataclass(eq=False)
 class EnumIntType(TypeDef):
     def __init__(self, info, super_: Type | None, name: str, scope: Scope):
         super().__init__(info, super_, name, scope)
 
 
-@dataclass
+@dataclass(eq=False)
 class EnumType(TypeDef):
     count: int
     discr_type: TypeRef
@@ -410,7 +522,7 @@ class EnumType(TypeDef):
         return self
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, eq=False)
 class EnumValueType(TypeDef):
     discr: int
     discr_type: TypeRef
@@ -441,20 +553,21 @@ class EnumValueType(TypeDef):
         return self.super_.get_attr(attr)
 
 
-@dataclass
-class BuiltinType(Type):
+@dataclass(eq=False)
+class BuiltinType(InternedType):
     name: str
 
     def __init__(self, name):
         super().__init__(None)
         self.name = name
 
-    def __eq__(self, value):
-        return isinstance(value, BuiltinType) and self.name == value.name
+    @staticmethod
+    def key(name):
+        return name
 
 
-@dataclass
-class UnknownType(Type):
+@dataclass(eq=False)
+class UnknownType(InternedType):
     def __init__(self):
         super().__init__(None)
 
@@ -849,7 +962,10 @@ class TypeRef(Type):
 
     def __eq__(self, value):
         value_type = value.type_ if isinstance(value, TypeRef) else value
-        return self.type_ == value_type
+        return self.type_ is value_type or self.type_ == value_type
+
+    def __hash__(self):
+        return hash(self.type_)
 
     def __deepcopy__(self, memo):
         return TypeRef(self.info, self.type_)
@@ -1026,6 +1142,9 @@ class MacroDef(Node):
     name: str
     func: FunctionDef
 
+    # Whether the body has nodes left to resolve once expanded, set when first inlined
+    _unresolved = None
+
     @staticmethod
     def translate(node: ast.MacroDef, scope: Scope):
         # TODO: add the macro itself to the scope to allow recursion?
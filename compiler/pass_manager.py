@@ -0,0 +1,186 @@
+"""Running of the semantic passes with time, memory and IR size accounting.
+
+    manager = PassManager(memory=True, nodes=True, functions=True)
+    module = compiler.semantic_pass(prog, manager)
+    print(manager.report())
+    manager.write_trace("passes.json")
+
+The trace is in the Chrome trace event format, viewable in `chrome://tracing` or
+Perfetto, with one span per pass and, when `functions` is set, one span per
+function definition the pass visited through `traverse_ir`. The module can be
+dumped after selected passes with `dump`, see `compiler.dump`.
+"""
+
+import collections
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+
+from . import ir
+from . import traverse_ir
+from .verify import Verifier
+
+
+@dataclass
+class FunctionStats:
+    name: str
+    start: float
+    seconds: float
+
+
+@dataclass
+class PassStats:
+    name: str
+    # Seconds since the creation of the manager
+    start: float
+    seconds: float = 0.0
+    # Peak of the memory allocated during the pass, in bytes, if traced
+    peak_memory: int | None = None
+    # IR nodes reachable from the module by class name, if counted
+    nodes_before: collections.Counter | None = None
+    nodes_after: collections.Counter | None = None
+    functions: list[FunctionStats] = field(default_factory=list)
+
+
+def count_nodes(root) -> collections.Counter:
+    """Number of distinct IR nodes reachable from `root`, by class name."""
+    counts: collections.Counter = collections.Counter()
+    seen = set()
+    stack = [root]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, ir.Node):
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+            counts[type(value).__name__] += 1
+            stack.extend(getattr(value, name, None) for name in value)
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+    return counts
+
+
+class PassManager:
+    """Runs passes over a module and records the statistics of each one in `passes`."""
+
+    def __init__(self, memory=False, nodes=False, functions=False, verbose=True, dump=None, verify=__debug__):
+        self.memory = memory
+        self.nodes = nodes
+        self.functions = functions
+        self.verbose = verbose
+        # `compiler.dump.Dump` writing the module after the passes it selects, if any
+        self.dump = dump
+        # `compiler.verify.Verifier` checking the module after the passes, a default one if `True`
+        self.verify = Verifier() if verify is True else verify or None
+        self.passes: list[PassStats] = []
+        self._origin = time.perf_counter()
+        self._current: PassStats | None = None
+        self._nodes: collections.Counter | None = None
+
+    def run_ast_pass(self, pass_, prog, module: ir.Module) -> ir.Module:
+        """Run the top-level pass `pass_(prog, module)`, which fills in `module`."""
+        self._record(pass_, lambda: pass_(prog, module), module)
+        return module
+
+    def run_pass(self, pass_, module: ir.Module) -> ir.Module:
+        return self._record(pass_, lambda: pass_(module), module)
+
+    def _record(self, pass_, run, module):
+        name = getattr(pass_, "__name__", type(pass_).__name__)
+        if self.verbose:
+            print("Pass:", name)
+
+        stats = PassStats(name, time.perf_counter() - self._origin)
+        if self.nodes:
+            stats.nodes_before = self._nodes if self._nodes is not None else count_nodes(module)
+
+        tracing = tracemalloc.is_tracing()
+        if self.memory:
+            if not tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+
+        self._current = stats
+        if self.functions:
+            traverse_ir.function_timer = self
+        start = time.perf_counter()
+        try:
+            result = run()
+        finally:
+            stats.seconds = time.perf_counter() - start
+            traverse_ir.function_timer = None
+            self._current = None
+            if self.memory:
+                stats.peak_memory = tracemalloc.get_traced_memory()[1] - before
+                if not tracing:
+                    tracemalloc.stop()
+            self.passes.append(stats)
+
+        if result is not None:
+            module = result
+        if self.nodes:
+            self._nodes = stats.nodes_after = count_nodes(module)
+        if self.dump is not None:
+            self.dump.write(len(self.passes) - 1, name, module)
+        if self.verify is not None and isinstance(module, ir.Module):
+            self.verify.after(name, module)
+        return result
+
+    def function(self, name, func, node, *args, **kwargs):
+        """Call `func(node, ...)` for the function definition `name`, recording its time in the current pass."""
+        start = time.perf_counter()
+        try:
+            return func(node, *args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            self._current.functions.append(FunctionStats(name, start - self._origin, end - start))
+
+    def report(self):
+        width = max([len("pass")] + [len(p.name) for p in self.passes])
+        lines = [f"{'pass':<{width}} {'time':>10} {'peak MiB':>10} {'nodes':>8} {'delta':>8}"]
+        for p in self.passes:
+            peak = f"{p.peak_memory / 2**20:>10.2f}" if p.peak_memory is not None else f"{'-':>10}"
+            if p.nodes_after is not None:
+                after = sum(p.nodes_after.values())
+                nodes = f"{after:>8} {after - sum(p.nodes_before.values()):>+8}"
+            else:
+                nodes = f"{'-':>8} {'-':>8}"
+            lines.append(f"{p.name:<{width}} {p.seconds * 1000:>8.2f}ms {peak} {nodes}")
+        lines.append(f"{'total':<{width}} {sum(p.seconds for p in self.passes) * 1000:>8.2f}ms")
+        return "\n".join(lines)
+
+    def trace_events(self):
+        """Chrome trace events of the passes and the functions visited by each pass."""
+        events = []
+        for p in self.passes:
+            args = {}
+            if p.peak_memory is not None:
+                args["peak_memory"] = p.peak_memory
+            if p.nodes_after is not None:
+                args["nodes_before"] = sum(p.nodes_before.values())
+                args["nodes_after"] = sum(p.nodes_after.values())
+            events.append(_complete_event(p.name, "pass", p.start, p.seconds, args))
+            for f in p.functions:
+                events.append(_complete_event(f.name, "function", f.start, f.seconds, {"pass": p.name}))
+        return events
+
+    def write_trace(self, filename):
+        with open(filename, "w", encoding="utf8") as f:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, f)
+
+
+def _complete_event(name, category, start, seconds, args):
+    return {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": start * 1e6,
+        "dur": seconds * 1e6,
+        "pid": 0,
+        "tid": 0,
+        "args": args,
+    }
@@ -1,20 +1,11 @@
 from compiler import ast
 from compiler import ir
+from compiler import span
 from compiler import traverse_ast
 from compiler import traverse_ir
+from compiler import worklist
 from compiler import eval_wasm
-
-
-def write_tree(filename):
-    import pprint
-
-    def write(node: ir.Node):
-        with open(filename, "w") as f:
-            pprint.pprint(node, stream=f)
-
-        return node
-
-    return write
+from compiler.pass_manager import PassManager
 
 
 def register_toplevel_decls(node: ast.Node, module: ir.Module):
@@ -171,17 +162,29 @@ def check_disallowed_toplevel_decls(node: ast.Node, module: ir.Module):
     assert len(node.stmts) == 0, f"{type(node.stmts[0]).__name__} not allowed as a top level declaration"
 
 
-def translate_toplevel_type_decls(node: ir.Node, scope=None) -> ir.Node:
-    match node:
-        case ir.Module():
-            node.scope.attrs = traverse_ir.traverse_dict(translate_toplevel_type_decls, node.scope.attrs, node.scope)
+def _skip_ast_macro(node: ir.Node, *args) -> ir.Node:
+    # Macros operating on the AST are not translated
+    return node
+
 
-        case ir.UntranslatedType(ast_node=ast.NativeArrayType() as ast_node):
+translate_toplevel_type_decls = traverse_ir.Visitor("translate_toplevel_type_decls")
+
+
+@translate_toplevel_type_decls.register(ir.Module)
+def _translate_module_types(node: ir.Module, scope=None) -> ir.Node:
+    node.scope.attrs = traverse_ir.traverse_dict(translate_toplevel_type_decls, node.scope.attrs, node.scope)
+    return node
+
+
+@translate_toplevel_type_decls.register(ir.UntranslatedType)
+def _translate_type(node: ir.UntranslatedType, scope=None) -> ir.Node:
+    match node.ast_node:
+        case ast.NativeArrayType() as ast_node:
             tr_type = translate_toplevel_type_decls(ir.UntranslatedType(ast_node.element_type), scope)
             assert isinstance(tr_type, ir.Type)
             return ir.NativeArrayType(ast_node.info, tr_type)
 
-        case ir.UntranslatedType(ast_node=ast.TupleType() as ast_node):
+        case ast.TupleType() as ast_node:
             if not ast_node.field_types:
                 return ir.VoidType(ast_node.info)
 
@@ -204,7 +207,7 @@ def translate_toplevel_type_decls(node: ir.Node, scope=None) -> ir.Node:
             else:
                 return ir.TupleType(ast_node.info, field_types)
 
-        case ir.UntranslatedType(ast_node=ast.TypeIdentifier() | ast.Identifier() as ast_node):
+        case ast.TypeIdentifier() | ast.Identifier() as ast_node:
             type_: ir.Type = scope.lookup(ast_node.name)
             match type_:
                 case ir.TypeDef():
@@ -216,21 +219,21 @@ def translate_toplevel_type_decls(node: ir.Node, scope=None) -> ir.Node:
                 case _:
                     raise NotImplementedError(type(type_))
 
-        case ir.UntranslatedType(ast_node=ast.GetAttr(obj=ast.TypeIdentifier() as obj, attr=str()) as ast_node):
+        case ast.GetAttr(obj=ast.TypeIdentifier() as obj, attr=str()) as ast_node:
             type_ = scope.lookup(obj.name)
             assert isinstance(type_, ir.TypeDef)
             member = type_.scope.attrs[ast_node.attr]
             assert isinstance(member, ir.TypeDef)
             return ir.TypeRef(ast_node.info, member)
 
-        case ir.UntranslatedType(ast_node=ast.GetItem() as template_inst):
+        case ast.GetItem() as template_inst:
             template = translate_toplevel_type_decls(ir.UntranslatedType(template_inst.expr), scope)
             arg = translate_toplevel_type_decls(ir.UntranslatedType(template_inst.idx), scope)
             assert isinstance(template, ir.TemplateRef)
             assert isinstance(arg, (ir.TypeRef, ir.TemplateArgRef))
             return ir.TemplateInst(node.info, template, [arg])
 
-        case ir.UntranslatedType(ast_node=ast.TemplateInst() as ast_node):
+        case ast.TemplateInst() as ast_node:
             assert isinstance(ast_node.name, ast.TypeIdentifier)
             template = scope.lookup(ast_node.name.name)
             assert isinstance(template, ir.TemplateDef)
@@ -249,70 +252,56 @@ def translate_toplevel_type_decls(node: ir.Node, scope=None) -> ir.Node:
                 args.append(arg)
             return ir.TemplateInst(ast_node.info, ir.TemplateRef(None, template), args)
 
-        case ir.UntranslatedType(ast_node=ast.ArrayType() as ast_node):
+        case ast.ArrayType() as ast_node:
             array = ir.TemplateRef(ast_node.info, scope.root.attrs["__array"])
             elem_type = translate_toplevel_type_decls(ir.UntranslatedType(ast_node.element_type), scope)
             assert isinstance(elem_type, ir.Type)
             return ir.TemplateInst(ast_node.info, array, [elem_type])
 
-        case ir.UntranslatedType():
+        case _:
             return node.translate(scope)
 
-        # case ir.TypeRef():
-        #     pass
 
-        case ir.TypeDef():
-            return traverse_ir.traverse(translate_toplevel_type_decls, node, node.scope)
+@translate_toplevel_type_decls.register(ir.TypeDef, ir.TemplateDef)
+def _translate_type_def(node: ir.TypeDef | ir.TemplateDef, scope=None) -> ir.Node:
+    return translate_toplevel_type_decls.traverse(node, node.scope)
 
-        case ir.TemplateDef():
-            return traverse_ir.traverse(translate_toplevel_type_decls, node, node.scope)
 
-        case ir.FunctionDef():
-            tr_type = translate_toplevel_type_decls(node.type_, scope)
-            assert isinstance(tr_type, ir.FunctionType)
-            node.type_ = tr_type
+@translate_toplevel_type_decls.register(ir.FunctionDef)
+def _translate_function_type(node: ir.FunctionDef, scope=None) -> ir.Node:
+    tr_type = translate_toplevel_type_decls(node.type_, scope)
+    assert isinstance(tr_type, ir.FunctionType)
+    node.type_ = tr_type
+    return node
 
-        case ir.AstMacroDef():
-            return node
 
-        case _:
-            return traverse_ir.traverse(translate_toplevel_type_decls, node, scope)
-    return node
+translate_toplevel_type_decls.register(ir.AstMacroDef)(_skip_ast_macro)
 
 
-def check_no_untranslated_types(node: ir.Node) -> ir.Node:
-    match node:
-        case ir.UntranslatedType():
-            raise Exception(f"Untranslated type: {node}")
-        case _:
-            return traverse_ir.traverse(check_no_untranslated_types, node)
-    return node
+translate_function_defs = traverse_ir.Visitor("translate_function_defs")
 
 
-def translate_function_defs(node: ir.Node, scope=None) -> ir.Node:
-    match node:
-        # case ir.Module():
-        #     for attr in list(node.scope.attrs.values()):
-        #         translate_function_defs(attr)
-        #     node.asm = traverse_ir.traverse_list(translate_function_defs, node.asm)
-        #     return node
-
-        case ir.FunctionDef():
-            for arg in node.type_.args:
-                node.scope.add_method(arg.name, ir.ArgRef(None, arg))
-
-            node.scope = traverse_ir.traverse(translate_function_defs, node.scope, node.scope)
-
-            if node.type_.args and node.type_.args[0].name == "self":
-                self_type = scope.lookup("Self")
-                if isinstance(node.type_.args[0].type_, ir.UnknownType):
-                    node.type_.args[0].type_ = self_type
-                else:
-                    assert node.type_.args[0].type_ == self_type, "Self type mismatch"
+@translate_function_defs.register(ir.FunctionDef)
+def _translate_function_def(node: ir.FunctionDef, scope=None) -> ir.Node:
+    for arg in node.type_.args:
+        node.scope.add_method(arg.name, ir.ArgRef(None, arg))
 
-            return node
+    node.scope = translate_function_defs.traverse(node.scope, node.scope)
+
+    if node.type_.args and node.type_.args[0].name == "self":
+        self_type = scope.lookup("Self")
+        if isinstance(node.type_.args[0].type_, ir.UnknownType):
+            node.type_.args[0].type_ = self_type
+        else:
+            assert node.type_.args[0].type_ == self_type, "Self type mismatch"
 
-        case ir.Untranslated(ast_node=ast.VarDecl() as var):
+    return node
+
+
+@translate_function_defs.register(ir.Untranslated)
+def _translate_untranslated(node: ir.Untranslated, scope=None) -> ir.Node:
+    match node.ast_node:
+        case ast.VarDecl() as var:
             var_type = translate_toplevel_type_decls(
                 ir.UntranslatedType(var.type_) if var.type_ else ir.UnknownType(), scope
             )
@@ -325,7 +314,7 @@ def translate_function_defs(node: ir.Node, scope=None) -> ir.Node:
             else:
                 return ir.VoidExpr(var.info)
 
-        case ir.Untranslated(ast_node=ast.Identifier() | ast.TypeIdentifier() as id):
+        case ast.Identifier() | ast.TypeIdentifier() as id:
             attr = scope.lookup(id.name)
             if isinstance(id, ast.TypeIdentifier):
                 assert isinstance(attr, ir.Type)
@@ -358,7 +347,7 @@ def translate_function_defs(node: ir.Node, scope=None) -> ir.Node:
                 case _:
                     raise NotImplementedError(type(attr))
 
-        case ir.Untranslated(ast_node=ast.TupleExpr() as ast_node):
+        case ast.TupleExpr() as ast_node:
             if len(ast_node.field_values) == 1:
                 return translate_function_defs(ir.Untranslated(ast_node.field_values[0]), scope)
             else:
@@ -370,20 +359,20 @@ def translate_function_defs(node: ir.Node, scope=None) -> ir.Node:
                 else:
                     return ir.TupleExpr(ast_node.info, ir.UnknownType(), fields)
 
-        case ir.Untranslated(ast_node=ast.While() as while_stmt):
+        case ast.While() as while_stmt:
             pre_condition = ir.Untranslated(while_stmt.condition)
             loop_scope = ir.Scope(scope, "__while", body=[ir.Untranslated(stmt) for stmt in while_stmt.body])
             loop_scope.break_scope = loop_scope.name  # FIXME: declare properly
             loop = ir.Loop(while_stmt.info, pre_condition, loop_scope)
             return translate_function_defs(loop, loop_scope)
 
-        case ir.Untranslated(ast_node=ast.Break() as break_stmt):
+        case ast.Break() as break_stmt:
             return ir.Break(break_stmt.info, scope.break_scope + ".__block", ir.VoidExpr(None))
 
-        case ir.Untranslated(ast_node=ast.Continue() as break_stmt):
+        case ast.Continue() as break_stmt:
             return ir.Continue(break_stmt.info, scope.break_scope + ".__loop")
 
-        case ir.Untranslated(ast_node=ast.GetItem() as ast_node):
+        case ast.GetItem() as ast_node:
             expr = translate_function_defs(ir.Untranslated(ast_node.expr), scope)
             idx = translate_function_defs(ir.Untranslated(ast_node.idx), scope)
             match expr:
@@ -404,7 +393,7 @@ def translate_function_defs(node: ir.Node, scope=None) -> ir.Node:
                 case _:
                     raise NotImplementedError(type(expr))
 
-        case ir.Untranslated(ast_node=ast.BinOp() as ast_node):
+        case ast.BinOp() as ast_node:
             func = scope.module_scope.lookup(f"({ast_node.op})")
             assert isinstance(func, (ir.FunctionDef, ir.MacroDef, ir.OverloadedFunction, ir.FunctionRef, ir.MacroRef))
             func = func.ref()
@@ -414,10 +403,10 @@ def translate_function_defs(node: ir.Node, scope=None) -> ir.Node:
             assert isinstance(rhs, ir.Expr)
             return ir.Call(ast_node.info, func, ir.TupleExpr(None, ir.UnknownType(), [lhs, rhs]))
 
-        case ir.Untranslated(ast_node=ast.UnaryL(op="-", arg=ast.IntLiteral() as value)):
+        case ast.UnaryL(op="-", arg=ast.IntLiteral() as value):
             return ir.IntLiteral(value, -value.value)
 
-        case ir.Untranslated(ast_node=ast.UnaryL() | ast.UnaryR() as ast_node):
+        case ast.UnaryL() | ast.UnaryR() as ast_node:
             func = scope.lookup(f"({ast_node.op})")
             assert isinstance(func, (ir.FunctionDef, ir.MacroDef, ir.OverloadedFunction))
             func = func.ref()
@@ -425,14 +414,14 @@ def translate_function_defs(node: ir.Node, scope=None) -> ir.Node:
             assert isinstance(tr_arg, ir.Expr)
             return ir.Call(ast_node, func, ir.TupleExpr(None, ir.UnknownType(), [tr_arg]))
 
-        case ir.Untranslated(ast_node=ast.Call(callee=ast.Identifier("__reinterpret_cast"), arg=arg)):
+        case ast.Call(callee=ast.Identifier("__reinterpret_cast"), arg=arg):
             return ir.ReinterpretCast(
                 node.info,
                 ir.UnknownType(),
                 translate_function_defs(ir.Untranslated(arg), scope),  # type:ignore[arg-type]
             )
 
-        case ir.Untranslated(ast_node=ast.Assignment(lvalue=ast.GetItem() as getter) as assign):
+        case ast.Assignment(lvalue=ast.GetItem() as getter) as assign:
             lvalue = translate_function_defs(ir.Untranslated(getter.expr), scope)
             idx = translate_function_defs(ir.Untranslated(getter.idx), scope)
             assign_value = translate_function_defs(ir.Untranslated(assign.expr), scope)
@@ -441,27 +430,26 @@ def translate_function_defs(node: ir.Node, scope=None) -> ir.Node:
             assert isinstance(assign_value, ir.Expr)
             return ir.SetItem(assign.info, lvalue, idx, assign_value)
 
-        case ir.Scope():
-            node.attrs = traverse_ir.traverse_dict(translate_function_defs, node.attrs, node)
-            node.body = traverse_ir.traverse_list(translate_function_defs, node.body, node)
-            return node
+        case _:
+            return translate_function_defs(node.translate(scope), scope)
 
-        case ir.MatchCaseEnum():
-            node.enum = translate_function_defs(node.enum, scope)
-            node.args = traverse_ir.traverse_list(_translate_match_pattern, node.args, node.scope)
-            node.scope = translate_function_defs(node.scope, scope)  # type:ignore[assignment]
-            return node
 
-        case ir.Untranslated():
-            return translate_function_defs(node.translate(scope), scope)
+@translate_function_defs.register(ir.Scope)
+def _translate_scope(node: ir.Scope, scope=None) -> ir.Node:
+    node.attrs = traverse_ir.traverse_dict(translate_function_defs, node.attrs, node)
+    node.body = traverse_ir.traverse_list(translate_function_defs, node.body, node)
+    return node
 
-        case ir.AstMacroDef():
-            return node
 
-        case _:
-            return traverse_ir.traverse(translate_function_defs, node, scope)
+@translate_function_defs.register(ir.MatchCaseEnum)
+def _translate_match_case_enum(node: ir.MatchCaseEnum, scope=None) -> ir.Node:
+    node.enum = translate_function_defs(node.enum, scope)
+    node.args = traverse_ir.traverse_list(_translate_match_pattern, node.args, node.scope)
+    node.scope = translate_function_defs(node.scope, scope)  # type:ignore[assignment]
+    return node
 
-    raise NotImplementedError(type(node))
+
+translate_function_defs.register(ir.AstMacroDef)(_skip_ast_macro)
 
 
 def _translate_match_pattern(node: ir.Node, scope) -> ir.Node:
@@ -493,601 +481,698 @@ def _expand_call_args(arg: ir.Node) -> list:
             return [arg]
 
 
-def resolve_member_access(node: ir.Node, scope=None) -> ir.Node:
-    node = traverse_ir.traverse_scoped(resolve_member_access, node, scope)
+resolve_member_access = traverse_ir.Visitor("resolve_member_access", scoped=True)
 
-    match node:
-        case ir.GetAttr():
-            try:
-                idx = int(node.attr)
-            except ValueError:
-                idx = None
 
-            if idx is not None:
-                assert isinstance(node.expr, ir.Expr)
+@resolve_member_access.register(ir.GetAttr)
+def _resolve_get_attr(node: ir.GetAttr, scope=None) -> ir.Node:
+    node = resolve_member_access.traverse(node, scope)
 
-                if isinstance(node.expr.type_, ir.UnknownType):
-                    return node
+    try:
+        idx = int(node.attr)
+    except ValueError:
+        idx = None
 
-                assert isinstance(node.expr.type_, ir.TypeRef)
-                match node.expr.type_.primitive():
-                    case ir.EnumValueType() as enum:
-                        return ir.GetTupleItem(node.info, enum.field_types[idx], node.expr, idx + 1)
+    if idx is not None:
+        assert isinstance(node.expr, ir.Expr)
 
-                    case ir.TupleType() as tuple_:
-                        field_type = tuple_.field_types[idx]
-                        assert isinstance(field_type, ir.TypeRef), field_type
-                        return ir.GetTupleItem(node.info, field_type, node.expr, idx)
+        if isinstance(node.expr.type_, ir.UnknownType):
+            return node
 
-                    case primitive:
-                        raise NotImplementedError(type(primitive))
+        assert isinstance(node.expr.type_, ir.TypeRef)
+        match node.expr.type_.primitive():
+            case ir.EnumValueType() as enum:
+                return ir.GetTupleItem(node.info, enum.field_types[idx], node.expr, idx + 1)
 
-            match node.expr:
-                case ir.TemplateArgRef():
-                    # FIXME: translate/annotate templated methods
-                    return node
+            case ir.TupleType() as tuple_:
+                field_type = tuple_.field_types[idx]
+                assert isinstance(field_type, ir.TypeRef), field_type
+                return ir.GetTupleItem(node.info, field_type, node.expr, idx)
 
-                case ir.TypeRef():
-                    match node.expr.type_:
-                        case ir.TypeDef():
-                            if node.attr == "__type_reference":
-                                return node.expr.type_.get_type_reference()
-                            elif node.attr == "__default":
-                                match node.expr.type_.primitive():
-                                    case ir.IntegralType() as integral:
-                                        return ir.Asm(
-                                            node.info,
-                                            ir.WasmExpr(node.info, [f"{integral.native_type}.const 0"]),
-                                            node.expr,
-                                        )
-                                    case ir.TupleType() | ir.NativeArrayType() | ir.EnumType():
-                                        return ir.Asm(
-                                            node.info,
-                                            ir.WasmExpr(node.info, [["ref.null", f"${node.expr.name}"]]),
-                                            node.expr,
-                                        )
-                                    case other:
-                                        raise NotImplementedError(type(other))
-
-                            try:
-                                attr = node.expr.type_.get_attr(node.attr)
-                            except KeyError as e:
-                                raise KeyError(
-                                    f"Type '{node.expr.type_.name}' has no member '{node.attr}'",
-                                ) from e
-
-                            match attr:
-                                case ir.TypeRef() | ir.AsmType() | ir.EnumInt():
-                                    return attr
-                                case ir.FunctionDef():
-                                    if (
-                                        isinstance(node.expr.primitive(), ir.EnumValueType)
-                                        and attr.type_.args[0].name == "self"
-                                    ):
-                                        return ir.BoundMethod(
-                                            node.info,
-                                            ir.UnknownType(),
-                                            ir.FunctionRef(None, attr),
-                                            ir.EnumInst(node.expr.info, node.expr, node.expr.primitive().discr, []),
-                                        )
-                                    else:
-                                        return ir.FunctionRef(node.info, attr)
-                                case ir.EnumValueType():
-                                    return ir.TypeRef(None, attr)
-                                case ir.MacroDef():
-                                    return ir.MacroRef(None, attr)
-                                case ir.ConstDecl():
-                                    return ir.ConstRef(None, attr)
-                                case _:
-                                    raise NotImplementedError(type(attr))
-                        case _:
-                            raise NotImplementedError(type(node.expr.type_))
+            case primitive:
+                raise NotImplementedError(type(primitive))
 
-                case ir.StringLiteral():
-                    match node.attr:
-                        case "__len":
-                            return ir.IntLiteral(node.info, len(node.expr.value))
-                        case "__int_le":
-                            return ir.IntLiteral(node.info, int.from_bytes(node.expr.value.encode(), "little"))
-                        case _:
-                            raise NotImplementedError(node.attr)
+    match node.expr:
+        case ir.TemplateArgRef():
+            # FIXME: translate/annotate templated methods
+            return node
 
-                case ir.Expr():
-                    match node.expr.type_:
-                        case ir.TypeRef():
-                            obj_type_prim = node.expr.type_.primitive()
-                            if isinstance(obj_type_prim, ir.NamedTupleType) and node.attr in obj_type_prim.field_names:
-                                field = obj_type_prim.field_names.index(node.attr)
-                                return ir.GetTupleItem(node.info, obj_type_prim.field_types[field], node.expr, field)
-                            elif isinstance(node.expr.type_.type_, ir.TypeDef):
-                                method = node.expr.type_.get_attr(node.attr)
-                                assert isinstance(method, ir.FunctionDef)
-                                if method.type_.args[0].name == "self":
-                                    return ir.BoundMethod(
-                                        node.info, ir.UnknownType(), ir.FunctionRef(None, method), node.expr
-                                    )
-                                else:
-                                    raise RuntimeError("Calling static method from object")
-                                    # return method
+        case ir.TypeRef():
+            match node.expr.type_:
+                case ir.TypeDef():
+                    if node.attr == "__type_reference":
+                        return node.expr.type_.get_type_reference()
+                    elif node.attr == "__default":
+                        match node.expr.type_.primitive():
+                            case ir.IntegralType() as integral:
+                                return ir.Asm(
+                                    node.info,
+                                    ir.WasmExpr(node.info, [f"{integral.native_type}.const 0"]),
+                                    node.expr,
+                                )
+                            case ir.TupleType() | ir.NativeArrayType() | ir.EnumType():
+                                return ir.Asm(
+                                    node.info,
+                                    ir.WasmExpr(node.info, [["ref.null", f"${node.expr.name}"]]),
+                                    node.expr,
+                                )
+                            case other:
+                                raise NotImplementedError(type(other))
+
+                    try:
+                        attr = node.expr.type_.get_attr(node.attr)
+                    except KeyError as e:
+                        raise KeyError(
+                            f"{span.format(node.info)}: Type '{node.expr.type_.name}' has no member '{node.attr}'",
+                        ) from e
+
+                    match attr:
+                        case ir.TypeRef() | ir.AsmType() | ir.EnumInt():
+                            return attr
+                        case ir.FunctionDef():
+                            if (
+                                isinstance(node.expr.primitive(), ir.EnumValueType)
+                                and attr.type_.args[0].name == "self"
+                            ):
+                                return ir.BoundMethod(
+                                    node.info,
+                                    ir.UnknownType(),
+                                    ir.FunctionRef(None, attr),
+                                    ir.EnumInst(node.expr.info, node.expr, node.expr.primitive().discr, []),
+                                )
                             else:
-                                raise NotImplementedError
+                                return ir.FunctionRef(node.info, attr)
+                        case ir.EnumValueType():
+                            return ir.TypeRef(None, attr)
+                        case ir.MacroDef():
+                            return ir.MacroRef(None, attr)
+                        case ir.ConstDecl():
+                            return ir.ConstRef(None, attr)
+                        case _:
+                            raise NotImplementedError(type(attr))
+                case _:
+                    raise NotImplementedError(type(node.expr.type_))
+
+        case ir.StringLiteral():
+            match node.attr:
+                case "__len":
+                    return ir.IntLiteral(node.info, len(node.expr.value))
+                case "__int_le":
+                    return ir.IntLiteral(node.info, int.from_bytes(node.expr.value.encode(), "little"))
+                case _:
+                    raise NotImplementedError(node.attr)
 
-                        case ir.BuiltinType(name="__str"):
-                            match node.attr:
-                                case "__len" | "__int_le":
-                                    node.type_ = ir.BuiltinType("__int")
-                                case _:
-                                    raise NotImplementedError
+        case ir.Expr():
+            match node.expr.type_:
+                case ir.TypeRef():
+                    obj_type_prim = node.expr.type_.primitive()
+                    if isinstance(obj_type_prim, ir.NamedTupleType) and node.attr in obj_type_prim.field_names:
+                        field = obj_type_prim.field_names.index(node.attr)
+                        return ir.GetTupleItem(node.info, obj_type_prim.field_types[field], node.expr, field)
+                    elif isinstance(node.expr.type_.type_, ir.TypeDef):
+                        method = node.expr.type_.get_attr(node.attr)
+                        assert isinstance(method, ir.FunctionDef)
+                        if method.type_.args[0].name == "self":
+                            return ir.BoundMethod(
+                                node.info, ir.UnknownType(), ir.FunctionRef(None, method), node.expr
+                            )
+                        else:
+                            raise RuntimeError("Calling static method from object")
+                            # return method
+                    else:
+                        raise NotImplementedError
 
+                case ir.BuiltinType(name="__str"):
+                    match node.attr:
+                        case "__len" | "__int_le":
+                            node.type_ = ir.BuiltinType("__int")
                         case _:
-                            return node
+                            raise NotImplementedError
 
-                case ir.SelfType() | ir.TemplateInst():
+                case _:
                     return node
 
-                case _:
-                    # TODO
+        case ir.SelfType() | ir.TemplateInst():
+            return node
+
+        case _:
+            # TODO
+            breakpoint()
+            return node
+            raise NotImplementedError(type(node.obj))
+
+    return node
+
+
+@resolve_member_access.register(ir.GetItem)
+def _resolve_get_item(node: ir.GetItem, scope=None) -> ir.Node:
+    node = resolve_member_access.traverse(node, scope)
+
+    match node.expr.type_.primitive():
+        case ir.NativeArrayType() as array_primitive:
+            return ir.GetNativeArrayItem(node.info, array_primitive.element_type, node.expr, node.idx)
+
+        case ir.TemplateInst() | ir.UnknownType() | ir.SelfType():
+            return node
+
+        case _:
+            assert isinstance(node.expr.type_, ir.TypeRef)
+            assert isinstance(node.expr.type_.type_, ir.TypeDef)
+            if "[]" in node.expr.type_.type_.scope.attrs:
+                method = node.expr.type_.type_.scope.attrs["[]"]
+                if isinstance(method, ir.OverloadedFunction):
                     breakpoint()
-                    return node
-                    raise NotImplementedError(type(node.obj))
+                assert isinstance(method, (ir.FunctionDef, ir.MacroDef))
+                method = ir.BoundMethod(node.info, ir.UnknownType(), method.ref(), node.expr)
+                call = ir.Call(node.info, method, node.idx)
+                return resolve_member_access(call, scope)
 
-        case ir.GetItem():
-            match node.expr.type_.primitive():
-                case ir.NativeArrayType() as array_primitive:
-                    return ir.GetNativeArrayItem(node.info, array_primitive.element_type, node.expr, node.idx)
+    return node
 
-                case ir.TemplateInst() | ir.UnknownType() | ir.SelfType():
-                    return node
 
-                case _:
-                    assert isinstance(node.expr.type_, ir.TypeRef)
-                    assert isinstance(node.expr.type_.type_, ir.TypeDef)
-                    if "[]" in node.expr.type_.type_.scope.attrs:
-                        method = node.expr.type_.type_.scope.attrs["[]"]
-                        if isinstance(method, ir.OverloadedFunction):
-                            breakpoint()
-                        assert isinstance(method, (ir.FunctionDef, ir.MacroDef))
-                        method = ir.BoundMethod(node.info, ir.UnknownType(), method.ref(), node.expr)
-                        call = ir.Call(node.info, method, node.idx)
-                        return resolve_member_access(call, scope)
-
-        case ir.SetItem():
-            match node.lvalue.type_.primitive():
-                case ir.NativeArrayType():
-                    return ir.SetNativeArrayItem(node.info, node.lvalue, node.idx, node.value)
-
-                case ir.TemplateInst() | ir.UnknownType():
-                    return node
+@resolve_member_access.register(ir.SetItem)
+def _resolve_set_item(node: ir.SetItem, scope=None) -> ir.Node:
+    node = resolve_member_access.traverse(node, scope)
 
-                case _:
-                    assert isinstance(node.lvalue.type_, ir.TypeRef)
-                    assert isinstance(node.lvalue.type_.type_, ir.TypeDef)
-                    if "[]=" in node.lvalue.type_.type_.scope.attrs:
-                        method = node.lvalue.type_.type_.scope.attrs["[]="]
-                        if isinstance(method, ir.OverloadedFunction):
-                            breakpoint()
-                        assert isinstance(method, (ir.FunctionDef, ir.MacroDef))
-                        method = ir.BoundMethod(node.info, ir.UnknownType(), method.ref(), node.lvalue)
-                        call = ir.Call(node.info, method, ir.TupleExpr(None, ir.UnknownType(), [node.idx, node.value]))
-                        return resolve_member_access(call, scope)
-                    pass
-
-        case ir.Assignment():
-            assert isinstance(node.expr, ir.Expr)
-            match node.lvalue:
-
-                case ir.VarRef() | ir.ArgRef():
-                    return ir.SetLocal(node.info, node.lvalue, node.expr)
-
-                case ir.GetAttr():
-                    return node
+    match node.lvalue.type_.primitive():
+        case ir.NativeArrayType():
+            return ir.SetNativeArrayItem(node.info, node.lvalue, node.idx, node.value)
 
-                case ir.GetTupleItem():
-                    return ir.SetTupleItem(node.info, node.lvalue.expr, node.lvalue.idx, node.expr)
+        case ir.TemplateInst() | ir.UnknownType():
+            return node
 
-                case _:
-                    raise NotImplementedError(type(node.lvalue))
-
-        case ir.Call():
-            match node.callee:
-                case ir.FunctionRef():
-                    return ir.FunctionCall(
-                        node.info,
-                        node.callee.func.type_.ret_type,
-                        node.callee,
-                        _expand_call_args(node.arg),
-                    )
+        case _:
+            assert isinstance(node.lvalue.type_, ir.TypeRef)
+            assert isinstance(node.lvalue.type_.type_, ir.TypeDef)
+            if "[]=" in node.lvalue.type_.type_.scope.attrs:
+                method = node.lvalue.type_.type_.scope.attrs["[]="]
+                if isinstance(method, ir.OverloadedFunction):
+                    breakpoint()
+                assert isinstance(method, (ir.FunctionDef, ir.MacroDef))
+                method = ir.BoundMethod(node.info, ir.UnknownType(), method.ref(), node.lvalue)
+                call = ir.Call(node.info, method, ir.TupleExpr(None, ir.UnknownType(), [node.idx, node.value]))
+                return resolve_member_access(call, scope)
+            pass
 
-                case ir.BoundMethod():
-                    return ir.FunctionCall(
-                        node.info,
-                        node.callee.func.func.type_.ret_type,
-                        node.callee.func,
-                        [node.callee.obj] + _expand_call_args(node.arg),
-                    )
+    return node
 
-                case ir.TypeRef():
-                    match node.callee.primitive():
-                        case ir.EnumValueType() as enum_val:
-                            args: list = _expand_call_args(node.arg)
-                            assert all(isinstance(arg, ir.Expr) for arg in args)
-                            return ir.EnumInst(node.info, node.callee, enum_val.discr, args)
-
-                        case ir.TupleType():
-                            match node.arg:
-                                case ir.TupleExpr():
-                                    return ir.TupleInst(node.info, node.callee, node.arg.args)
-                                case _:
-                                    assert isinstance(node.arg, ir.Expr)
-                                    return ir.Cast(node.info, node.callee, node.arg)
-
-                        case ir.TypeDef() | ir.IntegralType():
-                            args = _expand_call_args(node.arg)
-                            assert len(args) == 1
-                            assert isinstance(args[0], ir.Expr)
-                            return ir.Cast(node.info, node.callee, args[0])
 
-                        case _:
-                            raise NotImplementedError(node.callee)
+@resolve_member_access.register(ir.Assignment)
+def _resolve_assignment(node: ir.Assignment, scope=None) -> ir.Node:
+    node = resolve_member_access.traverse(node, scope)
 
-                case ir.MacroRef():
-                    return ir.MacroInst(
-                        node.info, node.callee.macro.func.type_.ret_type, node.callee, _expand_call_args(node.arg)
-                    )
+    assert isinstance(node.expr, ir.Expr)
+    match node.lvalue:
 
-                case ir.GetAttr() | ir.SelfType() | ir.TemplateInst():
-                    return node
+        case ir.VarRef() | ir.ArgRef():
+            return ir.SetLocal(node.info, node.lvalue, node.expr)
 
-                case ir.OverloadedFunction():
-                    assert isinstance(node.arg, ir.TupleExpr)
-                    call_args: list = node.arg.args
-                    arg_types = [arg.type_ for arg in call_args]
-                    matches: list[ir.FunctionRef | ir.MacroRef] = []
-                    for method in node.callee.overloads:
-                        assert isinstance(method, ir.FunctionRef)
-                        method_arg_types = [arg.type_ for arg in method.func.type_.args]
-                        comp = [t1.has_base_class(t2) for t1, t2 in zip(arg_types, method_arg_types)]
+        case ir.GetAttr():
+            return node
 
-                        if all(comp):
-                            return ir.FunctionCall(node.info, method.func.type_.ret_type, method, call_args)
+        case ir.GetTupleItem():
+            return ir.SetTupleItem(node.info, node.lvalue.expr, node.lvalue.idx, node.expr)
 
-                        if any(comp):
-                            matches.append(method)
+        case _:
+            raise NotImplementedError(type(node.lvalue))
 
-                    if not matches:
-                        if any(isinstance(arg_type, ir.UnknownType) for arg_type in arg_types):
-                            # Possibly before template substitution
-                            return node
 
-                        raise TypeError(
-                            f"No matching overload for function '{node.callee.name}' with argument types {arg_types}"
-                        )
+@resolve_member_access.register(ir.Call)
+def _resolve_call(node: ir.Call, scope=None) -> ir.Node:
+    node = resolve_member_access.traverse(node, scope)
 
-                    elif len(matches) == 1:
-                        method = matches[0]
-                        assert isinstance(method, ir.FunctionRef)
-                        return ir.FunctionCall(node.info, method.func.type_.ret_type, method, call_args)
+    match node.callee:
+        case ir.FunctionRef():
+            return ir.FunctionCall(
+                node.info,
+                node.callee.func.type_.ret_type,
+                node.callee,
+                _expand_call_args(node.arg),
+            )
 
-                    else:
-                        overloads = ir.OverloadedFunction(node.info, node.callee.name, matches)
-                        return ir.Call(node.info, overloads, node.arg, node.type_)
+        case ir.BoundMethod():
+            return ir.FunctionCall(
+                node.info,
+                node.callee.func.func.type_.ret_type,
+                node.callee.func,
+                [node.callee.obj] + _expand_call_args(node.arg),
+            )
+
+        case ir.TypeRef():
+            match node.callee.primitive():
+                case ir.EnumValueType() as enum_val:
+                    args: list = _expand_call_args(node.arg)
+                    assert all(isinstance(arg, ir.Expr) for arg in args)
+                    return ir.EnumInst(node.info, node.callee, enum_val.discr, args)
+
+                case ir.TupleType():
+                    match node.arg:
+                        case ir.TupleExpr():
+                            return ir.TupleInst(node.info, node.callee, node.arg.args)
+                        case _:
+                            assert isinstance(node.arg, ir.Expr)
+                            return ir.Cast(node.info, node.callee, node.arg)
 
-                case ir.Builtin(name="__enumerate"):
-                    node.type_ = ir.BuiltinType("__iter")
+                case ir.TypeDef() | ir.IntegralType():
+                    args = _expand_call_args(node.arg)
+                    assert len(args) == 1
+                    assert isinstance(args[0], ir.Expr)
+                    return ir.Cast(node.info, node.callee, args[0])
 
                 case _:
-                    raise NotImplementedError(type(node.callee))
+                    raise NotImplementedError(node.callee)
 
-        case ir.AstMacroDef():
+        case ir.MacroRef():
+            return ir.MacroInst(
+                node.info, node.callee.macro.func.type_.ret_type, node.callee, _expand_call_args(node.arg)
+            )
+
+        case ir.GetAttr() | ir.SelfType() | ir.TemplateInst():
             return node
 
-    return node
+        case ir.OverloadedFunction():
+            assert isinstance(node.arg, ir.TupleExpr)
+            call_args: list = node.arg.args
+            arg_types = [arg.type_ for arg in call_args]
+            matches: list[ir.FunctionRef | ir.MacroRef] = []
+            for method in node.callee.overloads:
+                assert isinstance(method, ir.FunctionRef)
+                method_arg_types = [arg.type_ for arg in method.func.type_.args]
+                comp = [t1.has_base_class(t2) for t1, t2 in zip(arg_types, method_arg_types)]
+
+                if all(comp):
+                    return ir.FunctionCall(node.info, method.func.type_.ret_type, method, call_args)
+
+                if any(comp):
+                    matches.append(method)
+
+            if not matches:
+                if any(isinstance(arg_type, ir.UnknownType) for arg_type in arg_types):
+                    # Possibly before template substitution
+                    return node
 
+                raise TypeError(
+                    f"{span.format(node.info)}: No matching overload for function '{node.callee.name}'"
+                    f" with argument types {arg_types}"
+                )
 
-def instantiate_templates(node: ir.Node, scope=None) -> ir.Node:
-    node = traverse_ir.traverse_scoped(instantiate_templates, node, scope)
+            elif len(matches) == 1:
+                method = matches[0]
+                assert isinstance(method, ir.FunctionRef)
+                return ir.FunctionCall(node.info, method.func.type_.ret_type, method, call_args)
 
-    match node:
-        case ir.TemplateInst():
-            if any(isinstance(type_, ir.TemplateArgRef) for type_ in node.args):
+            elif len(matches) == len(node.callee.overloads):
+                # Unchanged, a new node would be taken for progress by `compiler.worklist`
                 return node
 
-            assert all(isinstance(type_, ir.TypeRef) for type_ in node.args)
+            else:
+                overloads = ir.OverloadedFunction(node.info, node.callee.name, matches)
+                return ir.Call(node.info, overloads, node.arg, node.type_)
 
-            key = tuple(arg.name for arg in node.args)  # type:ignore[attr-defined]
-            if key in node.template.template.instances:
-                return ir.TypeRef(node.info, node.template.template.instances[key])
+        case ir.Builtin(name="__enumerate"):
+            node.type_ = ir.BuiltinType("__iter")
 
-            type_ = traverse_ir.instantiate(node.template.template, node.args)  # type:ignore[arg-type]
-            assert isinstance(type_, ir.TypeDef)
-            node.template.template.instances[key] = type_
-            type_ = instantiate_templates(type_, scope)  # type:ignore[assignment]
-            return ir.TypeRef(node.info, type_)
+        case _:
+            raise NotImplementedError(type(node.callee))
 
     return node
 
 
-def check_no_untranslated_nodes(node: ir.Node) -> ir.Node:
-    match node:
-        case ir.Untranslated():
-            raise Exception(f"Untranslated node: {node}")
-        case ir.AstMacroDef():
+instantiate_templates = traverse_ir.Visitor("instantiate_templates", scoped=True)
+
+
+@instantiate_templates.register(ir.TemplateInst)
+def _instantiate_template(node: ir.TemplateInst, scope=None) -> ir.Node:
+    node = instantiate_templates.traverse(node, scope)
+    if any(isinstance(type_, ir.TemplateArgRef) for type_ in node.args):
+        return node
+
+    assert all(isinstance(type_, ir.TypeRef) for type_ in node.args)
+
+    key = tuple(arg.name for arg in node.args)  # type:ignore[attr-defined]
+    if key in node.template.template.instances:
+        return ir.TypeRef(node.info, node.template.template.instances[key])
+
+    type_ = traverse_ir.instantiate(node.template.template, node.args)  # type:ignore[arg-type]
+    assert isinstance(type_, ir.TypeDef)
+    node.template.template.instances[key] = type_
+    type_ = instantiate_templates(type_, scope)  # type:ignore[assignment]
+    return ir.TypeRef(node.info, type_)
+
+
+propagate_types = traverse_ir.Visitor("propagate_types")
+
+
+@propagate_types.register(ir.Module)
+def _propagate_module(node: ir.Module) -> ir.Node:
+    node.scope = propagate_types(node.scope)
+    node.asm = [propagate_types(match_expr_type(asm, ir.VoidType(None))) for asm in node.asm]
+
+    return node
+
+
+@propagate_types.register(ir.TemplateDef)
+def _propagate_template_def(node: ir.TemplateDef) -> ir.Node:
+    # Only type-check instances
+    node.instances = traverse_ir.traverse_dict(propagate_types, node.instances)
+    return node
+
+
+@propagate_types.register(ir.TemplateFor)
+def _propagate_template_for(node: ir.TemplateFor) -> ir.Node:
+    match node.iterable:
+        case ir.Call(callee=ir.Builtin(name="__enumerate"), arg=iterable):
+            assert len(node.bindings) == 2
+            if not isinstance(node.bindings[0].type_, ir.BuiltinType):
+                assert isinstance(node.bindings[0].type_, ir.UnknownType)
+                assert isinstance(node.bindings[1].type_, ir.UnknownType)
+                node.bindings[0].type_ = ir.BuiltinType("__int")
+
+                # TODO: generalize
+                assert isinstance(iterable, ir.Expr)
+                assert iterable.type_ == ir.BuiltinType("__str")
+                # __str == __array[__int]
+                node.bindings[1].type_ = ir.BuiltinType("__int")
+
+            node.body = propagate_types(node.body)
             return node
         case _:
-            return traverse_ir.traverse(check_no_untranslated_nodes, node)
+            raise NotImplementedError
+
+
+@propagate_types.register(ir.FunctionReturn)
+def _propagate_function_return(node: ir.FunctionReturn) -> ir.Node:
+    node.expr = propagate_types(match_expr_type(node.expr, node.func.func.type_.ret_type))
+
     return node
 
 
-def propagate_types(node: ir.Node):
-    match node:
-        case ir.Module():
-            node.scope = propagate_types(node.scope)
-            node.asm = [propagate_types(match_expr_type(asm, ir.VoidType(None))) for asm in node.asm]
+@propagate_types.register(ir.FunctionCall)
+def _propagate_function_call(node: ir.FunctionCall) -> ir.Node:
+    func_args = node.func.func.type_.args
+    assert len(node.args) == len(func_args)
+    node.args = [
+        propagate_types(match_expr_type(arg, arg_decl.type_)) for arg, arg_decl in zip(node.args, func_args)
+    ]
 
-        case ir.TemplateDef():
-            # Only type-check instances
-            node.instances = traverse_ir.traverse_dict(propagate_types, node.instances)
-            return node
+    return node
 
-        case ir.TemplateFor():
-            match node.iterable:
-                case ir.Call(callee=ir.Builtin(name="__enumerate"), arg=iterable):
-                    assert len(node.bindings) == 2
-                    if not isinstance(node.bindings[0].type_, ir.BuiltinType):
-                        assert isinstance(node.bindings[0].type_, ir.UnknownType)
-                        assert isinstance(node.bindings[1].type_, ir.UnknownType)
-                        node.bindings[0].type_ = ir.BuiltinType("__int")
-
-                        # TODO: generalize
-                        assert isinstance(iterable, ir.Expr)
-                        assert iterable.type_ == ir.BuiltinType("__str")
-                        # __str == __array[__int]
-                        node.bindings[1].type_ = ir.BuiltinType("__int")
-
-                    node.body = propagate_types(node.body)
-                    return node
-                case _:
-                    raise NotImplementedError
-
-        case ir.FunctionReturn():
-            node.expr = propagate_types(match_expr_type(node.expr, node.func.func.type_.ret_type))
-
-        case ir.FunctionCall():
-            func_args = node.func.func.type_.args
-            assert len(node.args) == len(func_args)
-            node.args = [
-                propagate_types(match_expr_type(arg, arg_decl.type_)) for arg, arg_decl in zip(node.args, func_args)
-            ]
-
-        case ir.MacroDef():
-            if node.name in ["__type_declaration", "__type_reference", "__type_packed"]:
-                assert len(node.func.type_.args) == 0
-                assert isinstance(node.func.type_.ret_type, ir.VoidType)
-                node.func = propagate_types(node.func)
-                return node
-            else:
-                node.func = propagate_types(node.func)
-
-        case ir.MacroInst():
-            func_args = node.macro.macro.func.type_.args
-            assert len(node.args) == len(func_args)
-            node.args = [
-                propagate_types(match_expr_type(arg, arg_decl.type_)) for arg, arg_decl in zip(node.args, func_args)
-            ]
-
-        case ir.EnumInst():
-            assert isinstance(node.type_, ir.TypeRef)
-            primitive = node.type_.primitive()
-            assert isinstance(primitive, ir.EnumValueType)
-            assert len(node.args) == len(primitive.field_types)
-            node.args = [
-                propagate_types(match_expr_type(arg, field_type))
-                for arg, field_type in zip(node.args, primitive.field_types)
-            ]
-
-        case ir.TupleInst():
-            assert isinstance(node.type_, ir.TypeRef), node.type_
-            primitive = node.type_.primitive()
-            assert isinstance(primitive, ir.TupleType)
-            assert len(node.args) == len(primitive.field_types)
-            node.args = [
-                propagate_types(match_expr_type(arg, field_type))
-                for arg, field_type in zip(node.args, primitive.field_types)
-            ]
-
-        case ir.FunctionDef():
-            for i in range(len(node.scope.body) - 1):
-                if isinstance(node.scope.body[i], ir.Asm):
-                    node.scope.body[i] = propagate_types(match_expr_type(node.scope.body[i], ir.VoidType(None)))
-                else:
-                    node.scope.body[i] = propagate_types(node.scope.body[i])
 
-            if node.scope.body:
-                if isinstance(node.type_.ret_type, ir.VoidType):
-                    if isinstance(node.scope.body[-1], ir.Expr):
-                        if isinstance(node.scope.body[-1].type_, ir.UnknownType):
-                            expr = propagate_types(match_expr_type(node.scope.body[-1], ir.VoidType(None)))
-                        else:
-                            expr = propagate_types(node.scope.body[-1])
+@propagate_types.register(ir.MacroDef)
+def _propagate_macro_def(node: ir.MacroDef) -> ir.Node:
+    if node.name in ["__type_declaration", "__type_reference", "__type_packed"]:
+        assert len(node.func.type_.args) == 0
+        assert isinstance(node.func.type_.ret_type, ir.VoidType)
+        node.func = propagate_types(node.func)
+        return node
+    else:
+        node.func = propagate_types(node.func)
 
-                        node.scope.body[-1] = expr if isinstance(expr.type_, ir.VoidType) else ir.Drop(expr)
-                    else:
-                        node.scope.body[-1] = propagate_types(node.scope.body[-1])
-                else:
-                    match node.scope.body[-1]:
-                        case ir.Expr():
-                            node.scope.body[-1] = propagate_types(
-                                match_expr_type(node.scope.body[-1], node.type_.ret_type)
-                            )
-                        case ir.FunctionReturn():
-                            node.scope.body[-1] = propagate_types(node.scope.body[-1])
-                        case _:
-                            assert isinstance(node.type_.ret_type, ir.VoidType), node.name
-                            # TODO: check if statements always return
-                            node.scope.body[-1] = propagate_types(node.scope.body[-1])
-                            # raise Exception(f"Unexpected node type in function body: {type(node.scope.body[-1])}")
-
-        case ir.Block():
-            for i in range(len(node.scope.body) - 1):
-                if isinstance(node.scope.body[i], ir.Asm):
-                    node.scope.body[i] = propagate_types(match_expr_type(node.scope.body[i], ir.VoidType(None)))
-                else:
-                    node.scope.body[i] = propagate_types(node.scope.body[i])
-
-            assert not node.scope.attrs
-            if node.scope.body:
-                if isinstance(node.type_, ir.VoidType):
-                    if isinstance(node.scope.body[-1], ir.Expr):
-                        if isinstance(node.scope.body[-1].type_, ir.UnknownType):
-                            expr = propagate_types(match_expr_type(node.scope.body[-1], ir.VoidType(None)))
-                        else:
-                            expr = propagate_types(node.scope.body[-1])
+    return node
 
-                        node.scope.body[-1] = expr if isinstance(expr.type_, ir.VoidType) else ir.Drop(expr)
-                    else:
-                        node.scope.body[-1] = propagate_types(node.scope.body[-1])
-                else:
-                    match node.scope.body[-1]:
-                        case ir.Expr():
-                            node.scope.body[-1] = propagate_types(match_expr_type(node.scope.body[-1], node.type_))
-                        case ir.FunctionReturn():
-                            node.scope.body[-1] = propagate_types(node.scope.body[-1])
-                        case _:
-                            # TODO: check if statements always return
-                            node.scope.body[-1] = propagate_types(node.scope.body[-1])
-                            # raise Exception(f"Unexpected node type in function body: {type(node.scope.body[-1])}")
-
-        case ir.Scope():
-            node.attrs = traverse_ir.traverse_dict(propagate_types, node.attrs)
-            for i in range(len(node.body)):
-                if isinstance(node.body[i], ir.Asm):
-                    node.body[i] = propagate_types(match_expr_type(node.body[i], ir.VoidType(None)))
+
+@propagate_types.register(ir.MacroInst)
+def _propagate_macro_inst(node: ir.MacroInst) -> ir.Node:
+    func_args = node.macro.macro.func.type_.args
+    assert len(node.args) == len(func_args)
+    node.args = [
+        propagate_types(match_expr_type(arg, arg_decl.type_)) for arg, arg_decl in zip(node.args, func_args)
+    ]
+
+    return node
+
+
+@propagate_types.register(ir.EnumInst)
+def _propagate_enum_inst(node: ir.EnumInst) -> ir.Node:
+    assert isinstance(node.type_, ir.TypeRef)
+    primitive = node.type_.primitive()
+    assert isinstance(primitive, ir.EnumValueType)
+    assert len(node.args) == len(primitive.field_types)
+    node.args = [
+        propagate_types(match_expr_type(arg, field_type))
+        for arg, field_type in zip(node.args, primitive.field_types)
+    ]
+
+    return node
+
+
+@propagate_types.register(ir.TupleInst)
+def _propagate_tuple_inst(node: ir.TupleInst) -> ir.Node:
+    assert isinstance(node.type_, ir.TypeRef), node.type_
+    primitive = node.type_.primitive()
+    assert isinstance(primitive, ir.TupleType)
+    assert len(node.args) == len(primitive.field_types)
+    node.args = [
+        propagate_types(match_expr_type(arg, field_type))
+        for arg, field_type in zip(node.args, primitive.field_types)
+    ]
+
+    return node
+
+
+@propagate_types.register(ir.FunctionDef)
+def _propagate_function_def(node: ir.FunctionDef) -> ir.Node:
+    for i in range(len(node.scope.body) - 1):
+        if isinstance(node.scope.body[i], ir.Asm):
+            node.scope.body[i] = propagate_types(match_expr_type(node.scope.body[i], ir.VoidType(None)))
+        else:
+            node.scope.body[i] = propagate_types(node.scope.body[i])
+
+    if node.scope.body:
+        if isinstance(node.type_.ret_type, ir.VoidType):
+            if isinstance(node.scope.body[-1], ir.Expr):
+                if isinstance(node.scope.body[-1].type_, ir.UnknownType):
+                    expr = propagate_types(match_expr_type(node.scope.body[-1], ir.VoidType(None)))
                 else:
-                    node.body[i] = propagate_types(node.body[i])
-
-        case ir.Assignment():
-            assert isinstance(node.lvalue, ir.VarRef)
-            node.expr = propagate_types(match_expr_type(node.expr, node.lvalue.type_))
-            assert isinstance(node.expr, ir.Expr)
-            match node.lvalue:
-                case ir.VarRef():
-                    assert node.lvalue.type_ == node.expr.type_
-                case ir.ArgRef():
-                    raise ValueError("Setting argument not allowed")
+                    expr = propagate_types(node.scope.body[-1])
+
+                node.scope.body[-1] = expr if isinstance(expr.type_, ir.VoidType) else ir.Drop(expr)
+            else:
+                node.scope.body[-1] = propagate_types(node.scope.body[-1])
+        else:
+            match node.scope.body[-1]:
+                case ir.Expr():
+                    node.scope.body[-1] = propagate_types(
+                        match_expr_type(node.scope.body[-1], node.type_.ret_type)
+                    )
+                case ir.FunctionReturn():
+                    node.scope.body[-1] = propagate_types(node.scope.body[-1])
                 case _:
-                    raise NotImplementedError(type(node.lvalue))
+                    assert isinstance(node.type_.ret_type, ir.VoidType), node.name
+                    # TODO: check if statements always return
+                    node.scope.body[-1] = propagate_types(node.scope.body[-1])
+                    # raise Exception(f"Unexpected node type in function body: {type(node.scope.body[-1])}")
 
-        case ir.SetLocal():
-            node.expr = propagate_types(match_expr_type(node.expr, node.var.type_))
+    return node
 
-        case ir.SetNativeArrayItem():
-            assert isinstance(node.lvalue.type_, ir.TypeRef)
-            assert isinstance(node.lvalue.type_.type_, ir.TypeDef)
-            method = node.lvalue.type_.type_.scope.attrs["[]="]
-            assert isinstance(method, (ir.FunctionDef, ir.MacroDef))
-            idx_type = method.type_.args[1].type_
 
-            node.lvalue = propagate_types(node.lvalue)
-            node.idx = propagate_types(match_expr_type(node.idx, idx_type))
-            node.value = propagate_types(match_expr_type(node.value, node.lvalue.type_.primitive().element_type))
+@propagate_types.register(ir.Block)
+def _propagate_block(node: ir.Block) -> ir.Node:
+    for i in range(len(node.scope.body) - 1):
+        if isinstance(node.scope.body[i], ir.Asm):
+            node.scope.body[i] = propagate_types(match_expr_type(node.scope.body[i], ir.VoidType(None)))
+        else:
+            node.scope.body[i] = propagate_types(node.scope.body[i])
+
+    assert not node.scope.attrs
+    if node.scope.body:
+        if isinstance(node.type_, ir.VoidType):
+            if isinstance(node.scope.body[-1], ir.Expr):
+                if isinstance(node.scope.body[-1].type_, ir.UnknownType):
+                    expr = propagate_types(match_expr_type(node.scope.body[-1], ir.VoidType(None)))
+                else:
+                    expr = propagate_types(node.scope.body[-1])
 
-        case ir.GetNativeArrayItem():
-            assert isinstance(node.expr.type_, ir.TypeRef)
-            assert isinstance(node.expr.type_.type_, ir.TypeDef)
-            method = node.expr.type_.type_.scope.attrs["[]"]
-            assert isinstance(method, (ir.FunctionDef, ir.MacroDef))
-            idx_type = method.type_.args[1].type_
-
-            node.expr = propagate_types(node.expr)
-            node.idx = propagate_types(match_expr_type(node.idx, idx_type))
-
-        case ir.Cast():
-            assert isinstance(node.type_, ir.TypeRef)
-            assert isinstance(node.type_.type_, ir.TypeDef)
-            expr = propagate_types(node.expr)
-            return explicit_cast(expr, node.type_)
-
-        case ir.Match():
-            assert isinstance(node.match_expr.expr, ir.Expr)
-            node.match_expr.var.type_ = node.match_expr.expr.type_
-
-            node.match_expr = propagate_types(node.match_expr)
-            for i, case in enumerate(node.cases):
-                match case:
-                    case ir.MatchCaseEnum():
-                        assert isinstance(case.enum, ir.TypeRef)
-                        assert isinstance(case.enum.type_, ir.EnumValueType)
-                        assert len(case.args) == len(case.enum.type_.field_types)
-                        case.args = [
-                            propagate_types(match_expr_type(arg, type_))
-                            for arg, type_ in zip(case.args, case.enum.type_.field_types)
-                        ]
-                        case.scope = propagate_types(case.scope)
-
-                    case ir.MatchIntCase():
-                        case.scope = propagate_types(case.scope)
-
-                    case ir.MatchCase():
-                        assert isinstance(node.match_expr.expr, ir.Expr)
-                        case.expr = propagate_types(match_expr_type(case.expr, node.match_expr.expr.type_))
-                        case.scope = propagate_types(case.scope)
+                node.scope.body[-1] = expr if isinstance(expr.type_, ir.VoidType) else ir.Drop(expr)
+            else:
+                node.scope.body[-1] = propagate_types(node.scope.body[-1])
+        else:
+            match node.scope.body[-1]:
+                case ir.Expr():
+                    node.scope.body[-1] = propagate_types(match_expr_type(node.scope.body[-1], node.type_))
+                case ir.FunctionReturn():
+                    node.scope.body[-1] = propagate_types(node.scope.body[-1])
+                case _:
+                    # TODO: check if statements always return
+                    node.scope.body[-1] = propagate_types(node.scope.body[-1])
+                    # raise Exception(f"Unexpected node type in function body: {type(node.scope.body[-1])}")
 
-                    case _:
-                        raise NotImplementedError(case)
+    return node
+
+
+@propagate_types.register(ir.Scope)
+def _propagate_scope(node: ir.Scope) -> ir.Node:
+    node.attrs = traverse_ir.traverse_dict(propagate_types, node.attrs)
+    for i in range(len(node.body)):
+        if isinstance(node.body[i], ir.Asm):
+            node.body[i] = propagate_types(match_expr_type(node.body[i], ir.VoidType(None)))
+        else:
+            node.body[i] = propagate_types(node.body[i])
+
+    return node
 
-        case ir.AstMacroDef():
-            return node
 
+@propagate_types.register(ir.Assignment)
+def _propagate_assignment(node: ir.Assignment) -> ir.Node:
+    assert isinstance(node.lvalue, ir.VarRef)
+    node.expr = propagate_types(match_expr_type(node.expr, node.lvalue.type_))
+    assert isinstance(node.expr, ir.Expr)
+    match node.lvalue:
+        case ir.VarRef():
+            assert node.lvalue.type_ == node.expr.type_
+        case ir.ArgRef():
+            raise ValueError("Setting argument not allowed")
         case _:
-            return traverse_ir.traverse(propagate_types, node)
+            raise NotImplementedError(type(node.lvalue))
 
     return node
 
 
-def drop_unused_result(node: ir.Node) -> ir.Node:
-    match node:
-        case ir.TemplateDef():
-            # Only type-check instances
-            node.instances = traverse_ir.traverse_dict(propagate_types, node.instances)
-            return node
+@propagate_types.register(ir.SetLocal)
+def _propagate_set_local(node: ir.SetLocal) -> ir.Node:
+    node.expr = propagate_types(match_expr_type(node.expr, node.var.type_))
 
-        case ir.Scope():
-            # TODO: while/if/else expressions
-            for i in range(len(node.body) - 1):
-                expr = node.body[i]
-                if isinstance(expr, ir.Expr):
-                    assert not isinstance(expr.type_, ir.UnknownType)
-                    if not isinstance(expr.type_, ir.VoidType):
-                        node.body[i] = ir.Drop(expr)
+    return node
 
-    return traverse_ir.traverse(drop_unused_result, node)
 
+@propagate_types.register(ir.SetNativeArrayItem)
+def _propagate_set_native_array_item(node: ir.SetNativeArrayItem) -> ir.Node:
+    assert isinstance(node.lvalue.type_, ir.TypeRef)
+    assert isinstance(node.lvalue.type_.type_, ir.TypeDef)
+    method = node.lvalue.type_.type_.scope.attrs["[]="]
+    assert isinstance(method, (ir.FunctionDef, ir.MacroDef))
+    idx_type = method.type_.args[1].type_
 
-def convert_enum_inst(node: ir.Node) -> ir.Node:
-    node = traverse_ir.traverse(convert_enum_inst, node)
+    node.lvalue = propagate_types(node.lvalue)
+    node.idx = propagate_types(match_expr_type(node.idx, idx_type))
+    node.value = propagate_types(match_expr_type(node.value, node.lvalue.type_.primitive().element_type))
 
-    match node:
-        # case ir.GetEnumItem():
-        #     return ir.GetTupleItem(node.info, node.type_, node.expr, node.idx + 1)
+    return node
 
-        case ir.EnumInst():
-            enum_value_type = node.type_.primitive()
-            assert isinstance(enum_value_type, ir.EnumValueType)
-            return ir.TupleInst(
-                node.info,
-                node.type_,
-                [match_expr_type(ir.IntLiteral(None, node.discr), enum_value_type.discr_type)] + node.args,
-            )
 
-        case ir.EnumInt():
-            assert isinstance(node.type_, ir.TypeRef)
-            assert isinstance(node.type_.type_, ir.EnumIntType)
-            assert node.type_.type_.super_
-            return match_expr_type(ir.IntLiteral(None, node.discr), node.type_.type_.super_)
+@propagate_types.register(ir.GetNativeArrayItem)
+def _propagate_get_native_array_item(node: ir.GetNativeArrayItem) -> ir.Node:
+    assert isinstance(node.expr.type_, ir.TypeRef)
+    assert isinstance(node.expr.type_.type_, ir.TypeDef)
+    method = node.expr.type_.type_.scope.attrs["[]"]
+    assert isinstance(method, (ir.FunctionDef, ir.MacroDef))
+    idx_type = method.type_.args[1].type_
+
+    node.expr = propagate_types(node.expr)
+    node.idx = propagate_types(match_expr_type(node.idx, idx_type))
 
     return node
 
 
+@propagate_types.register(ir.Cast)
+def _propagate_cast(node: ir.Cast) -> ir.Node:
+    assert isinstance(node.type_, ir.TypeRef)
+    assert isinstance(node.type_.type_, ir.TypeDef)
+    expr = propagate_types(node.expr)
+    return explicit_cast(expr, node.type_)
+
+
+@propagate_types.register(ir.Match)
+def _propagate_match(node: ir.Match) -> ir.Node:
+    assert isinstance(node.match_expr.expr, ir.Expr)
+    node.match_expr.var.type_ = node.match_expr.expr.type_
+
+    node.match_expr = propagate_types(node.match_expr)
+    for i, case in enumerate(node.cases):
+        match case:
+            case ir.MatchCaseEnum():
+                assert isinstance(case.enum, ir.TypeRef)
+                assert isinstance(case.enum.type_, ir.EnumValueType)
+                assert len(case.args) == len(case.enum.type_.field_types)
+                case.args = [
+                    propagate_types(match_expr_type(arg, type_))
+                    for arg, type_ in zip(case.args, case.enum.type_.field_types)
+                ]
+                case.scope = propagate_types(case.scope)
+
+            case ir.MatchIntCase():
+                case.scope = propagate_types(case.scope)
+
+            case ir.MatchCase():
+                assert isinstance(node.match_expr.expr, ir.Expr)
+                case.expr = propagate_types(match_expr_type(case.expr, node.match_expr.expr.type_))
+                case.scope = propagate_types(case.scope)
+
+            case _:
+                raise NotImplementedError(case)
+
+    return node
+
+
+propagate_types.register(ir.AstMacroDef)(_skip_ast_macro)
+
+
+# Nodes that a later visit of `resolve_member_access` and `propagate_types` may still replace
+unresolved_nodes = (ir.UnknownType, ir.GetAttr, ir.Call, ir.GetItem, ir.SetItem, ir.Assignment, ir.Cast)
+
+
+def _resolve_types(node: ir.Node, scope=None) -> ir.Node:
+    return propagate_types(resolve_member_access(node, scope))
+
+
+def resolve_types(module: ir.Module) -> ir.Module:
+    """Resolve member accesses and propagate types through the module up to a fixpoint.
+
+    After a sweep over the whole module only the definitions that still contain
+    `unresolved_nodes` are revisited, see `compiler.worklist`.
+    """
+    module = _resolve_types(module)
+    worklist.Worklist(module, unresolved_nodes).run(_resolve_types)
+    return module
+
+
+drop_unused_result = traverse_ir.Visitor("drop_unused_result")
+
+
+@drop_unused_result.register(ir.TemplateDef)
+def _drop_unused_template_result(node: ir.TemplateDef) -> ir.Node:
+    # Only type-check instances
+    node.instances = traverse_ir.traverse_dict(propagate_types, node.instances)
+    return node
+
+
+@drop_unused_result.register(ir.Scope)
+def _drop_unused_scope_result(node: ir.Scope) -> ir.Node:
+    # TODO: while/if/else expressions
+    for i in range(len(node.body) - 1):
+        expr = node.body[i]
+        if isinstance(expr, ir.Expr):
+            assert not isinstance(expr.type_, ir.UnknownType)
+            if not isinstance(expr.type_, ir.VoidType):
+                node.body[i] = ir.Drop(expr)
+
+    return drop_unused_result.traverse(node)
+
+
+convert_enum_inst = traverse_ir.Visitor("convert_enum_inst")
+
+
+@convert_enum_inst.register(ir.EnumInst)
+def _convert_enum_inst(node: ir.EnumInst) -> ir.Node:
+    node = convert_enum_inst.traverse(node)
+    enum_value_type = node.type_.primitive()
+    assert isinstance(enum_value_type, ir.EnumValueType)
+    return ir.TupleInst(
+        node.info,
+        node.type_,
+        [match_expr_type(ir.IntLiteral(None, node.discr), enum_value_type.discr_type)] + node.args,
+    )
+
+
+@convert_enum_inst.register(ir.EnumInt)
+def _convert_enum_int(node: ir.EnumInt) -> ir.Node:
+    node = convert_enum_inst.traverse(node)
+    assert isinstance(node.type_, ir.TypeRef)
+    assert isinstance(node.type_.type_, ir.EnumIntType)
+    assert node.type_.type_.super_
+    return match_expr_type(ir.IntLiteral(None, node.discr), node.type_.type_.super_)
+
+
 def _check_match_expr_type_result(func):
     def wrapper(expr: ir.Node, type_: ir.Type):
         res = func(expr, type_)
@@ -1113,7 +1198,7 @@ def implicit_cast_literal(expr: ir.Expr, type_: ir.Type):
             try:
                 from_literal = cast_type.scope.attrs["__from_literal"]
             except KeyError:
-                raise RuntimeError(f"Implicit conversion from {expr.type_} to {type_} not allowed")
+                raise RuntimeError(f"{span.format(expr.info)}: Implicit conversion from {expr.type_} to {type_} not allowed")
 
             if isinstance(from_literal, ir.OverloadedFunction):
                 (from_literal,) = list(
@@ -1129,7 +1214,7 @@ def implicit_cast_literal(expr: ir.Expr, type_: ir.Type):
             assert isinstance(type_, ir.TypeRef)
             return ir.ImplicitCast(expr.info, type_, from_literal, expr)
 
-        case ir.BuiltinType() if expr.type_.name == type_.name:
+        case ir.BuiltinType() if expr.type_ is type_:
             return expr
 
         case other:
@@ -1170,7 +1255,7 @@ def explicit_cast(expr: ir.Expr, type_: ir.Type):
                 # Allow automatic conversion from __str to __int literals on explicit casts
                 expr = ir.IntLiteral(expr.info, int.from_bytes(expr.value.encode(), "little"))
             else:
-                assert expr.type_.name == arg_type.name  # type:ignore[attr-defined]
+                assert expr.type_ is arg_type
 
             assert type_.has_base_class(from_literal.func.type_.ret_type)
             return ir.ExplicitCast(
@@ -1243,118 +1328,111 @@ def match_expr_type(expr: ir.Node, type_: ir.Type):
 
         case ir.TypeRef(type_=ir.TypeDef() as expr_type):
             if not expr_type.has_base_class(type_):
-                raise Exception(f"Expected {type_}, got {expr.type_}")
+                raise Exception(f"{span.format(expr.info)}: Expected {type_}, got {expr.type_}")
 
         case _:
             if expr.type_ != type_:
-                raise Exception(f"Type mismatch: {expr.type_} vs {type_}")
+                raise Exception(f"{span.format(expr.info)}: Type mismatch: {expr.type_} vs {type_}")
 
     return expr
 
 
-def specialize_match(node: ir.Node) -> ir.Node:
-    match node:
-        case ir.Match():
-            assert isinstance(node.match_expr.expr, ir.Expr)
-            assert node.match_expr.var.type_ == node.match_expr.expr.type_
-            match node.match_expr.expr.type_.primitive():
-                case ir.EnumType():
-                    cases: list = [ir.MatchCaseEnum.from_case(case) for case in node.cases]
-                    return ir.MatchEnum(node.info, node.match_expr, cases, node.scope)
-                case ir.IntegralType():
-                    cases = []
-                    for case in node.cases:
-                        if isinstance(case, ir.MatchIntCase):
-                            cases.append(case)
-
-                        match case.expr:
-                            case ir.ImplicitCast():
-                                inlined = inline_macros(case.expr)
-                                assert isinstance(inlined, ir.Expr)
-                                value = eval_wasm.eval_expr(inlined)
-                                assert isinstance(value, int)
-                            case ir.IntLiteral():
-                                value = case.expr.value
-                            case ir.EnumInt():
-                                value = case.expr.discr
-                            case _:
-                                raise NotImplementedError(type(case.expr))
-
-                        cases.append(ir.MatchIntCase(case.info, value, case.scope))
-                    return ir.MatchInt(node.info, node.match_expr, cases, node.scope)
-                case other:
-                    raise NotImplementedError(type(other))
-
-        case ir.TemplateDef():
-            node.instances = traverse_ir.traverse_dict(specialize_match, node.instances)
+specialize_match = traverse_ir.Visitor("specialize_match")
 
-        case _:
-            return traverse_ir.traverse(specialize_match, node)
+
+@specialize_match.register(ir.Match)
+def _specialize_match(node: ir.Match) -> ir.Node:
+    assert isinstance(node.match_expr.expr, ir.Expr)
+    assert node.match_expr.var.type_ == node.match_expr.expr.type_
+    match node.match_expr.expr.type_.primitive():
+        case ir.EnumType():
+            cases: list = [ir.MatchCaseEnum.from_case(case) for case in node.cases]
+            return ir.MatchEnum(node.info, node.match_expr, cases, node.scope)
+        case ir.IntegralType():
+            cases = []
+            for case in node.cases:
+                if isinstance(case, ir.MatchIntCase):
+                    cases.append(case)
+
+                match case.expr:
+                    case ir.ImplicitCast():
+                        inlined = inline_macros(case.expr)
+                        assert isinstance(inlined, ir.Expr)
+                        value = eval_wasm.eval_expr(inlined)
+                        assert isinstance(value, int)
+                    case ir.IntLiteral():
+                        value = case.expr.value
+                    case ir.EnumInt():
+                        value = case.expr.discr
+                    case _:
+                        raise NotImplementedError(type(case.expr))
+
+                cases.append(ir.MatchIntCase(case.info, value, case.scope))
+            return ir.MatchInt(node.info, node.match_expr, cases, node.scope)
+        case other:
+            raise NotImplementedError(type(other))
+
+
+@specialize_match.register(ir.TemplateDef)
+def _specialize_template_match(node: ir.TemplateDef) -> ir.Node:
+    node.instances = traverse_ir.traverse_dict(specialize_match, node.instances)
     return node
 
 
-def check_no_unknown_types(node: ir.Node) -> ir.Node:
-    match node:
-        case ir.UnknownType():
-            raise Exception(f"Unknown type: {node}")
+inline_macros = traverse_ir.Visitor("inline_macros")
 
-        case ir.TemplateDef():
-            # Only check instances, not template
-            node.instances = traverse_ir.traverse_dict(check_no_unknown_types, node.instances)
-            return node
 
-        case ir.AstMacroDef():
-            return node
+@inline_macros.register(ir.FunctionDef)
+def _inline_function_macros(node: ir.FunctionDef, scope=None) -> ir.Node:
+    assert node.scope.func
+    return inline_macros.traverse(node, node.scope)
 
-        case _:
-            return traverse_ir.traverse(check_no_unknown_types, node)
-    return node
 
+@inline_macros.register(ir.MacroInst)
+def _inline_macro_inst(node: ir.MacroInst, scope=None) -> ir.Node:
+    # args = [inline_macros(arg, scope) for arg in node.args]
+    return _expand_macro(node.macro.macro, scope, node.args)
+
+
+@inline_macros.register(ir.ImplicitCast, ir.ExplicitCast)
+def _inline_cast(node: ir.ImplicitCast | ir.ExplicitCast, scope=None) -> ir.Node:
+    return _expand_macro(node.macro.macro, scope, [node.expr])
+
+
+def _expand_macro(macro: ir.MacroDef, scope, args: list[ir.Node]) -> ir.Node:
+    """Inline `macro` with `args`, resolving the expansion only if the body or the arguments are unresolved."""
+    if macro._unresolved is None:
+        # Macro bodies are resolved before they are expanded, only once per macro
+        macro._unresolved = worklist.contains(macro.func.scope.body, unresolved_nodes)
+    inlined = traverse_ir.inline(macro, scope, args)
+    if macro._unresolved or worklist.contains(args, unresolved_nodes):
+        inlined = _resolve_types(inlined)
+    return inline_macros(inlined, scope)
 
-def inline_macros(node: ir.Node, scope=None) -> ir.Node:
-    match node:
-        case ir.FunctionDef():
-            assert node.scope.func
-            return traverse_ir.traverse(inline_macros, node, node.scope)
-
-        case ir.MacroInst():
-            # args = [inline_macros(arg, scope) for arg in node.args]
-            inlined = traverse_ir.inline(node.macro, scope, node.args)
-            inlined = resolve_member_access(inlined)
-            inlined = propagate_types(inlined)
-            inlined = inline_macros(inlined, scope)
-            return inlined
-
-        case ir.ImplicitCast() | ir.ExplicitCast():
-            inlined = traverse_ir.inline(node.macro, scope, [node.expr])
-            inlined = resolve_member_access(inlined)
-            inlined = propagate_types(inlined)
-            inlined = inline_macros(inlined, scope)
-            return inlined
-
-        case ir.ConstRef():
-            return node.const.expr
-
-        case ir.TemplateFor():
-            match node.iterable:
-                case ir.Call(callee=ir.Builtin(name="__enumerate"), arg=ir.StringLiteral(value=string)):
-                    block_name = scope.new_child_name("__inline_for")
-                    body = []
-                    for i, c in enumerate(string):
-                        arg_map: dict[str, ir.Node] = {
-                            node.bindings[0].name: ir.IntLiteral(node.bindings[0].info, i),
-                            node.bindings[1].name: ir.IntLiteral(node.bindings[1].info, ord(c)),
-                        }
-                        body.append(traverse_ir.inline_scope(node.body, scope, arg_map))
-
-                    inlined = ir.Block(None, ir.VoidType(None), block_name, ir.Scope(scope, "macro", body))
-                    return inline_macros(inlined, scope)
-                case _:
-                    # raise NotImplementedError
-                    return node
 
+@inline_macros.register(ir.ConstRef)
+def _inline_const(node: ir.ConstRef, scope=None) -> ir.Node:
+    return node.const.expr
+
+
+@inline_macros.register(ir.TemplateFor)
+def _inline_template_for(node: ir.TemplateFor, scope=None) -> ir.Node:
+    match node.iterable:
+        case ir.Call(callee=ir.Builtin(name="__enumerate"), arg=ir.StringLiteral(value=string)):
+            block_name = scope.new_child_name("__inline_for")
+            body = []
+            for i, c in enumerate(string):
+                arg_map: dict[str, ir.Node] = {
+                    node.bindings[0].name: ir.IntLiteral(node.bindings[0].info, i),
+                    node.bindings[1].name: ir.IntLiteral(node.bindings[1].info, ord(c)),
+                }
+                body.append(traverse_ir.inline_scope(node.body, scope, arg_map))
+
+            inlined = ir.Block(None, ir.VoidType(None), block_name, ir.Scope(scope, "macro", body))
+            return inline_macros(inlined, scope)
         case _:
-            return traverse_ir.traverse(inline_macros, node, scope)
+            # raise NotImplementedError
+            return node
 
 
 def _get_type_dependencies(node, type_: ir.Type | None, depth):
@@ -1388,19 +1466,23 @@ def _get_type_dependencies(node, type_: ir.Type | None, depth):
             raise NotImplementedError(type(type_))
 
 
-def type_sorting(node: ir.Node) -> ir.Node:
-    match node:
-        case ir.TemplateDef():
-            for inst in node.instances.values():
-                type_sorting(inst)
+type_sorting = traverse_ir.Visitor("type_sorting")
 
-            return node
 
-        case ir.TypeDef():
-            if not node.sorting:
-                _get_type_dependencies(node, node, 0)
+@type_sorting.register(ir.TemplateDef)
+def _sort_template_types(node: ir.TemplateDef) -> ir.Node:
+    for inst in node.instances.values():
+        type_sorting(inst)
+
+    return node
+
 
-    return traverse_ir.traverse(type_sorting, node)
+@type_sorting.register(ir.TypeDef)
+def _sort_type(node: ir.TypeDef) -> ir.Node:
+    if not node.sorting:
+        _get_type_dependencies(node, node, 0)
+
+    return type_sorting.traverse(node)
 
 
 def done(node: ir.Node) -> ir.Node:
@@ -1416,26 +1498,23 @@ toplevel_ast_passes: list = [
 
 ir_passes: list = [
     translate_toplevel_type_decls,
-    check_no_untranslated_types,
     translate_function_defs,
-    check_no_untranslated_nodes,
     instantiate_templates,
-    resolve_member_access,
-    propagate_types,
-    resolve_member_access,
-    propagate_types,
+    resolve_types,
     drop_unused_result,
     specialize_match,
-    check_no_unknown_types,
     convert_enum_inst,
-    write_tree("inner.ir"),
     inline_macros,
     type_sorting,
     done,
 ]
 
 
-def run(prog: ast.Module):
+def run(prog: ast.Module, manager: PassManager | None = None):
+    """Translate `prog` into an IR module, recording the statistics of each pass in `manager`."""
+    if manager is None:
+        manager = PassManager()
+
     root_scope = ir.Scope(None, "root")
     root_scope.register_type("__int", ir.BuiltinType("__int"))
     root_scope.register_type("__str", ir.BuiltinType("__str"))
@@ -1456,14 +1535,12 @@ def run(prog: ast.Module):
 
     module = ir.Module(prog.info, root_scope)
     for pass_ in toplevel_ast_passes:
-        print("Pass:", pass_.__name__)
-        pass_(prog, module)
+        manager.run_ast_pass(pass_, prog, module)
 
     # import pprint
     # pprint.pp(module)
 
     for pass_ in ir_passes:
-        print("Pass:", pass_.__name__)
-        module = pass_(module)
+        module = manager.run_pass(pass_, module)
 
     return module
@@ -0,0 +1,134 @@
+"""Compact source spans of AST and IR nodes.
+
+A span is a single integer packing the id of a registered source file with the
+start and end offsets of a node in the text of that file. The parser records
+spans in `Node.info`; lines and columns are only computed when a span is
+formatted for a diagnostic.
+
+Registered files are held weakly: a file stays registered while the object
+returned by `register` is alive, and parsed modules hold theirs in
+`ast.Module.sources`. The texts of dropped ASTs are released, spans of released
+files are formatted as unknown.
+"""
+
+import bisect
+import itertools
+import re
+import weakref
+
+from . import ast
+
+_offset_bits = 32
+_offset_mask = (1 << _offset_bits) - 1
+
+
+class SourceFile:
+    def __init__(self, file_id, filename, text):
+        self.id = file_id
+        self.filename = filename
+        self.text = text
+        self._line_starts = None
+
+    def line_column(self, pos):
+        if self._line_starts is None:
+            self._line_starts = [0] + [m.end() for m in re.finditer("\n", self.text)]
+        line = bisect.bisect_right(self._line_starts, pos)
+        return line, pos - self._line_starts[line - 1] + 1
+
+
+# Registered source files, by file id
+files: weakref.WeakValueDictionary[int, SourceFile] = weakref.WeakValueDictionary()
+_shared: weakref.WeakValueDictionary[tuple[str, str], SourceFile] = weakref.WeakValueDictionary()
+# File ids are never reused, spans of a released file do not refer to another one
+_ids = itertools.count()
+
+
+def register(filename, text, shared=True):
+    """Source file `filename` with contents `text`, its `id` is recorded in spans.
+
+    Shared files are reused for the same filename and text while they are
+    registered. Unshared files belong to the caller, which can replace their text
+    with `update`.
+    """
+    if shared:
+        source = _shared.get((filename, text))
+        if source is not None:
+            return source
+    source = SourceFile(next(_ids), filename, text)
+    files[source.id] = source
+    if shared:
+        _shared[filename, text] = source
+    return source
+
+
+def update(file_id, text):
+    source = files[file_id]
+    source.text = text
+    source._line_starts = None
+
+
+def make(file_id, start, end):
+    return (file_id << 2 * _offset_bits) | (start << _offset_bits) | end
+
+
+def file_id(span):
+    return span >> 2 * _offset_bits
+
+
+def start(span):
+    return (span >> _offset_bits) & _offset_mask
+
+
+def end(span):
+    return span & _offset_mask
+
+
+def join(first, last):
+    """Span from the start of `first` to the end of `last`."""
+    if first is None or last is None:
+        return first if last is None else last
+    return (first & ~_offset_mask) | end(last)
+
+
+def location(span):
+    """Filename, line and column of the first non-blank character of `span`.
+
+    Returns `None` when the file of `span` was released.
+    """
+    source = files.get(file_id(span))
+    if source is None:
+        return None
+    pos = start(span)
+    stripped = len(source.text[pos : end(span)].lstrip())
+    if stripped:
+        pos = end(span) - stripped
+    return (source.filename, *source.line_column(pos))
+
+
+def format(span):
+    loc = location(span) if span is not None else None
+    if loc is None:
+        return "<unknown>"
+    filename, line, column = loc
+    return f"{filename}:{line}:{column}"
+
+
+def rebase(node, file_id, shift=0):
+    """Move the spans of the AST `node` and its descendants to `file_id`, offset by `shift`."""
+    base = file_id << 2 * _offset_bits
+    offsets = (1 << 2 * _offset_bits) - 1
+    delta = (shift << _offset_bits) + shift
+    seen = set()
+
+    def visit(value):
+        if isinstance(value, list):
+            for item in value:
+                visit(item)
+        elif isinstance(value, ast.Node) and id(value) not in seen:
+            seen.add(id(value))
+            if value.info is not None:
+                value.info = base | ((value.info & offsets) + delta)
+            for item in vars(value).values():
+                visit(item)
+
+    visit(node)
@@ -1,111 +1,226 @@
 import copy
-from collections import OrderedDict
 
 from . import ir
 
 
-def traverse_wasm(func, node, *args, **kwargs):
-    return ir.WasmExpr(
-        node.info,
-        [
-            (
-                traverse_wasm(func, a, *args, **kwargs)
-                if isinstance(a, ir.WasmExpr)
-                else func(a, *args, **kwargs) if isinstance(a, ir.Node) else a
-            )
-            for a in node.terms
-        ],
-    )
+# Traversed fields of each node class, see `child_fields`
+_child_fields: dict[type, tuple[str, ...]] = {}
 
 
-def traverse_dict(func, attr: dict, *args, **kwargs):
-    return OrderedDict(filter(lambda x: x[1] is not None, ((k, func(v, *args, **kwargs)) for k, v in attr.items())))
+def child_fields(cls) -> tuple[str, ...]:
+    """Names of the fields of the node class `cls` that are traversed, none for references."""
+    fields = _child_fields.get(cls)
+    if fields is None:
+        # References are not traversed, their targets are visited where they are defined
+        if cls.__name__.endswith("Ref"):
+            fields = ()
+        else:
+            fields = tuple(name for name in cls.__dataclass_fields__ if name not in ("info", "ast_node"))
+        _child_fields[cls] = fields
+    return fields
 
 
-def traverse_list(func, attr: list[ir.Node], *args, **kwargs):
-    return list(filter(lambda x: x is not None, (func(a, *args, **kwargs) for a in attr)))
+def traverse_wasm(func, node, *args, **kwargs):
+    terms = node.terms
+    for i, term in enumerate(terms):
+        if isinstance(term, ir.WasmExpr):
+            traverse_wasm(func, term, *args, **kwargs)
+        elif isinstance(term, ir.Node):
+            terms[i] = func(term, *args, **kwargs)
+    return node
 
 
-def traverse(func, node: ir.Node, *args, **kwargs):
-    assert isinstance(node, ir.Node), type(node)
-    if type(node).__name__.endswith("Ref"):
-        return node
+# `compiler.pass_manager.PassManager` timing the function definitions visited by a pass, if any
+function_timer = None
 
-    if isinstance(node, ir.WasmExpr):
-        return traverse_wasm(func, node, *args, **kwargs)
-
-    for attr_name in node:
-        attr = node[attr_name]
-        if attr_name in ["info", "ast_node"]:
-            continue
-        match attr:
-            case ir.WasmExpr():
-                node[attr_name] = traverse_wasm(func, attr, *args, **kwargs)
-            case ir.Node():
-                node[attr_name] = func(attr, *args, **kwargs)
-                assert node[attr_name] is not None
-            case list():
-                node[attr_name] = traverse_list(func, attr, *args, **kwargs)
-            case dict():
-                node[attr_name] = traverse_dict(func, attr, *args, **kwargs)
-            case str() | int() | None:
-                pass
-            case _:
-                raise NotImplementedError(type(attr))
-    return node
 
+def traverse_dict(func, attr: dict, *args, **kwargs):
+    """Replace the values of `attr` with `func(value, ...)` in place, removing those replaced with `None`."""
+    removed = []
+    for key, value in list(attr.items()):
+        if function_timer is not None and isinstance(value, ir.FunctionDef):
+            result = function_timer.function(value.name, func, value, *args, **kwargs)
+        else:
+            result = func(value, *args, **kwargs)
+        if result is None:
+            removed.append(key)
+        elif result is not value:
+            attr[key] = result
+    for key in removed:
+        del attr[key]
+    return attr
 
-def traverse_scoped(func, node: ir.Node, scope):
-    assert isinstance(node, ir.Node), type(node)
-    if type(node).__name__.endswith("Ref"):
-        return node
 
-    match node:
-        case ir.WasmExpr():
-            return traverse_wasm(func, node, scope)
-        case ir.Scope():
-            scope = node
-
-    for attr_name in node:
-        attr = node[attr_name]
-        if attr_name in ["info", "ast_node"]:
-            continue
-        match attr:
-            case ir.WasmExpr():
-                node[attr_name] = traverse_wasm(func, attr, scope)
-            case ir.Node():
-                node[attr_name] = func(attr, scope)
-                assert node[attr_name] is not None
-            case list():
-                node[attr_name] = traverse_list(func, attr, scope)
-            case dict():
-                node[attr_name] = traverse_dict(func, attr, scope)
-            case str() | int() | None:
-                pass
-            case _:
-                raise NotImplementedError(type(attr))
+def traverse_list(func, attr: list[ir.Node], *args, **kwargs):
+    """Replace the items of `attr` with `func(item, ...)` in place, removing those replaced with `None`."""
+    removed = False
+    for i, item in enumerate(attr):
+        result = func(item, *args, **kwargs)
+        if result is None:
+            removed = True
+        if result is not item:
+            attr[i] = result
+    if removed:
+        attr[:] = [item for item in attr if item is not None]
+    return attr
+
+
+def _traverse_fields(func, node, fields, args, kwargs):
+    for name in fields:
+        attr = getattr(node, name)
+        if isinstance(attr, ir.Node):
+            if isinstance(attr, ir.WasmExpr):
+                traverse_wasm(func, attr, *args, **kwargs)
+            else:
+                result = func(attr, *args, **kwargs)
+                assert result is not None
+                if result is not attr:
+                    setattr(node, name, result)
+        elif isinstance(attr, list):
+            traverse_list(func, attr, *args, **kwargs)
+        elif isinstance(attr, dict):
+            traverse_dict(func, attr, *args, **kwargs)
+        elif not (attr is None or isinstance(attr, (str, int))):
+            raise NotImplementedError(type(attr))
     return node
 
 
-def _inline_args(node: ir.Node, block_name: str, args: dict[str, ir.Node]):
-    match node:
-        case ir.ArgRef():
-            # return args[node.arg.name]
-            return args.get(node.var.name, node)
-
-        case ir.VarRef():
-            # return args[node.var.name]
-            return args.get(node.var.name, node)
+def traverse(func, node: ir.Node, *args, **kwargs):
+    """Replace the children of `node` with `func(child, ...)`, mutating `node` and its lists and dicts in place.
 
-        case ir.FunctionDef():
-            # TODO: handle arg shadowing by lambdas/sub-functions
-            raise NotImplementedError
+    Children are visited in the order of the fields of the node class. Wasm
+    expressions are not passed to `func`, the nodes in their terms are instead.
+    """
+    assert isinstance(node, ir.Node), type(node)
+    if isinstance(node, ir.WasmExpr):
+        return traverse_wasm(func, node, *args, **kwargs)
+    return _traverse_fields(func, node, child_fields(type(node)), args, kwargs)
 
-        case ir.FunctionReturn():
-            return ir.Break(None, block_name, _inline_args(node.expr, block_name, args))
 
-        case _:
-            return traverse(_inline_args, node, block_name, args)
+def traverse_scoped(func, node: ir.Node, scope=None):
+    """Like `traverse` for `func(child, scope)`, with the innermost scope enclosing each child."""
+    assert isinstance(node, ir.Node), type(node)
+    if isinstance(node, ir.WasmExpr):
+        return traverse_wasm(func, node, scope)
+    if isinstance(node, ir.Scope):
+        scope = node
+    return _traverse_fields(func, node, child_fields(type(node)), (scope,), {})
+
+
+class Visitor:
+    """Pass calling the handler registered for the class of each node and traversing the other nodes.
+
+    A handler registered for a class also handles its subclasses, the handler of
+    the nearest class in the method resolution order of a node is used. Handlers
+    are looked up once per node class. Scoped visitors traverse with
+    `traverse_scoped` instead of `traverse`.
+
+        inline_consts = Visitor("inline_consts")
+
+        @inline_consts.register(ir.ConstRef)
+        def _(node):
+            return node.const.expr
+    """
+
+    def __init__(self, name, scoped=False):
+        self.__name__ = name
+        self.scoped = scoped
+        self.handlers: dict[type, object] = {}
+        self._table: dict[type, object] = {}
+
+    def register(self, *classes):
+        def decorator(handler):
+            for cls in classes:
+                self.handlers[cls] = handler
+            self._table.clear()
+            return handler
+
+        return decorator
+
+    def _lookup(self, cls):
+        handler = next((self.handlers[base] for base in cls.__mro__ if base in self.handlers), None)
+        if handler is None:
+            if issubclass(cls, ir.WasmExpr) or self.scoped and issubclass(cls, ir.Scope):
+                handler = self.traverse
+            else:
+                # Children of other unhandled nodes are visited without going through `traverse`
+                handler = child_fields(cls)
+        self._table[cls] = handler
+        return handler
+
+    def __call__(self, node, *args, **kwargs):
+        handler = self._table.get(type(node))
+        if handler is None:
+            handler = self._lookup(type(node))
+        if type(handler) is tuple:
+            return _traverse_fields(self, node, handler, args, kwargs)
+        return handler(node, *args, **kwargs)
+
+    def traverse(self, node, *args, **kwargs):
+        """Visit the children of `node`."""
+        if self.scoped:
+            return traverse_scoped(self, node, *args, **kwargs)
+        return traverse(self, node, *args, **kwargs)
+
+    def __repr__(self):
+        return f"Visitor({self.__name__!r})"
+
+
+# Classes with their own `__deepcopy__`, copied by it when cloned
+_deepcopied: dict[type, bool] = {}
+
+
+def _inline_copy(value, block_name: str, args: dict[str, ir.Node], memo: dict):
+    """Copy of `value` like `copy.deepcopy`, with arguments and local variables replaced by `args` by name.
+
+    Returns become breaks out of the block `block_name`. Only the traversed
+    fields of the nodes are substituted, other attributes are deep copied.
+    """
+    if value is None or isinstance(value, (str, int)):
+        return value
+    if isinstance(value, list):
+        return [_inline_copy(item, block_name, args, memo) for item in value]
+    if not isinstance(value, ir.Node):
+        if isinstance(value, dict):
+            copied_dict = type(value)()
+            for key, item in value.items():
+                copied_dict[key] = _inline_copy(item, block_name, args, memo)
+            return copied_dict
+        return copy.deepcopy(value, memo)
+
+    copied = memo.get(id(value))
+    if copied is not None:
+        return copied
+
+    cls = type(value)
+    if cls is ir.ArgRef or cls is ir.VarRef:
+        mapped = args.get(value.var.name)
+        return mapped if mapped is not None else cls(value.info, value.var)
+    if cls is ir.FunctionReturn:
+        return ir.Break(None, block_name, _inline_copy(value.expr, block_name, args, memo))
+    if cls is ir.FunctionDef:
+        # TODO: handle arg shadowing by lambdas/sub-functions
+        raise NotImplementedError
+    if cls is ir.Scope:
+        body = _inline_copy(value.body, block_name, args, memo)
+        copied = ir.Scope(value.parent, value.name, body=body, func=value.func, info=value.info)
+        memo[id(value)] = copied
+        copied.attrs = _inline_copy(value.attrs, block_name, args, memo)
+        return copied
+
+    deepcopied = _deepcopied.get(cls)
+    if deepcopied is None:
+        deepcopied = _deepcopied[cls] = hasattr(cls, "__deepcopy__")
+    if deepcopied:
+        copied = memo[id(value)] = value.__deepcopy__(memo)
+        return copied
+
+    copied = memo[id(value)] = cls.__new__(cls)
+    fields = child_fields(cls)
+    state = copied.__dict__
+    for name, attr in value.__dict__.items():
+        state[name] = _inline_copy(attr, block_name, args, memo) if name in fields else copy.deepcopy(attr, memo)
+    return copied
 
 
 def inline(node: ir.Node, func_scope: ir.Scope | None, args: list[ir.Node]) -> ir.Node:
@@ -125,7 +240,7 @@ def inline(node: ir.Node, func_scope: ir.Scope | None, args: list[ir.Node]) -> i
                         mapped_var = func_scope.register_local(var_name, ir.VarDecl(var.info, var_name, var.type_))
                         arg_map[var.name] = ir.VarRef(None, mapped_var)
 
-            body = [_inline_args(copy.deepcopy(stmt), block_name, arg_map) for stmt in node.func.scope.body]
+            body = [_inline_copy(stmt, block_name, arg_map, {}) for stmt in node.func.scope.body]
             if len(body) == 1:
                 assert body[0].type_ == node.func.type_.ret_type
                 return body[0]
@@ -149,7 +264,7 @@ def inline_scope(scope: ir.Scope, func_scope: ir.Scope | None, arg_map: dict[str
                 mapped_var = func_scope.register_local(var_name, ir.VarDecl(var.info, var_name, var.type_))
                 arg_map[var.name] = ir.VarRef(None, mapped_var)
 
-    body = [_inline_args(copy.deepcopy(stmt), block_name, arg_map) for stmt in scope.body]
+    body = [_inline_copy(stmt, block_name, arg_map, {}) for stmt in scope.body]
     if len(body) == 1:
         return body[0]
     return ir.Block(None, ir.VoidType(None), block_name, ir.Scope(func_scope, "macro", body))
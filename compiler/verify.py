@@ -0,0 +1,114 @@
+"""Verification of the invariants of the IR between passes.
+
+Each invariant holds from the pass that establishes it onwards. The verifier
+checks every invariant established so far in a single walk over the module,
+after the passes it selects:
+
+- no `UntranslatedType` is left once the type declarations are translated,
+- no `Untranslated` node is left once the function definitions are translated,
+- every `VarRef` refers to a variable declared in a scope of the module,
+- no two scopes have the same name,
+- no `UnknownType` is left once the types are resolved, outside of templates,
+- every expression has a type.
+
+The verifier is run by the `PassManager` in debug builds, release compiles
+(`python -O`) skip it entirely.
+
+    manager = PassManager(verify=Verifier(each=True))
+"""
+
+from . import ir
+from . import span
+from . import traverse_ir
+
+# Invariants established by each pass
+stages = {
+    "translate_toplevel_type_decls": ["untranslated_types"],
+    "translate_function_defs": ["untranslated_nodes", "var_refs", "scope_names"],
+    "specialize_match": ["unknown_types", "typed_exprs"],
+    # The final module is always verified
+    "done": [],
+}
+
+
+class VerificationError(Exception):
+    pass
+
+
+class Verifier:
+    """Checker of the invariants established by the passes run so far.
+
+    The module is verified after the passes in `stages`, or after every pass if
+    `each` is set.
+    """
+
+    def __init__(self, each=False):
+        self.each = each
+        self.invariants: set[str] = set()
+
+    def after(self, name, module: ir.Module):
+        self.invariants.update(stages.get(name, ()))
+        if self.each or name in stages:
+            self.verify(module, name)
+
+    def verify(self, module: ir.Module, name=None):
+        """Check the established invariants in `module`, raising a `VerificationError` on the first violation."""
+        check = self.invariants
+        untranslated_types = "untranslated_types" in check
+        untranslated_nodes = "untranslated_nodes" in check
+        unknown_types = "unknown_types" in check
+        typed_exprs = "typed_exprs" in check
+
+        declared = set()
+        var_refs = []
+        scopes: dict[str, int] = {}
+        # Nodes with whether they belong to the generic part of a template
+        stack: list = [(module, False)]
+        while stack:
+            value, generic = stack.pop()
+            if isinstance(value, list):
+                stack.extend((item, generic) for item in value)
+                continue
+            if isinstance(value, dict):
+                stack.extend((item, generic) for item in value.values())
+                continue
+            if not isinstance(value, ir.Node) or isinstance(value, ir.AstMacroDef):
+                # Macros operating on the AST are not translated
+                continue
+
+            if untranslated_types and isinstance(value, ir.UntranslatedType):
+                self._fail(name, value, "Untranslated type")
+            if untranslated_nodes and isinstance(value, ir.Untranslated):
+                self._fail(name, value, "Untranslated node")
+            if not generic:
+                if unknown_types and isinstance(value, ir.UnknownType):
+                    self._fail(name, value, "Unknown type")
+                if typed_exprs and isinstance(value, ir.Expr) and not isinstance(value.type_, ir.Type):
+                    self._fail(name, value, "Untyped expression")
+
+            if isinstance(value, ir.VarDecl):
+                declared.add(id(value))
+            elif isinstance(value, ir.VarRef):
+                var_refs.append(value)
+            elif isinstance(value, ir.Scope):
+                other = scopes.setdefault(value.name, id(value))
+                if other != id(value) and "scope_names" in check:
+                    self._fail(name, value, f"Duplicate scope name '{value.name}'")
+            elif isinstance(value, ir.TemplateDef):
+                # Only the instances of a template are resolved
+                stack.append((value.instances, generic))
+                stack.extend((getattr(value, field), True) for field in value if field not in ("info", "instances"))
+                continue
+
+            for field in traverse_ir.child_fields(type(value)):
+                stack.append((getattr(value, field, None), generic))
+
+        if "var_refs" in check:
+            for ref in var_refs:
+                if id(ref.var) not in declared:
+                    self._fail(name, ref, "Reference to undeclared variable")
+
+    @staticmethod
+    def _fail(name, node, message):
+        after = f" after {name}" if name else ""
+        raise VerificationError(f"{span.format(node.info)}: {message}{after}: {node}")
@@ -0,0 +1,172 @@
+"""Fixpoint iteration of passes over the parts of a module that are not resolved yet.
+
+After a first sweep over the whole module most definitions are fully resolved,
+only the few that still contain unresolved nodes need to be visited again. The
+definitions of the module are split into entries: the attributes of the module
+scope, with the members of type definitions as entries of their own. Entries
+are revisited until they are resolved or a visit leaves the same unresolved
+nodes, a stalled entry is only revisited when an entry it refers to changes.
+References to a member of a type also depend on the type.
+
+    worklist = Worklist(module, unresolved=(ir.UnknownType, ir.GetAttr, ir.Call))
+    worklist.run(lambda node, scope: propagate_types(resolve_member_access(node, scope)))
+"""
+
+import collections
+
+from . import ir
+from . import traverse_ir
+
+
+def scan(root, classes):
+    """Instances of `classes` and ids of the definitions referenced from `root`.
+
+    Only the nodes reachable from `root` without following references are
+    scanned, the ids of the nodes referred to are returned instead. Overloaded
+    functions are used in place of a reference to them, they are both scanned
+    and referenced.
+    """
+    found = []
+    targets = set()
+    stack = [root]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, ir.Node):
+            cls = type(value)
+            if isinstance(value, classes):
+                found.append(value)
+            fields = traverse_ir.child_fields(cls)
+            if fields:
+                for name in fields:
+                    stack.append(getattr(value, name, None))
+            else:
+                targets.update(id(v) for v in vars(value).values() if isinstance(v, ir.Node))
+            if cls is ir.OverloadedFunction:
+                targets.add(id(value))
+        elif isinstance(value, list):
+            stack += value
+        elif isinstance(value, dict):
+            stack += value.values()
+    return found, targets
+
+
+def contains(root, classes):
+    """Whether an instance of `classes` is reachable from `root` without following references."""
+    stack = [root]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, ir.Node):
+            if isinstance(value, classes):
+                return True
+            for name in traverse_ir.child_fields(type(value)):
+                stack.append(getattr(value, name, None))
+        elif isinstance(value, list):
+            stack += value
+        elif isinstance(value, dict):
+            stack += value.values()
+    return False
+
+
+class Entry:
+    __slots__ = ["scope", "name", "owner", "nodes", "unresolved", "dependencies"]
+
+    def __init__(self, scope: ir.Scope, name: str, owner: ir.TypeDef | None = None):
+        self.scope = scope
+        self.name = name
+        # Type whose member the entry is, if any
+        self.owner = owner
+        # Unresolved nodes of the entry, compared by identity to detect changes
+        self.nodes: list[ir.Node] = []
+        self.unresolved = False
+        self.dependencies: set[int] = set()
+
+    @property
+    def node(self):
+        return self.scope.attrs[self.name]
+
+
+class Worklist:
+    """Entries of `module` containing instances of the node classes `unresolved`."""
+
+    def __init__(self, module: ir.Module, unresolved: tuple[type, ...]):
+        self.module = module
+        self.unresolved = unresolved
+        # Number of visits of each entry by "scope/name"
+        self.visits: collections.Counter = collections.Counter()
+        self.pending: list[Entry] = []
+        # Ids of the members of the types of the module to the id of their type
+        self.owners: dict[int, int] = {}
+        for attr in module.scope.attrs.values():
+            if isinstance(attr, ir.TypeDef):
+                self.owners.update((id(member), id(attr)) for member in attr.scope.attrs.values())
+        for entry in self._entries(module.scope):
+            self._update(entry)
+            if entry.unresolved:
+                self.pending.append(entry)
+
+    def _entries(self, scope: ir.Scope, owner=None):
+        # In the order of a sweep over the module
+        for name, attr in scope.attrs.items():
+            # Members of a type are entries of their own if the type itself is resolved
+            if isinstance(attr, ir.TypeDef) and not attr.scope.body and not self._unresolved_fields(attr):
+                yield from self._entries(attr.scope, attr)
+            else:
+                yield Entry(scope, name, owner)
+
+    def _unresolved_fields(self, type_: ir.TypeDef):
+        fields = [getattr(type_, name, None) for name in type_ if name not in ("info", "ast_node", "scope")]
+        return contains(fields, self.unresolved)
+
+    def _update(self, entry: Entry):
+        """Record the unresolved nodes of `entry`, returning whether they changed."""
+        # Most entries are resolved, only the others need to be scanned
+        if contains(entry.node, self.unresolved):
+            nodes, targets = scan(entry.node, self.unresolved)
+            targets.update([self.owners[target] for target in targets if target in self.owners])
+        else:
+            nodes, targets = [], set()
+        # Interned nodes occur several times, resolving some of them is a change
+        changed = collections.Counter(map(id, nodes)) != collections.Counter(map(id, entry.nodes))
+        # The previous nodes are kept alive until now, so that their ids are not reused
+        entry.nodes = nodes
+        entry.unresolved = bool(nodes)
+        entry.dependencies = targets
+        return changed
+
+    def run(self, visit):
+        """Replace each pending entry with `visit(node, scope)` until no entry changes.
+
+        Entries leave the worklist once resolved or when a visit does not change
+        them. Such stalled entries are added back when one of the definitions they
+        refer to changes, and are left in `pending` at the end if still unresolved.
+        """
+        queue = collections.deque(self.pending)
+        queued = {id(entry) for entry in queue}
+        stalled: list[Entry] = []
+
+        while queue:
+            entry = queue.popleft()
+            queued.discard(id(entry))
+            before = entry.node
+            self.visits[f"{entry.scope.name}/{entry.name}"] += 1
+            entry.scope.attrs[entry.name] = visit(before, entry.scope)
+
+            if not self._update(entry) and entry.node is before:
+                if entry.unresolved:
+                    stalled.append(entry)
+                continue
+
+            changed = {id(before), id(entry.node)}
+            if entry.owner is not None:
+                changed.add(id(entry.owner))
+            woken = [other for other in stalled if other.dependencies & changed]
+            stalled = [other for other in stalled if not other.dependencies & changed]
+            if entry.unresolved:
+                woken.append(entry)
+            for other in woken:
+                if id(other) not in queued:
+                    queued.add(id(other))
+                    queue.append(other)
+
+        self.pending = stalled
+        return self.module
@@ -1,34 +1,26 @@
+import argparse
 import os
-import pprint
 import sys
 
 import compiler
 import parser
 from compiler import codegen
+from compiler.dump import Dump, formats
+from compiler.verify import Verifier
 
 std_lib_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib/prelude")
 
 
-def main(output_file, input_files):
-    code = ""
-
-    std_lib_files = [fname for fname in os.listdir(std_lib_path) if fname.endswith(".gi")]
+def main(output_file, input_files, dump=None, verify=__debug__):
+    std_lib_files = sorted(fname for fname in os.listdir(std_lib_path) if fname.endswith(".gi"))
     # std_lib_files = open(os.path.join(std_lib_path, "prelude"), "r").readlines()
-    for filename in std_lib_files:
-        with open(os.path.join(std_lib_path, filename), "r", encoding="utf8") as f:
-            code += f.read() + "\n"
-
-    for filename in input_files:
-        with open(filename, "r", encoding="utf8") as f:
-            code += f.read() + "\n"
+    std_lib_files = [os.path.join(std_lib_path, filename) for filename in std_lib_files]
 
-    prog = parser.parse_str(code)
+    prog = parser.parse_files(std_lib_files + input_files)
     if not prog:
         return 1
 
-    module = compiler.semantic_pass(prog)
-    with open(output_file + ".ir", "w", encoding="utf8") as ir_out:
-        pprint.pp(module, stream=ir_out)
+    module = compiler.semantic_pass(prog, compiler.PassManager(dump=dump, verify=verify))
 
     module = codegen.translate_wasm(module)
     wasm = codegen.wasm_repr_indented(module)
@@ -39,4 +31,18 @@ def main(output_file, input_files):
 
 
 if __name__ == "__main__":
-    quit(main(sys.argv[1], sys.argv[2:]))
+    args = argparse.ArgumentParser()
+    args.add_argument("output_file")
+    args.add_argument("input_files", nargs="*")
+    args.add_argument("--dump", action="append", metavar="PASS", help="dump the IR after PASS, or after every pass for 'all'")
+    args.add_argument("--dump-format", choices=list(formats), default="text")
+    args.add_argument("--dump-dir", help="directory of the dumps, <output_file>.dump by default")
+    args.add_argument("--verify-each", action="store_true", help="verify the IR after every pass, not only in debug builds")
+    args = args.parse_args()
+
+    dump = None
+    if args.dump:
+        passes = None if "all" in args.dump else args.dump
+        dump = Dump(passes, args.dump_format, args.dump_dir or args.output_file + ".dump")
+    verify = Verifier(each=True) if args.verify_each else __debug__
+    quit(main(args.output_file, args.input_files, dump, verify))
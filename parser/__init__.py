@@ -1,34 +1,122 @@
+import bisect
+import concurrent.futures
+import re
+
+from compiler import ast, span
+
+from . import ast_cache
+from . import codegen
 from . import lang
+from . import lexer
+from .combinators import IncompleteParse, Memo
 
+# Default bound on the number of entries kept by the packrat cache
+PACKRAT_SIZE = 1 << 16
 
-class Input:
-    def __init__(self, text, filename):
+
+class Source:
+    """Text being parsed, shared by every `Input` positioned in it."""
+
+    def __init__(self, text, filename, memo=None, file_id=None):
         self.text = text
         self.filename = filename
+        # Registered text, its id is recorded in the spans of the parsed nodes
+        self.file = span.register(filename, text) if file_id is None else span.files[file_id]
+        self.file_id = self.file.id
+        self.memo = memo
+        self._line_starts = None
+        self._tokens = None
+
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = lexer.tokenize(self.text)
+        return self._tokens
+
+    def line_starts(self):
+        if self._line_starts is None:
+            self._line_starts = [0] + [m.end() for m in re.finditer("\n", self.text)]
+        return self._line_starts
+
+    def line_column(self, pos):
+        line_starts = self.line_starts()
+        line = bisect.bisect_right(line_starts, pos)
+        return line, pos - line_starts[line - 1] + 1
+
+
+class State:
+    """Parse-time state of the grammar, e.g. operator declarations.
+
+    States are never modified: rules replace the state of their input with
+    `Input.with_state`, so that a parser backtracking to an earlier input also
+    drops the changes made since. Packrat entries are keyed on the state by identity.
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        return State({**self.values, key: value})
+
+
+empty_state = State({})
+
+
+class Input:
+    """Immutable cursor into a `Source`, line and column are computed on demand."""
+
+    __slots__ = ("text", "source", "pos", "indent", "state")
+
+    def __init__(self, text, filename, memo=None, file_id=None, state=empty_state):
+        self.source = Source(text, filename, memo, file_id)
+        self.text = text
         self.pos = 0
-        self.line = 1
-        self.column = 1
         self.indent = 1
+        self.state = state
+
+    def _at(self, pos, indent, state):
+        new = object.__new__(Input)
+        new.source = self.source
+        new.text = self.text
+        new.pos = pos
+        new.indent = indent
+        new.state = state
+        return new
+
+    @property
+    def filename(self):
+        return self.source.filename
 
-    def current(self):
-        return self.text[self.pos :]
+    @property
+    def memo(self):
+        return self.source.memo
+
+    @property
+    def line(self):
+        return self.source.line_column(self.pos)[0]
+
+    @property
+    def column(self):
+        return self.source.line_column(self.pos)[1]
+
+    def peek(self, n=1):
+        return self.text[self.pos : self.pos + n]
 
     def startswith(self, s):
         return self.text.startswith(s, self.pos)
 
     def advance(self, n):
-        new = Input(self.text, self.filename)
-        new.pos = self.pos + n
-        new.indent = self.indent
-        segment = self.text[self.pos : self.pos + n]
-        advance_lines = segment.count("\n")
-        new.line = self.line + advance_lines
-        if advance_lines > 0:
-            last_newline = segment.rfind("\n")
-            new.column = n - last_newline
-        else:
-            new.column = self.column + n
-        return new
+        return self._at(self.pos + n, self.indent, self.state)
+
+    def with_indent(self, indent):
+        return self._at(self.pos, indent, self.state)
+
+    def with_state(self, key, value):
+        return self._at(self.pos, self.indent, self.state.set(key, value))
 
     def context(self):
         start = self.text.rfind("\n", 0, self.pos) + 1
@@ -36,23 +124,143 @@ class Input:
         if end == -1:
             end = len(self.text)
         line_text = self.text[start:end]
-        lineno = f"{self.line:4}"
+        line = self.line
+        lineno = f"{line:4}"
         pointer = " " * (self.pos - start + len(lineno) + 2) + "^"
-        return f"{self.filename}:{self.line}\n{lineno}: {line_text}\n{pointer}"
+        return f"{self.filename}:{line}\n{lineno}: {line_text}\n{pointer}"
+
 
+def run_parser(parser, text, filename="<input>", packrat=False):
+    """Run `parser` over the whole of `text`.
 
-def run_parser(parser, text, filename="<input>"):
-    result, input = parser(Input(text, filename=filename))
+    `packrat` enables memoization of rule results for the duration of this call,
+    either `True` for a cache of `PACKRAT_SIZE` entries or the maximum number of
+    entries to keep. A resulting module holds its source file, the spans of other
+    nodes refer to `text` only while it is registered, see `compiler.span.register`.
+    """
+    memo = None
+    if packrat:
+        memo = Memo(PACKRAT_SIZE if packrat is True else packrat)
+    result, input = parser(Input(text, filename=filename, memo=memo))
     if input.pos != len(input.text):
         raise ValueError("Unconsumed input:\n" + input.context())
+    if isinstance(result, ast.Module):
+        result.sources = [input.source.file]
     return result
 
 
-def parse_file(filename):
+def parse_statements(text, filename="<input>", packrat=False):
+    """Yield the top-level statements of `text` as soon as each one is parsed.
+
+    Equivalent to the statements of `lang.module()`. Packrat entries are dropped
+    after every statement, as the parser never backtracks into a previous one.
+    The spans of the statements refer to `text` only while it is registered,
+    see `compiler.span.register`.
+    """
+    memo = None
+    if packrat:
+        memo = Memo(PACKRAT_SIZE if packrat is True else packrat)
+    statement = codegen.load().statement()
+    separator = lexer.skip()
+
+    _, input = separator(Input(text, filename=filename, memo=memo))
+    try:
+        stmt, input = statement(input)
+    except ValueError:
+        pass
+    else:
+        while True:
+            yield stmt
+            if memo is not None:
+                memo.entries.clear()
+            try:
+                _, input_sep = separator(input)
+            except (ValueError, IncompleteParse):
+                break
+            try:
+                stmt, input = statement(input_sep)
+            except ValueError:
+                break
+
+    _, input = separator(input)
+    if input.pos != len(input.text):
+        raise ValueError("Unconsumed input:\n" + input.context())
+
+
+def parse_file(filename, packrat=False, cache=True):
+    """Parse the file `filename`, reusing the module stored in `ast_cache` when `cache` is set."""
     with open(filename) as f:
         text = f.read()
-    return run_parser(lang.module(), text, filename=filename)
+    return _parse_source(text, filename, packrat, cache)
+
+
+def _parse_source(text, filename, packrat, cache):
+    module = ast_cache.load(text) if cache else None
+    if module is None:
+        return _parse_text(text, filename, packrat, cache)
+    return _rebase(module, filename, text)
+
+
+def _parse_text(text, filename, packrat, cache):
+    """Module of `text`, stored in `ast_cache` when `cache` is set."""
+    source = span.register(filename, text)
+    module = ast.Module(list(parse_statements(text, filename, packrat)), [source])
+    if cache:
+        ast_cache.store(text, module)
+    return module
+
+
+def _rebase(module, filename, text):
+    """Move the spans of a module loaded from `ast_cache` or parsed by another process to the file `filename`."""
+    source = span.register(filename, text)
+    for stmt in module.stmts:
+        if stmt.info is not None:
+            if span.file_id(stmt.info) != source.id:
+                span.rebase(module, source.id)
+            break
+    module.sources = [source]
+    return module
+
+
+def parse_str(code, packrat=False):
+    source = span.register("<input>", code)
+    return ast.Module(list(parse_statements(code, packrat=packrat)), [source])
+
+
+def parse_files(filenames, packrat=False, max_workers=None, cache=True):
+    """Parse each of `filenames` in a pool of `max_workers` processes.
+
+    Returns a single module with the statements of every file, in the order of
+    `filenames`. Operator declarations only apply to the file declaring them.
+    Files found in `ast_cache` are not parsed again when `cache` is set.
+    """
+    texts = []
+    for filename in filenames:
+        with open(filename) as f:
+            texts.append(f.read())
+
+    modules = [ast_cache.load(text) if cache else None for text in texts]
+    missing = [i for i, module in enumerate(modules) if module is None]
+    for filename, text, module in zip(filenames, texts, modules):
+        if module is not None:
+            _rebase(module, filename, text)
+    args = (
+        [texts[i] for i in missing],
+        [filenames[i] for i in missing],
+        [packrat] * len(missing),
+        [cache] * len(missing),
+    )
 
+    codegen.load()
+    if len(missing) < 2 or max_workers == 1:
+        parsed = map(_parse_text, *args)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+            parsed = list(map(_rebase, pool.map(_parse_text, *args), args[1], args[0]))
+    for i, module in zip(missing, parsed):
+        modules[i] = module
 
-def parse_str(code):
-    return run_parser(lang.module(), code)
+    return ast.Module(
+        [stmt for module in modules for stmt in module.stmts],
+        [source for module in modules for source in module.sources],
+    )
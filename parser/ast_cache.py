@@ -0,0 +1,94 @@
+"""Persistent cache of the modules parsed from source files.
+
+Modules are pickled and compressed into a file named after the hash of the
+source text, in a directory named after the parser version: the generated
+grammar module and every module shaping the pickled nodes and their spans.
+Entries are written to a temporary file and renamed into place, so concurrent
+writers never expose a partial entry.
+
+The cache is kept in `$GUIBEI_AST_CACHE`, by default in `guibei/ast` under the
+user cache directory, and may be shared by several checkouts.
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import zlib
+
+from parser import codegen
+
+base_dir = os.path.dirname(codegen.parser_dir)
+
+# One subdirectory of entries per parser version
+cache_root = os.environ.get(
+    "GUIBEI_AST_CACHE",
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "guibei", "ast"),
+)
+
+# Other parser versions are removed once no entry was written to them for this many seconds
+max_age = 30 * 24 * 3600
+
+# Files determining the cached modules, besides the dependencies of the generated grammar
+dependencies = [
+    "parser/__init__.py",
+    "parser/ast_cache.py",
+    "parser/lexer.py",
+    "compiler/ast.py",
+    "compiler/span.py",
+]
+
+
+@functools.cache
+def version():
+    h = hashlib.sha256(codegen.source_hash().encode())
+    for name in dependencies:
+        with open(os.path.join(base_dir, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def cache_dir():
+    return os.path.join(cache_root, version())
+
+
+def _path(text):
+    return os.path.join(cache_dir(), hashlib.sha256(text.encode()).hexdigest() + ".ast")
+
+
+def load(text):
+    """Module previously stored for `text`, or `None`."""
+    try:
+        with open(_path(text), "rb") as f:
+            return pickle.loads(zlib.decompress(f.read()))
+    except (OSError, EOFError, zlib.error, pickle.UnpicklingError):
+        return None
+
+
+def store(text, module):
+    directory = cache_dir()
+    try:
+        if not os.path.isdir(directory):
+            _prune()
+            os.makedirs(directory, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(zlib.compress(pickle.dumps(module, pickle.HIGHEST_PROTOCOL)))
+        os.replace(tmp, _path(text))
+    except OSError:
+        # The cache is an optimization, parsing does not fail when it cannot be written
+        pass
+
+
+def _prune():
+    # Other versions may still be in use by another checkout sharing the cache
+    if not os.path.isdir(cache_root):
+        return
+    deadline = time.time() - max_age
+    for entry in os.scandir(cache_root):
+        if entry.name != version() and entry.is_dir() and entry.stat().st_mtime < deadline:
+            shutil.rmtree(entry.path, ignore_errors=True)
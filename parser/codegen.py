@@ -0,0 +1,329 @@
+"""Ahead-of-time translation of the grammar into a plain recursive-descent module.
+
+The `@generate` rules of `parser/indent.py` and `parser/lang.py` are rewritten
+into functions that call their sub-parsers directly instead of going through a
+generator: `x = yield p` becomes `x, input = p(input)`. Sub-parsers built from
+constant arguments are constructed once when the module is loaded, and constant
+`regex` and `string` primitives are matched inline.
+
+The generated source is cached on disk and regenerated whenever the grammar, the
+combinators or this module change.
+"""
+
+import ast
+import functools
+import hashlib
+import importlib.util
+import os
+import sys
+
+parser_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Modules whose rules are translated, in dependency order
+sources = ["indent", "lang"]
+# Files whose contents determine the generated module
+dependencies = ["combinators.py", "indent.py", "lexer.py", "lang.py", "codegen.py"]
+
+cache_dir = os.environ.get("GUIBEI_PARSER_CACHE", os.path.join(parser_dir, "__pycache__"))
+
+_header = """
+from __future__ import annotations
+import re as _re
+from parser.combinators import *
+from parser.combinators import IncompleteParse as _IncompleteParse
+from parser.combinators import ParseError as _ParseError
+from parser.combinators import cached as _cached
+from parser.combinators import rule as _rule
+from parser import indent as _indent
+from compiler.ast import Node as _Node
+from compiler.span import make as _make_span
+from parser import lang as _lang
+"""
+
+
+def _name(id, ctx=ast.Load):
+    return ast.Name(id, ctx())
+
+
+def _assign(target, value):
+    if isinstance(target, str):
+        target = _name(target, ast.Store)
+    return ast.Assign([target], value)
+
+
+def _parse_stmt(code, **names):
+    """Parse the statement `code`, substituting the expressions in `names` for their identifiers."""
+
+    class Substitute(ast.NodeTransformer):
+        def visit_Name(self, node):
+            return names.get(node.id, node)
+
+    return Substitute().visit(ast.parse(code).body[0])
+
+
+def _contains(node, types):
+    return any(isinstance(n, types) for n in ast.walk(node))
+
+
+class _Constants:
+    """Module level values computed once after every rule is defined."""
+
+    def __init__(self):
+        self.names = {}
+        self.assignments = []
+
+    def add(self, prefix, value):
+        key = (prefix, ast.dump(value))
+        name = self.names.get(key)
+        if name is None:
+            name = self.names[key] = f"_{prefix}{len(self.names)}"
+            self.assignments.append(_assign(name, value))
+        return name
+
+
+class _Rule:
+    """Translation of one `@generate` rule."""
+
+    def __init__(self, func, module, constants):
+        self.func = func
+        self.module = module
+        self.constants = constants
+        self.temps = 0
+
+        arguments = func.args
+        params = {a.arg for a in arguments.posonlyargs + arguments.args + arguments.kwonlyargs}
+        params |= {a.arg for a in (arguments.vararg, arguments.kwarg) if a is not None}
+        stored = {n.id for n in ast.walk(func) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)}
+        if params & stored:
+            raise NotImplementedError(f"{func.name}: rule assigns to its parameters {params & stored}")
+        self.locals = params | stored | {"input"}
+
+    def constant(self, node):
+        """Whether `node` can be evaluated once at module level."""
+        if _contains(node, (ast.Yield, ast.Lambda, ast.NamedExpr, ast.comprehension)):
+            return False
+        return not any(isinstance(n, ast.Name) and n.id in self.locals for n in ast.walk(node))
+
+    def temp(self):
+        self.temps += 1
+        return f"_y{self.temps}"
+
+    def call(self, node, target):
+        """Statements running the parser yielded by `node`, storing its result in `target`."""
+        p = node.value
+        code = [_assign("_line", ast.Constant(node.lineno))]
+
+        match p:
+            case ast.Call(func=ast.Name(id="regex"), args=[pattern], keywords=[]) if self.constant(pattern):
+                group = ast.Constant(0)
+            case ast.Call(func=ast.Name(id="regex"), args=[pattern, group], keywords=[]) if self.constant(p):
+                pass
+            case ast.Call(
+                func=ast.Name(id="regex"), args=[pattern], keywords=[ast.keyword(arg="group", value=group)]
+            ) if self.constant(p):
+                pass
+            case ast.Call(func=ast.Name(id="string"), args=[ast.Constant(value=str(s))], keywords=[]):
+                code.append(
+                    _parse_stmt(
+                        "if not input.startswith(s): raise _ParseError(input, expected)",
+                        s=ast.Constant(s),
+                        expected=ast.Constant(repr(s)),
+                    )
+                )
+                if target is not None:
+                    code.append(_assign(target, ast.Constant(s)))
+                code.append(_parse_stmt("input = input.advance(n)", n=ast.Constant(len(s))))
+                return code
+            case _:
+                if self.constant(p):
+                    p = _name(self.constants.add("p", p))
+                target = target or _name("_", ast.Store)
+                targets = ast.Tuple([target, _name("input", ast.Store)], ast.Store())
+                code.append(_assign(targets, ast.Call(p, [_name("input")], [])))
+                return code
+
+        compiled = ast.Call(ast.Attribute(_name("_re"), "compile", ast.Load()), [pattern], [])
+        match = self.constants.add("match", ast.Attribute(compiled, "match", ast.Load()))
+        expected = self.constants.add("expected", _parse_stmt('"pattern /" + pattern + "/"', pattern=pattern).value)
+        code.append(_parse_stmt("_m = match(input.text, input.pos)", match=_name(match)))
+        code.append(_parse_stmt("if _m is None: raise _ParseError(input, expected)", expected=_name(expected)))
+        if target is not None:
+            code.append(_assign(target, _parse_stmt("_m.group(g)", g=group).value))
+        code.append(_parse_stmt("input = input.advance(_m.end() - input.pos)"))
+        return code
+
+    def hoist(self, node, code):
+        """Replace the yields in the expression `node`, appending the statements running them to `code`."""
+        rule = self
+
+        class Hoist(ast.NodeTransformer):
+            def visit_Yield(self, node):
+                self.generic_visit(node)
+                target = rule.temp()
+                code.extend(rule.call(node, _name(target, ast.Store)))
+                return _name(target)
+
+            def visit_Lambda(self, node):
+                return node
+
+        return Hoist().visit(node)
+
+    def statement(self, stmt):
+        code = []
+        match stmt:
+            case ast.Expr(value=ast.Yield() as node):
+                code.extend(self.call(node, None))
+            case ast.Assign(targets=[target], value=ast.Yield() as node):
+                code.extend(self.call(node, target))
+            case ast.Return(value=value):
+                value = self.hoist(value, code) if value is not None else ast.Constant(None)
+                if not isinstance(value, ast.Constant):
+                    # Returned nodes are given their span as in `generate`
+                    code.append(_assign("_r", value))
+                    code.append(
+                        _parse_stmt(
+                            "if isinstance(_r, _Node) and _r.info is None:"
+                            " _r.info = _make_span(input.source.file_id, _pos, input.pos)"
+                        )
+                    )
+                    value = _name("_r")
+                code.append(ast.Return(ast.Tuple([value, _name("input")], ast.Load())))
+            case ast.If():
+                stmt.test = self.hoist(stmt.test, code)
+                stmt.body = self.statements(stmt.body)
+                stmt.orelse = self.statements(stmt.orelse)
+                code.append(stmt)
+            case ast.For():
+                stmt.iter = self.hoist(stmt.iter, code)
+                stmt.body = self.statements(stmt.body)
+                stmt.orelse = self.statements(stmt.orelse)
+                code.append(stmt)
+            case ast.While() if not _contains(stmt.test, ast.Yield):
+                stmt.body = self.statements(stmt.body)
+                stmt.orelse = self.statements(stmt.orelse)
+                code.append(stmt)
+            case ast.Assign() | ast.AugAssign() | ast.AnnAssign() | ast.Expr():
+                code.append(self.hoist(stmt, code))
+            case _ if not _contains(stmt, (ast.Yield, ast.Return)):
+                code.append(stmt)
+            case _:
+                raise NotImplementedError(f"{self.func.name}:{stmt.lineno}: unsupported statement")
+        return code
+
+    def statements(self, body):
+        return [s for stmt in body for s in self.statement(stmt)]
+
+    def translate(self):
+        name = self.func.name
+        body = self.statements(self.func.body)
+        if not isinstance(body[-1], ast.Return):
+            body.append(_parse_stmt("return None, input"))
+
+        run = _parse_stmt(
+            """
+def run(input):
+    _pos = input.pos
+    try:
+        pass
+    except ValueError as _e:
+        if input.pos != _pos:
+            raise _IncompleteParse(_e, name, filename, _line) from None
+        raise
+""",
+            name=ast.Constant(name),
+            filename=ast.Attribute(_name(f"_{self.module}"), "__file__", ast.Load()),
+        )
+        run.body[1].body = body
+
+        factory = ast.FunctionDef(
+            name=name,
+            args=self.func.args,
+            body=[run, _parse_stmt("return _rule(name, run)", name=ast.Constant(name))],
+            decorator_list=[_name("_cached")],
+        )
+        return ast.copy_location(factory, self.func)
+
+
+def _is_rule(stmt):
+    return isinstance(stmt, ast.FunctionDef) and any(
+        isinstance(d, ast.Name) and d.id == "generate" for d in stmt.decorator_list
+    )
+
+
+def _is_source_import(stmt):
+    if isinstance(stmt, ast.ImportFrom):
+        return stmt.module == "__future__" or stmt.module in (f"parser.{m}" for m in sources)
+    return False
+
+
+def generate_source():
+    """Source of the module equivalent to `parser.lang` with every rule translated."""
+    constants = _Constants()
+    body = ast.parse(_header).body
+
+    for module in sources:
+        with open(os.path.join(parser_dir, f"{module}.py"), encoding="utf8") as f:
+            tree = ast.parse(f.read())
+        for stmt in tree.body:
+            if _is_source_import(stmt):
+                continue
+            if _is_rule(stmt):
+                stmt = _Rule(stmt, module, constants).translate()
+            body.append(stmt)
+
+    body.extend(constants.assignments)
+    module = ast.fix_missing_locations(ast.Module(body, []))
+    return f"# Generated by parser/codegen.py from {', '.join(f'parser/{m}.py' for m in sources)}\n" + ast.unparse(
+        module
+    )
+
+
+def source_hash():
+    h = hashlib.sha256(sys.version.encode())
+    for name in dependencies:
+        with open(os.path.join(parser_dir, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def _write(path, source):
+    os.makedirs(cache_dir, exist_ok=True)
+    # Modules of other grammar versions, concurrent processes may be loading the same one as this
+    for fname in os.listdir(cache_dir):
+        if fname.startswith("lang_") and fname.endswith(".py") and fname != os.path.basename(path):
+            try:
+                os.remove(os.path.join(cache_dir, fname))
+            except FileNotFoundError:
+                pass
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf8") as f:
+        f.write(source)
+    os.replace(tmp, path)
+
+
+def _exec(source):
+    module = type(sys)("parser.generated")
+    exec(compile(source, "<generated grammar>", "exec"), module.__dict__)
+    return module
+
+
+@functools.cache
+def load():
+    """Generated grammar module, regenerated if the cached one is missing or stale."""
+    path = os.path.join(cache_dir, f"lang_{source_hash()}.py")
+    source = None
+    if not os.path.exists(path):
+        source = generate_source()
+        try:
+            _write(path, source)
+        except OSError:
+            return _exec(source)
+
+    spec = importlib.util.spec_from_file_location("parser.generated", path)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except FileNotFoundError:
+        # Removed by a process running another version of the grammar
+        return _exec(source or generate_source())
+    return module
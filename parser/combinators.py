@@ -2,91 +2,248 @@ import functools
 import linecache
 import re
 import sys
+import weakref
+
+from compiler import ast, span
+
+
+class ParseError(ValueError):
+    """Failure to match `expected` at `input`.
+
+    Failures are raised for every rejected alternative and are nearly always
+    caught by `choice`, `optional` or `many`, so only the position and the
+    expectation are recorded. The message is formatted when it is displayed.
+    """
+
+    def __init__(self, input, expected, found=None, cause=None):
+        super().__init__(input, expected)
+        self.input = input
+        self.expected = expected
+        self.found = found
+        self.cause = cause
+
+    def __str__(self):
+        if self.cause is not None:
+            return str(self.cause)
+
+        expected = self.expected
+        if isinstance(expected, tuple):
+            expected = " ".join(map(str, expected))
+
+        found = self.found
+        if found is None:
+            next_char = self.input.peek()
+            found = repr(next_char) if next_char else "{eof}"
+
+        return f"{self.input.context()}\nExpected {expected}, found {found}"
+
+    def __reduce__(self):
+        # The input refers to the whole source and parser state, only the message is sent to other processes
+        return ParseError, (None, None, None, str(self))
 
 
 class IncompleteParse(Exception):
-    pass
+    """Failure of the rule `name` after it had already consumed input."""
+
+    def __init__(self, reason, name, filename, lineno):
+        super().__init__(reason, name, filename, lineno)
+        self.reason = reason
+        self.name = name
+        self.filename = filename
+        self.lineno = lineno
+
+    def __str__(self):
+        context = ""
+        context += f"In parser {self.name}\n"
+        context += f"{self.filename}:{self.lineno}\n"
+
+        for lineno in range(self.lineno - 3, self.lineno + 2):
+            line = linecache.getline(self.filename, lineno).strip("\n")
+            prefix = "->" if lineno == self.lineno else "  "
+            context += f"{lineno:4}: {prefix} {line}\n"
+
+        context += "\n"
+        context += str(self.reason)
+        return context
+
+
+class Memo:
+    """Bounded packrat cache shared by every `Input` of a single `run_parser` call.
+
+    Maps `(rule, pos, indent, state)` keys to the `(result, input)` pair returned
+    by the rule, or to the exception it raised. Once `max_size` entries are
+    stored the oldest ones are evicted first.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = {}
+
+    def __call__(self, key, p, input):
+        entry = self.entries.get(key)
+        if entry is None:
+            try:
+                entry = p(input)
+            except (ValueError, IncompleteParse) as e:
+                entry = e.with_traceback(None)
+            if len(self.entries) >= self.max_size:
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = entry
+
+        if isinstance(entry, Exception):
+            raise entry
+
+        return entry
+
+
+def cached(f):
+    """Build the parser returned by the factory `f` once per distinct set of arguments.
+
+    Grammar rules are created from inside other rules every time those run, so
+    reusing the parser objects avoids rebuilding the combinator graph on each
+    invocation. Factories called with unhashable arguments build a new parser.
+    """
+    parsers = {}
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(kwargs.items()))
+        try:
+            return parsers[key]
+        except KeyError:
+            parser = parsers[key] = f(*args, **kwargs)
+            return parser
+        except TypeError:
+            return f(*args, **kwargs)
+
+    return wrapper
+
+
+@cached
+def memo(p):
+    def parser(input):
+        memo = input.source.memo
+        if memo is None:
+            return p(input)
+        return memo((parser, input.pos, input.indent, input.state), p, input)
+
+    return parser
+
+
+# `parser.profile.Profile` collecting the statistics of rules and regexes, if any
+profiler = None
+
+# Parsers whose statistics are collected while profiling, mapped to the closure
+# variable replaced by `instrument`, the name of their statistics and its original value
+_instrumented = weakref.WeakKeyDictionary()
+# Wrappers installed by `instrument`, by closure variable
+_wrappers = None
+
+
+def _cell(parser, var):
+    return parser.__closure__[parser.__code__.co_freevars.index(var)]
+
+
+def _instrumentable(parser, var, name):
+    cell = _cell(parser, var)
+    _instrumented[parser] = (var, name, cell.cell_contents)
+    if _wrappers is not None:
+        cell.cell_contents = _wrappers[var](name, cell.cell_contents)
+    return parser
+
+
+def instrument(wrappers):
+    """Replace the closure variable `var` of the rules and regexes by `wrappers[var](name, value)`.
+
+    Parsers created later are wrapped as they are built, until `instrument(None)`
+    restores the original values. Uninstrumented parsers run no profiling code.
+    """
+    global _wrappers
+    _wrappers = wrappers
+    for parser, (var, name, original) in list(_instrumented.items()):
+        _cell(parser, var).cell_contents = original if wrappers is None else wrappers[var](name, original)
+
+
+def rule(name, run):
+    """Parser for the rule `name` parsed by `run`, memoized when packrat parsing is enabled."""
+
+    def parser(input):
+        memo = input.source.memo
+        if memo is None:
+            return run(input)
+        return memo((parser, input.pos, input.indent, input.state), run, input)
+
+    parser.__name__ = name
+    return _instrumentable(parser, "run", name)
 
 
 def generate(f):
+    @cached
     @functools.wraps(f)
     def wrapper(*args, **kwargs):
-        def parser(input):
+        def run(input):
             initial_pos = input.pos
             gen = f(*args, **kwargs)
             result = None
             try:
                 while True:
                     p = gen.send(result)
-                    prev_pos = input.pos
-                    # print("PARSER", getattr(p, "parser_debug", p))
                     result, input = p(input)
-                    # if input.pos > prev_pos:
-                    #     print("CONSUMED", repr(input.text[prev_pos:input.pos]), "CUR", repr(input.current()[:10]), gen, getattr(p, "parser_debug", p))
             except StopIteration as e:
-                return e.value, input
+                result = e.value
+                # Nodes keep the span of the innermost rule returning them
+                if isinstance(result, ast.Node) and result.info is None:
+                    result.info = span.make(input.source.file_id, initial_pos, input.pos)
+                return result, input
             except ValueError as e:
-                frame_lineno = gen.gi_frame.f_lineno
-                filename = gen.gi_code.co_filename
-                context = ""
-                context += f"In parser {f.__name__}\n"
-                context += f"{filename}:{frame_lineno}\n"
-
-                for lineno in range(frame_lineno - 3, frame_lineno + 2):
-                    line = linecache.getline(filename, lineno).strip("\n")
-                    prefix = "->" if lineno == frame_lineno else "  "
-                    context += f"{lineno:4}: {prefix} {line}\n"
-
-                context += "\n"
-                context += e.args[0]
-
                 if input.pos != initial_pos:
-                    raise IncompleteParse(context) from e
-                else:
-                    raise ValueError(context) from e
+                    raise IncompleteParse(e, f.__name__, gen.gi_code.co_filename, gen.gi_frame.f_lineno) from None
+                raise
 
-        parser.__name__ = f.__name__
-        return parser
+        return rule(f.__name__, run)
 
     return wrapper
 
 
+@cached
 def string(s):
+    expected = repr(s)
+
     def parser(input):
         if input.startswith(s):
             return s, input.advance(len(s))
         else:
-            found = repr(input.current()[0]) if input.current() else "{eof}"
-            raise ValueError(input.context() + f"\nExpected {repr(s)}, found {found}")
+            raise ParseError(input, expected)
 
     return parser
 
 
+@cached
 def regex(pattern, group=0):
-    compiled = re.compile(pattern)
+    match = re.compile(pattern).match
+    expected = f"pattern /{pattern}/"
 
     def parser(input):
-        match = compiled.match(input.current())
-        if match:
-            return match.group(group), input.advance(len(match.group(0)))
+        m = match(input.text, input.pos)
+        if m:
+            return m.group(group), input.advance(m.end() - m.start())
         else:
-            found = repr(input.current()[0]) if input.current() else "{eof}"
-            raise ValueError(input.context() + f"\nExpected pattern /{pattern}/, found {found}")
+            raise ParseError(input, expected)
 
-    parser.parser_debug = f"regex({repr(pattern)}, group={group})"
-    return parser
+    return _instrumentable(parser, "match", expected)
 
 
+@cached
 def eof():
     def parser(input):
         if input.pos != len(input.text):
-            found = repr(input.current()[0])
-            raise ValueError(input.context() + f"\nExpected {{eof}}, found {found}")
+            raise ParseError(input, "{eof}")
         return None, input
 
     return parser
 
 
+@cached
 def choice(*parsers):
     def parser(input):
         last_error = None
@@ -100,6 +257,22 @@ def choice(*parsers):
     return parser
 
 
+def dispatch(key, rules, default):
+    """Select the alternative in `rules` by the text `key` matches at the input position.
+
+    Inputs whose key has no entry in `rules` are parsed with `default`.
+    """
+    compiled = re.compile(key)
+
+    def parser(input):
+        match = compiled.match(input.text, input.pos)
+        p = rules.get(match.group(), default) if match else default
+        return p(input)
+
+    return parser
+
+
+@cached
 def many(p):
     def parser(input):
         results = []
@@ -114,6 +287,7 @@ def many(p):
     return parser
 
 
+@cached
 def optional(p):
     def parser(input):
         try:
@@ -124,6 +298,7 @@ def optional(p):
     return parser
 
 
+@cached
 def sequence(*parsers, index=None):
     def parser(input):
         results = []
@@ -139,6 +314,7 @@ def sequence(*parsers, index=None):
     return parser
 
 
+@cached
 def sep_by(sep, p, min_count=0):
     def parser(input):
         results = []
@@ -171,16 +347,18 @@ def sep_by(sep, p, min_count=0):
     return parser
 
 
+@cached
 def backtrack(p):
     def parser(input):
         try:
             return p(input)
         except IncompleteParse as e:
-            raise ValueError("backtrack") from e
+            raise ParseError(input, "backtrack", cause=e) from None
 
     return parser
 
 
+@cached
 def not_followed_by(p):
     def parser(input):
         try:
@@ -188,8 +366,7 @@ def not_followed_by(p):
         except (ValueError, IncompleteParse) as e:
             return (), input
 
-        found = repr(input.current()[0]) if input.current() else "{eof}"
-        raise ValueError(input.context() + f"\nExpected not to match, but found {found}")
+        raise ParseError(input, "not to match")
 
     return parser
 
@@ -204,7 +381,7 @@ def debug_context():
 
 def debug_current(n):
     def parser(input):
-        return input.current()[:n], input
+        return input.peek(n), input
 
     return parser
 
@@ -0,0 +1,130 @@
+"""Incremental reparsing of a source text edited between parses.
+
+The text is split into chunks at lines that can start a top-level statement:
+lines beginning in the first column with a name, `:[` or `:for`, except for the
+`else` and `elif` continuations of an `if`. Chunks whose text and incoming parser
+state (e.g. declared operators) match a chunk of the previous parse reuse its
+statements, so only the chunks touched by an edit are parsed again. The spans of
+reused statements are moved to their new offsets.
+
+A statement is parsed from at most `max_chunks` consecutive chunks. Texts with
+a syntax error are parsed once more as a whole to report it, and the chunks
+kept for the next parse are those of the last successful one and the chunks
+parsed before the error.
+"""
+
+import bisect
+import re
+
+from compiler import ast, span
+from parser import Input, codegen, empty_state, run_parser
+from parser.combinators import IncompleteParse
+
+_chunk_start = re.compile(r"^(?=[_a-zA-Z]|:\[|:for\b)(?!(else|elif)\b)", re.MULTILINE)
+
+# Number of chunks a statement can span, e.g. a `:[` annotation line and the function it annotates
+max_chunks = 3
+
+
+class Chunk:
+    """Top-level statements parsed from `text` with the parser state `state_in`."""
+
+    def __init__(self, head, start, text, state_in, state_out, stmts):
+        # Text up to the second line starting a statement, used to look the chunk up
+        self.head = head
+        # Offset of the chunk in the text its statement spans refer to
+        self.start = start
+        self.text = text
+        self.state_in = state_in
+        self.state_out = state_out
+        self.stmts = stmts
+
+
+class IncrementalParser:
+    """Parser for successive versions of one text, reusing the statements of unchanged chunks.
+
+    Statement nodes of unchanged chunks are shared between the returned modules.
+    """
+
+    def __init__(self, filename="<input>", grammar=None):
+        self.filename = filename
+        self.grammar = grammar or codegen.load()
+        self.chunks = {}
+        # Number of chunks parsed by the last call to `parse`
+        self.parsed = 0
+        # Spans refer to the last parsed text
+        self.file = None
+
+    def parse(self, text):
+        if self.file is None:
+            self.file = span.register(self.filename, text, shared=False)
+        else:
+            span.update(self.file.id, text)
+
+        starts = [m.start() for m in _chunk_start.finditer(text)]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        starts.append(len(text))
+        boundaries = set(starts)
+
+        self.parsed = 0
+        available = {head: list(candidates) for head, candidates in self.chunks.items()}
+        chunks = []
+        state = empty_state
+        i = 0
+        while i < len(starts) - 1:
+            chunk = self._reuse(available, text, starts[i], starts[i + 1], state, boundaries)
+            if chunk is None:
+                chunk = self._parse_chunk(text, starts, i, state)
+                if chunk is None:
+                    # Chunks parsed so far are still valid for the next edit
+                    for done in chunks:
+                        if done not in self.chunks.get(done.head, ()):
+                            self.chunks.setdefault(done.head, []).append(done)
+                    # Report the error at its position in the whole text
+                    return run_parser(self.grammar.module(), text, filename=self.filename)
+            elif chunk.start != starts[i]:
+                span.rebase(chunk.stmts, self.file.id, starts[i] - chunk.start)
+                chunk.start = starts[i]
+
+            chunks.append(chunk)
+            state = chunk.state_out
+            i = bisect.bisect_left(starts, starts[i] + len(chunk.text))
+
+        self.chunks = {}
+        for chunk in chunks:
+            self.chunks.setdefault(chunk.head, []).append(chunk)
+
+        return ast.Module([stmt for chunk in chunks for stmt in chunk.stmts], [self.file])
+
+    def _reuse(self, available, text, start, end, state, boundaries):
+        candidates = available.get(text[start:end], [])
+        for i, chunk in enumerate(candidates):
+            if (
+                chunk.state_in.values == state.values
+                and text.startswith(chunk.text, start)
+                and start + len(chunk.text) in boundaries
+            ):
+                # Each chunk is placed once, its spans are moved to the new offset
+                del candidates[i]
+                return chunk
+        return None
+
+    def _parse_chunk(self, text, starts, i, state):
+        # A statement can span several chunk starts, e.g. after a `:[` annotation line
+        for j in range(i + 1, min(i + 1 + max_chunks, len(starts))):
+            chunk_text = text[starts[i] : starts[j]]
+            input = Input(chunk_text, self.filename, file_id=self.file.id, state=state)
+            try:
+                module, input = self.grammar.module()(input)
+            except (ValueError, IncompleteParse):
+                continue
+            if input.pos != len(chunk_text):
+                continue
+
+            self.parsed += 1
+            span.rebase(module.stmts, self.file.id, starts[i])
+            head = text[starts[i] : starts[i + 1]]
+            return Chunk(head, starts[i], chunk_text, state, input.state, module.stmts)
+
+        return None
@@ -1,60 +1,65 @@
 from parser.combinators import *
 
 
+@cached
 def with_pos(p):
     def parser(input):
-        indent = input.indent
-        input.indent = input.column
-        result, input = p(input)
-        input.indent = indent
-        return result, input
+        result, output = p(input.with_indent(input.column))
+        return result, output.with_indent(input.indent)
 
     return parser
 
 
+@cached
 def same_indent():
     def parser(input):
-        if input.column != input.indent:
-            raise ValueError(input.context() + f"\nExpected indent == {input.indent}, found {input.column}")
+        column = input.column
+        if column != input.indent:
+            raise ParseError(input, ("indent ==", input.indent), column)
         return None, input
 
     return parser
 
 
+@cached
 def indented():
     def parser(input):
-        if input.column <= input.indent:
-            raise ValueError(input.context() + f"\nExpected indent > {input.indent}, found {input.column}")
+        column = input.column
+        if column <= input.indent:
+            raise ParseError(input, ("indent >", input.indent), column)
         return None, input
 
     return parser
 
 
 @generate
-def indented_block(p):
-    @generate
-    def next_line():
-        yield regex(r"\s*\n\s*")
-        yield same_indent()
+def _next_line():
+    yield regex(r"\s*\n\s*")
+    yield same_indent()
+
 
+@generate
+def indented_block(p):
     yield regex(r"\s*")
     yield indented()
-    body = yield with_pos(sep_by(next_line(), p, min_count=1))
+    body = yield with_pos(sep_by(_next_line(), p, min_count=1))
     return body
 
 
+@cached
 def indent_spaces():
     compiled = re.compile(r"\s*")
 
     def parser(input):
         res = ""
-        match = compiled.match(input.current())
+        match = compiled.match(input.text, input.pos)
         if match:
             res = match.group(0)
-            input = input.advance(len(match.group(0)))
+            input = input.advance(len(res))
 
-        if input.column < input.indent:
-            raise ValueError(input.context() + f"\nUnexpected indent level")
+        column = input.column
+        if column < input.indent:
+            raise ParseError(input, ("indent >=", input.indent), column)
 
         return res, input
 
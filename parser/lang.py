@@ -1,7 +1,13 @@
+from __future__ import annotations
+
+import dataclasses
+import re
+
 from parser.combinators import *
 from parser.indent import *
+from parser.lexer import NAME, INT, STR, token, skip
 
-from compiler import ast
+from compiler import ast, span
 
 operator_characters = r"!$%&'*+-./:;<=>?@\^`|~"
 
@@ -11,33 +17,85 @@ def comment():
     yield regex(r"#[^\n]*(\s*#[^\n]*)*")
 
 
+# Terms of `asm:` blocks, alternatives are tried in order
+_wast_term = re.compile(
+    r"(?P<attr>[a-z]+=\d+)"
+    r"|(?P<name>[a-z]\w*(\.[a-z]\w*)?)"
+    r"|(?P<int>-?(0x)?\d+)"
+    r'|(?P<str>"[^"]*")'
+    r"|(?P<id>[$\w.]+)"
+    r"|(?P<open>\(\s*)"
+    r"|(?P<splice>\{)"
+)
+_wast_space = re.compile(r"\s*")
+_wast_close = re.compile(r"\s*\)")
+
+
+def _scan_wast(input, pos, indent):
+    """`ast.WasmExpr` of the terms starting at `pos` and the position after its last term.
+
+    Terms after the first one are separated by blanks ending at a column >= `indent`.
+    """
+    text = input.text
+    terms = []
+    end = pos
+    while True:
+        term_pos = end
+        if terms:
+            term_pos = _wast_space.match(text, end).end()
+            if term_pos - text.rfind("\n", 0, term_pos) < indent:
+                break
+
+        match = _wast_term.match(text, term_pos)
+        if match is None:
+            break
+
+        kind = match.lastgroup
+        if kind == "int":
+            try:
+                term = int(match.group())
+            except ValueError:
+                raise ParseError(input.advance(term_pos - input.pos), "integer") from None
+            end = match.end()
+        elif kind == "open":
+            start = match.end()
+            term, inner_end = _scan_wast(input, start, start - text.rfind("\n", 0, start))
+            close = _wast_close.match(text, inner_end)
+            if close is None:
+                raise ParseError(input.advance(inner_end - input.pos), "')'")
+            end = close.end()
+        elif kind == "splice":
+            term, rest = expr()(input.advance(match.end() - input.pos).with_indent(indent))
+            if not rest.startswith("}"):
+                raise ParseError(rest, "'}'")
+            end = rest.pos + 1
+        else:
+            term = match.group()
+            end = match.end()
+        terms.append(term)
+
+    node = ast.WasmExpr(terms)
+    node.info = span.make(input.source.file_id, pos, end)
+    return node, end
+
+
+@cached
+def _wast_expr():
+    """WebAssembly s-expression terms scanned in a single pass, `{...}` splices are parsed with `expr`."""
+
+    def parser(input):
+        node, end = _scan_wast(input, input.pos, input.column)
+        return node, input.advance(end - input.pos)
+
+    return parser
+
+
 @generate
 def asm():
-    @generate
-    def wast_term():
-        @generate
-        def int_literal():
-            return int((yield regex(r"-?(0x)?\d+")))
-
-        term = yield choice(
-            regex(r"[a-z]+=\d+"),
-            regex(r"[a-z]\w*(\.[a-z]\w*)?"),
-            int_literal(),
-            regex(r'"[^"]*"'),
-            regex(r"[$\w.]+"),
-            parens(wast_expr()),
-            bracers(expr()),
-        )
-        return term
-
-    @generate
-    def wast_expr():
-        return ast.WasmExpr((yield sep_by(indent_spaces(), wast_term())))
-
     yield string("asm:")
     yield regex(r"\s*")
     yield indented()
-    asm = yield with_pos(wast_expr())
+    asm = yield _wast_expr()
     return ast.Asm(asm)
 
 
@@ -65,9 +123,10 @@ def const_decl():
 
 
 @generate
-def assignment():
+def expr_statement():
     lvalue = yield expr()
-    yield regex(r"\s*=\s*")
+    if (yield optional(regex(r"\s*=\s*"))) is None:
+        return lvalue
     value = yield expr()
     return ast.Assignment(lvalue, value)
 
@@ -78,12 +137,12 @@ def macro_def():
     ast_macro = yield optional(string(":"))
     name = yield choice(identifier(), operator_identifier())
     yield regex(r" *")
-    args = yield _function_args()
-    ret_type = yield (optional(_function_ret()))
+    type_ = yield _function_signature(optional(_function_ret()))
     yield regex(r" *:")
     body = yield indented_block(statement())
 
-    func = ast.FunctionDef(name.name, ast.FunctionType(args, ret_type), body)
+    func = ast.FunctionDef(name.name, type_, body)
+    func.info = span.join(name.info, body[-1].info)
 
     if ast_macro:
         return ast.AstMacroDef(name.name, func)
@@ -105,12 +164,11 @@ def function_def():
     yield regex("func +")
     name = yield choice(identifier(), operator_identifier())
     yield regex(r" *")
-    args, ret_type = yield sequence(_function_args(), _function_ret())
+    type_ = yield _function_signature(_function_ret())
     if (yield optional(regex(r" *:"))):
         body = yield indented_block(statement())
     else:
         body = []
-    type_ = ast.FunctionType(args, ret_type)
     func = ast.FunctionDef(name.name, type_, body)
 
     if annotations:
@@ -123,10 +181,22 @@ def _function_ret():
     return sequence(regex(r" *-> *"), type_expr(), index=1)
 
 
+@generate
+def _arg_decl():
+    name, type_ = yield _typed_id_decl()
+    return ast.ArgDecl(name, type_)
+
+
 @generate
 def _function_args():
-    args = yield parens(sep_by(regex(r"\s*,\s*"), _typed_id_decl()))
-    return [ast.ArgDecl(*a) for a in args]
+    return (yield parens(sep_by(regex(r"\s*,\s*"), _arg_decl())))
+
+
+@generate
+def _function_signature(ret):
+    args = yield _function_args()
+    ret_type = yield ret
+    return ast.FunctionType(args, ret_type)
 
 
 @generate
@@ -169,7 +239,7 @@ def type_def():
 
 @generate
 def int_literal():
-    val = yield regex(r"0x[a-fA-F0-9]+|\d+")
+    val = yield token(INT, r"0x[a-fA-F0-9]+|\d+")
     if val.startswith("0x"):
         val = int(val, 16)
     else:
@@ -185,8 +255,8 @@ def _escaped_text(quote):
 
 @generate
 def string_literal():
-    text = yield _escaped_text('"')
-    return ast.StringLiteral(text)
+    text = yield token(STR, r'"([^"\\]|\\.)*"')
+    return ast.StringLiteral(text[1:-1].encode().decode("unicode_escape"))
 
 
 # @generate
@@ -195,8 +265,11 @@ def string_literal():
 #     return ast.CharLiteral(text)
 
 
+reserved_names = ("asm", "if", "func", "while", "macro", "const", "impl", "in")
+
+
 def _name():
-    return regex(r"(?!(asm|if|func|while|macro|const|impl|in)\b)[_a-zA-Z]\w*")
+    return token(NAME, rf"(?!({'|'.join(reserved_names)})\b)[_a-zA-Z]\w*", exclude=reserved_names)
 
 
 @generate
@@ -219,72 +292,170 @@ def tuple_expr():
     return ast.TupleExpr(elements)
 
 
+@generate
+def operator_declaration():
+    # (infixl 5 +) (infixr 5 ++) (unaryl 9 ~)
+    yield string("(")
+    fixity = yield regex(r"(infixl|infixr|unaryl) +", group=1)
+    precedence = yield regex(r"(\d+) +", group=1)
+    op = yield regex(rf"[{operator_characters}]+")
+    yield string(")")
+    yield declare_operator(fixity, int(precedence), op)
+    return f"({op})"
+
+
 @generate
 def operator_identifier():
     # (+) [] []=
-    op = yield regex(rf"\([{operator_characters}]+\)|\[\]=?")
+    op = yield choice(regex(rf"\([{operator_characters}]+\)|\[\]=?"), operator_declaration())
     return ast.Identifier(op)
 
 
 @generate
-def array_index(array):
+def array_index():
     idx = yield brackets(sep_by(regex(r"\s*,\s*"), expr(), min_count=1))
     if len(idx) > 1:
-        idx = ast.TupleExpr(idx)
+        tuple_ = ast.TupleExpr(idx)
+        tuple_.info = span.join(idx[0].info, idx[-1].info)
+        idx = tuple_
     else:
         idx = idx[0]
-    return ast.GetItem(array, idx)
+    return ast.GetItem(None, idx)
 
 
 @generate
-def call(unit, callee):
+def call(unit):
     arg = yield unit
-    return ast.Call(callee, arg)
+    return ast.Call(None, arg)
 
 
 @generate
-def attr_access(expr):
+def attr_access():
     yield string(".")
     attr = yield choice(regex(r"\d"), _name())
-    return ast.GetAttr(expr, attr)
-
-
-def unaryop(unop):
-    @generate
-    def _unaryop(unit):
-        ops = yield many(unop)
-        term = yield unit
-        for op in reversed(ops):
-            term = ast.UnaryL(op, term)
-        return term
-
-    return _unaryop
+    return ast.GetAttr(None, attr)
+
 
+# Operand field of the postfix nodes, which are parsed without it
+_postfix_operand = {ast.GetItem: "expr", ast.Call: "callee", ast.GetAttr: "obj", ast.TemplateInst: "name"}
 
-def binop(binop):
-    @generate
-    def _binop(unit):
-        res = yield unit
-        terms = []
-        operators = []
-
-        while True:
-            op = yield optional(sequence(regex(r"\s*"), binop))
-            if op is None:
-                break
-            op = op[1]
-            yield regex(r"\s*")
-            rhs = yield unit
-            operators.append(op)
-            terms.append(rhs)
 
-        # TODO: right-association
-        for op, rhs in zip(operators, terms):
-            res = ast.BinOp(op, res, rhs)
+def _apply_postfix(operand, postfix):
+    """Copy of the node `postfix` applied to `operand`, spanning both."""
+    node = dataclasses.replace(postfix, **{_postfix_operand[type(postfix)]: operand})
+    node.info = span.join(operand.info, postfix.info)
+    return node
+
+
+class OperatorTable:
+    """Precedence and associativity of the prefix and infix operators."""
+
+    def __init__(self, prefix: dict[str, int], infix: dict[str, tuple[int, bool]]):
+        self.prefix = prefix
+        # op -> (precedence, right associative)
+        self.infix = infix
+        self.prefix_pattern = self._compile(r"", prefix)
+        self.infix_pattern = self._compile(r"\s*", infix)
+
+    def __eq__(self, other):
+        return isinstance(other, OperatorTable) and (self.prefix, self.infix) == (other.prefix, other.infix)
+
+    @staticmethod
+    def _compile(prefix, ops):
+        # Longest operators first, so that e.g. `<<` is not matched as `<`
+        alternatives = "|".join(re.escape(op) for op in sorted(ops, key=len, reverse=True))
+        return re.compile(rf"{prefix}({alternatives})")
+
+    def declare(self, fixity: str, precedence: int, op: str) -> OperatorTable:
+        prefix = dict(self.prefix)
+        infix = dict(self.infix)
+        match fixity:
+            case "infixl":
+                infix[op] = (precedence, False)
+            case "infixr":
+                infix[op] = (precedence, True)
+            case "unaryl":
+                prefix[op] = precedence
+        return OperatorTable(prefix, infix)
+
+
+operators = OperatorTable(
+    {"+": 9, "-": 9},
+    {
+        **dict.fromkeys(["*", "//", "/", "%"], (8, False)),
+        **dict.fromkeys(["+", "-"], (7, False)),
+        **dict.fromkeys(["<<", ">>"], (6, False)),
+        "&": (5, False),
+        "|": (4, False),
+        **dict.fromkeys(["<=", ">=", ">", "<", "==", "!="], (3, False)),
+        "&&": (2, False),
+        "||": (1, False),
+    },
+)
+
+
+def operator_table(input) -> OperatorTable:
+    # Declarations are only visible for the rest of the text being parsed
+    return input.state.get("operators", operators)
+
+
+@cached
+def declare_operator(fixity, precedence, op):
+    def parser(input):
+        return None, input.with_state("operators", operator_table(input).declare(fixity, precedence, op))
+
+    return parser
+
+
+@cached
+def prefix_operator():
+    def parser(input):
+        table = operator_table(input)
+        match = table.prefix_pattern.match(input.text, input.pos)
+        if not match:
+            raise ParseError(input, "prefix operator")
+        op = match.group(1)
+        return (op, table.prefix[op]), input.advance(len(op))
+
+    return parser
+
+
+@cached
+def infix_operator(min_precedence):
+    def parser(input):
+        table = operator_table(input)
+        match = table.infix_pattern.match(input.text, input.pos)
+        if not match:
+            raise ParseError(input, "infix operator")
+        op = match.group(1)
+        precedence, right = table.infix[op]
+        if precedence < min_precedence:
+            raise ParseError(input, ("operator with precedence >=", min_precedence))
+        return (op, precedence, right), input.advance(match.end() - input.pos)
+
+    return parser
+
+
+@generate
+def operator_expr(unit, min_precedence=0):
+    prefix = yield optional(prefix_operator())
+    if prefix:
+        op, precedence = prefix
+        term = ast.UnaryL(op, (yield operator_expr(unit, precedence)))
+    else:
+        term = yield unit
 
-        return res
+    while True:
+        infix = yield optional(infix_operator(min_precedence))
+        if infix is None:
+            break
+        op, precedence, right = infix
+        yield regex(r"\s*")
+        rhs = yield operator_expr(unit, precedence if right else precedence + 1)
+        term = ast.BinOp(op, term, rhs)
+        term.info = span.join(term.lhs.info, rhs.info)
 
-    return _binop
+    return term
 
 
 @generate
@@ -339,27 +510,30 @@ def match_block():
 
 
 @generate
-def if_block():
-    @generate
-    def condition_then_body():
-        condition = yield expr()
-        yield regex(r" *:")
-        body_then = yield indented_block(statement())
-        body_else = yield optional(
-            sequence(regex(r"\s*"), same_indent(), choice(backtrack(else_block()), elif_block()), index=2)
-        )
-        return ast.IfElse(condition, body_then, body_else if body_else is not None else [])
-
-    def else_block():
-        return sequence(regex(r"else *:\s*"), indented_block(statement()), index=1)
-
-    @generate
-    def elif_block():
-        elif_stmt = yield sequence(regex(r"elif +"), condition_then_body(), index=1)
-        return [elif_stmt]
+def _condition_then_body():
+    condition = yield expr()
+    yield regex(r" *:")
+    body_then = yield indented_block(statement())
+    body_else = yield optional(
+        sequence(regex(r"\s*"), same_indent(), choice(backtrack(_else_block()), _elif_block()), index=2)
+    )
+    return ast.IfElse(condition, body_then, body_else if body_else is not None else [])
+
+
+def _else_block():
+    return sequence(regex(r"else *:\s*"), indented_block(statement()), index=1)
+
 
+@generate
+def _elif_block():
+    elif_stmt = yield sequence(regex(r"elif +"), _condition_then_body(), index=1)
+    return [elif_stmt]
+
+
+@generate
+def if_block():
     yield regex(r"if +")
-    return (yield condition_then_body())
+    return (yield _condition_then_body())
 
 
 @generate
@@ -378,18 +552,19 @@ def compiler_annotation():
 
 
 @generate
-def enum_def():
-    @generate
-    def enum_val():
-        name = yield _name()
-        fields = yield optional(tuple_def())
-        return ast.EnumValueType(name, fields)
+def _enum_val():
+    name = yield _name()
+    fields = yield optional(tuple_def())
+    return ast.EnumValueType(name, fields)
+
 
+@generate
+def enum_def():
     yield regex("enum +")
     name = yield _name()
     args = yield optional(brackets(sep_by(regex(r"\s*,\s*"), identifier(), min_count=1)))
     yield regex(r" *:")
-    values = yield indented_block(enum_val())
+    values = yield indented_block(_enum_val())
 
     if args:
         return ast.EnumTemplateDef(name, args, values)
@@ -414,37 +589,47 @@ def impl():
 
 @generate
 def statement():
-    yield optional(sequence(comment(), regex(r"\s*")))
+    yield skip()
     yield same_indent()
-    stmt = yield choice(
-        ast_for_block(),
-        while_block(),
-        break_statement(),
-        continue_statement(),
-        if_block(),
-        match_block(),
-        return_statement(),
-        var_decl(),
-        const_decl(),
-        enum_def(),
-        impl(),
-        type_def(),
-        function_def(),
-        macro_def(),
-        backtrack(assignment()),
-        expr(),
-    )
+    stmt = yield statement_body
     return stmt
 
 
+# Leading word of a statement, term or type, used to pick the only rule that can match
+keyword = r":\[|:?[_a-zA-Z]\w*|."
+
+statement_rules = {
+    ":[": function_def(),
+    ":for": ast_for_block(),
+    "while": while_block(),
+    "if": if_block(),
+    "const": const_decl(),
+    "impl": impl(),
+    "func": function_def(),
+    "macro": macro_def(),
+}
+# Keywords that are not reserved can still start an expression
+for name, rule in [
+    ("break", break_statement()),
+    ("continue", continue_statement()),
+    ("match", match_block()),
+    ("return", return_statement()),
+    ("let", var_decl()),
+    ("enum", enum_def()),
+    ("type", type_def()),
+]:
+    statement_rules[name] = choice(rule, expr_statement())
+statement_body = dispatch(keyword, statement_rules, expr_statement())
+
+
 @generate
 def expr_index(unit):
     term = yield unit
     while True:
-        term_ex = yield optional(choice(attr_access(term), array_index(term), call(unit, term)))
-        if not term_ex:
+        suffix = yield optional(choice(attr_access(), array_index(), call(unit)))
+        if not suffix:
             break
-        term = term_ex
+        term = _apply_postfix(term, suffix)
     return term
 
 
@@ -457,43 +642,50 @@ def cast_expr(unit):
             break
         # TODO: ast.Cast
         callee = ast.Call(callee, arg)
+        callee.info = span.join(callee.callee.info, arg.info)
     return callee
 
 
-expr_term = choice(function_def(), asm(), int_literal(), string_literal(), identifier(), tuple_expr())
+expr_term_rules = {
+    ":[": function_def(),
+    "func": function_def(),
+    "asm": asm(),
+    '"': string_literal(),
+    "(": tuple_expr(),
+    **dict.fromkeys("0123456789", int_literal()),
+}
+expr_term = memo(dispatch(keyword, expr_term_rules, identifier()))
 
 
+# Postfix layers binding tighter than any operator in `operators`
 precedence = [
     expr_index,
     cast_expr,
-    unaryop(regex(r"\+|-")),
-    binop(regex(r"\*|//|/|%")),
-    binop(regex(r"\+|-")),
-    binop(regex(r"<<|>>")),
-    binop(regex(r"&(?!&)")),
-    binop(regex(r"\|(?!\|)")),
-    binop(regex(r"<=|>=|>|<|==|!=")),
-    binop(regex(r"&&")),
-    binop(regex(r"\|\|")),
 ]
 for op in precedence:
     expr_term = op(expr_term)
+expr_term = operator_expr(expr_term)
 
 
 def expr():
     return expr_term
 
 
+@generate
+def _type_identifier():
+    name = yield token(NAME, r"[_a-zA-Z]\w*")
+    return ast.TypeIdentifier(name)
+
+
 @generate
 def type_name():
-    name = yield regex(r"[_a-zA-Z]\w*")
-    term = ast.TypeIdentifier(name)
+    term = yield _type_identifier()
 
     while True:
-        term_ex = yield optional(choice(attr_access(term), template_args(term)))
-        if not term_ex:
+        suffix = yield optional(choice(attr_access(), template_args()))
+        if not suffix:
             break
-        term = term_ex
+        term = _apply_postfix(term, suffix)
 
     return term
 
@@ -512,9 +704,9 @@ def native_array():
 
 
 @generate
-def template_args(term):
+def template_args():
     args = yield brackets(sep_by(regex(r"\s*,\s*"), type_expr(), min_count=1))
-    return ast.TemplateInst(term, args)
+    return ast.TemplateInst(None, args)
 
 
 @generate
@@ -526,13 +718,22 @@ def integral_type():
 
 @generate
 def type_expr():
-    term = yield choice(integral_type(), tuple_def(), function_type(), array_type(), type_name())
+    term = yield type_term
     return term
 
 
+type_rules = {
+    "__integral": integral_type(),
+    "(": tuple_def(),
+    "func": function_type(),
+    "[": array_type(),
+}
+type_term = dispatch(keyword, type_rules, type_name())
+
+
 @generate
 def module():
-    yield regex(r"\s*")
-    res = yield sep_by(regex(r"\s*"), statement())
-    yield regex(r"\s*")
+    yield skip()
+    res = yield sep_by(skip(), statement())
+    yield skip()
     return ast.Module(res)
@@ -0,0 +1,169 @@
+import array
+import bisect
+import re
+
+from parser.combinators import ParseError, cached, regex
+
+NAME = 0
+INT = 1
+STR = 2
+OP = 3
+LPAR = 4
+RPAR = 5
+LBRACE = 6
+RBRACE = 7
+LSQB = 8
+RSQB = 9
+COMMA = 10
+ERROR = 11
+
+token_names = [
+    "NAME",
+    "INT",
+    "STR",
+    "OP",
+    "LPAR",
+    "RPAR",
+    "LBRACE",
+    "RBRACE",
+    "LSQB",
+    "RSQB",
+    "COMMA",
+    "ERROR",
+]
+
+_token_kinds = {
+    "name": NAME,
+    "int": INT,
+    "str": STR,
+    "op": OP,
+    "lpar": LPAR,
+    "rpar": RPAR,
+    "lbrace": LBRACE,
+    "rbrace": RBRACE,
+    "lsqb": LSQB,
+    "rsqb": RSQB,
+    "comma": COMMA,
+    "error": ERROR,
+}
+
+_scanner = re.compile(
+    r"""
+    (?P<space>\s+)
+    | (?P<comment>\#[^\n]*)
+    | (?P<name>[_a-zA-Z]\w*)
+    | (?P<int>0x[a-fA-F0-9]+|\d+)
+    | (?P<str>"(?:[^"\\]|\\[^\n])*")
+    | (?P<op>[!$%&'*+\-./:;<=>?@\\^`|~]+)
+    | (?P<lpar>\()
+    | (?P<rpar>\))
+    | (?P<lbrace>\{)
+    | (?P<rbrace>\})
+    | (?P<lsqb>\[)
+    | (?P<rsqb>\])
+    | (?P<comma>,)
+    | (?P<error>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+class Tokens:
+    """Token stream of a source text, stored as parallel arrays of kinds and offsets.
+
+    Whitespace and comments produce no tokens, and there are no INDENT/DEDENT
+    tokens: layout is handled by the grammar from the column of each position
+    (see `parser.indent`). Lines continuing an expression may start at any
+    column and comments take part in the layout of blocks, which tokens derived
+    from the indentation of each line could not express.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.kinds = bytearray()
+        self.starts = array.array("l")
+        self.ends = array.array("l")
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        return token_names[self.kinds[i]], self.text[self.starts[i] : self.ends[i]]
+
+    def append(self, kind, start, end):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def find(self, pos):
+        """Index of the token starting at `pos`, or `None` if `pos` is not a token boundary."""
+        i = bisect.bisect_left(self.starts, pos)
+        if i < len(self.kinds) and self.starts[i] == pos:
+            return i
+        return None
+
+    def next_start(self, pos):
+        """Offset of the first token after the whitespace and comments at `pos`.
+
+        Returns `None` when `pos` lies inside a token.
+        """
+        i = bisect.bisect_left(self.starts, pos)
+        if i > 0 and self.ends[i - 1] > pos:
+            return None
+        return self.starts[i] if i < len(self.kinds) else len(self.text)
+
+
+def tokenize(text):
+    tokens = Tokens(text)
+    pos = 0
+    match = _scanner.match
+    while pos < len(text):
+        m = match(text, pos)
+        kind = m.lastgroup
+        end = m.end()
+        if kind != "space" and kind != "comment":
+            tokens.append(_token_kinds[kind], pos, end)
+        pos = end
+
+    return tokens
+
+
+@cached
+def token(kind, pattern, exclude=()):
+    """Match a token of `kind` at the input position.
+
+    Falls back to `pattern` where the position is not a token boundary, so the
+    result is always the same as `regex(pattern)`. Tokens whose text is in
+    `exclude` are rejected.
+    """
+    fallback = regex(pattern)
+    expected = f"{token_names[kind]} /{pattern}/"
+
+    def parser(input):
+        tokens = input.source.tokens()
+        i = tokens.find(input.pos)
+        if i is None:
+            return fallback(input)
+
+        if tokens.kinds[i] == kind:
+            text = input.text[input.pos : tokens.ends[i]]
+            if text not in exclude:
+                return text, input.advance(len(text))
+
+        raise ParseError(input, expected)
+
+    return parser
+
+
+@cached
+def skip():
+    """Skip whitespace and comments up to the next token."""
+    fallback = regex(r"(\s|#[^\n]*)*")
+
+    def parser(input):
+        pos = input.source.tokens().next_start(input.pos)
+        if pos is None:
+            return fallback(input)
+        return input.text[input.pos : pos], input.advance(pos - input.pos)
+
+    return parser
@@ -0,0 +1,173 @@
+"""Per-rule and per-regex parser statistics.
+
+While a `Profile` is active every grammar rule and every `regex` primitive records
+its calls, successes, failures, the input it consumed and the input it examined
+before failing, and its cumulative time. Results reused from the packrat cache
+are not counted. Regexes inlined into the generated grammar module are not
+visible, profile with `parser.lang` to include them.
+
+Parsers are only instrumented while a profile is active, see
+`combinators.instrument`, so parsing without a profile runs no profiling code.
+
+    python -m parser.profile [--json] [--sort KEY] FILE...
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from parser import combinators, lang, run_parser
+from parser.combinators import IncompleteParse
+
+columns = ["calls", "successes", "failures", "consumed", "wasted", "time"]
+
+
+class Stats:
+    __slots__ = columns + ["active"]
+
+    def __init__(self):
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        # Characters consumed by successful calls
+        self.consumed = 0
+        # Characters between the start of a failed call and the position it failed at
+        self.wasted = 0
+        # Seconds spent in outermost calls, recursive calls are not counted twice
+        self.time = 0.0
+        self.active = 0
+
+    def as_dict(self):
+        return {column: getattr(self, column) for column in columns}
+
+
+def _failure_pos(e):
+    while isinstance(e, IncompleteParse):
+        e = e.reason
+    while getattr(e, "cause", None) is not None:
+        e = e.cause
+    input = getattr(e, "input", None)
+    return input.pos if input is not None else None
+
+
+class Profile:
+    """Statistics of the rules and regexes run while the profile is active, by name."""
+
+    def __init__(self):
+        self.stats = {}
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = combinators.profiler
+        combinators.profiler = self
+        if self._previous is None:
+            combinators.instrument({"run": _recording_rule, "match": _recording_match})
+        return self
+
+    def __exit__(self, *exc):
+        combinators.profiler = self._previous
+        if self._previous is None:
+            combinators.instrument(None)
+
+    def _stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = Stats()
+        return stats
+
+    def record(self, name, p, input):
+        stats = self._stats(name)
+        stats.calls += 1
+        stats.active += 1
+        start = time.perf_counter()
+        try:
+            result = p(input)
+        except (ValueError, IncompleteParse) as e:
+            stats.failures += 1
+            pos = _failure_pos(e)
+            if pos is not None:
+                stats.wasted += max(0, pos - input.pos)
+            raise
+        finally:
+            stats.active -= 1
+            if not stats.active:
+                stats.time += time.perf_counter() - start
+
+        stats.successes += 1
+        stats.consumed += result[1].pos - input.pos
+        return result
+
+    def record_match(self, name, match, text, pos):
+        stats = self._stats(name)
+        stats.calls += 1
+        start = time.perf_counter()
+        m = match(text, pos)
+        stats.time += time.perf_counter() - start
+        if m is None:
+            stats.failures += 1
+        else:
+            stats.successes += 1
+            stats.consumed += m.end() - pos
+        return m
+
+    def sorted(self, key="time"):
+        return sorted(self.stats.items(), key=lambda item: getattr(item[1], key), reverse=True)
+
+    def as_dict(self, key="time"):
+        return {name: stats.as_dict() for name, stats in self.sorted(key)}
+
+    def to_json(self, key="time"):
+        return json.dumps(self.as_dict(key), indent=2)
+
+    def report(self, key="time", limit=None):
+        rows = self.sorted(key)[:limit]
+        width = max([len("name")] + [len(name) for name, _ in rows])
+        lines = [f"{'name':<{width}} " + " ".join(f"{column:>10}" for column in columns)]
+        for name, stats in rows:
+            values = [f"{stats.time * 1000:>8.2f}ms" if c == "time" else f"{getattr(stats, c):>10}" for c in columns]
+            lines.append(f"{name:<{width}} " + " ".join(values))
+        return "\n".join(lines)
+
+
+def _recording_rule(name, run):
+    def recording(input):
+        return combinators.profiler.record(name, run, input)
+
+    return recording
+
+
+def _recording_match(name, match):
+    def recording(text, pos):
+        return combinators.profiler.record_match(name, match, text, pos)
+
+    return recording
+
+
+def profile(text, filename="<input>", grammar=lang):
+    """Profile of parsing `text` as a module of `grammar`."""
+    with Profile() as prof:
+        run_parser(grammar.module(), text, filename=filename)
+    return prof
+
+
+def main(argv):
+    args = argparse.ArgumentParser(prog="python -m parser.profile")
+    args.add_argument("files", nargs="+")
+    args.add_argument("--json", action="store_true", help="print the statistics as JSON")
+    args.add_argument("--sort", default="time", choices=columns)
+    args.add_argument("--limit", type=int, default=None, help="number of rows in the report")
+    args = args.parse_args(argv)
+
+    with Profile() as prof:
+        for filename in args.files:
+            with open(filename, encoding="utf8") as f:
+                text = f.read()
+            run_parser(lang.module(), text, filename=filename)
+
+    print(prof.to_json(args.sort) if args.json else prof.report(args.sort, args.limit))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
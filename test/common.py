@@ -11,12 +11,9 @@ import tempfile
 import subprocess
 
 
-prelude = ""
 std_lib_path = os.path.join(base_dir, "lib/prelude")
-std_lib_files = [fname for fname in os.listdir(std_lib_path) if fname.endswith(".gi")]
-for filename in std_lib_files:
-    with open(os.path.join(std_lib_path, filename), "r", encoding="utf8") as f:
-        prelude += f.read() + "\n"
+std_lib_files = sorted(fname for fname in os.listdir(std_lib_path) if fname.endswith(".gi"))
+std_lib_files = [os.path.join(std_lib_path, filename) for filename in std_lib_files]
 
 
 def compile(code):
@@ -30,7 +27,10 @@ def compile(code):
 
 
 def compile_full(code):
-    prog = parser.parse_str(prelude + code)
+    prog = parser.parse_files(std_lib_files)
+    main = parser.parse_str(code)
+    prog.stmts += main.stmts
+    prog.sources += main.sources
     if not prog:
         raise RuntimeError("Compilation failed: " + prog)
 
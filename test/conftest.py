@@ -0,0 +1,16 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser
+
+
+@pytest.fixture(autouse=True, scope="session")
+def ast_cache_root(tmp_path_factory):
+    # Parsed modules are shared by the tests of a session without writing to the user cache
+    root = parser.ast_cache.cache_root
+    parser.ast_cache.cache_root = str(tmp_path_factory.mktemp("ast"))
+    yield parser.ast_cache.cache_root
+    parser.ast_cache.cache_root = root
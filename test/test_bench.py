@@ -0,0 +1,34 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser
+from bench import parse as bench
+
+
+@pytest.mark.parametrize("name", list(bench.shapes))
+def test_shape_parses(name):
+    generate, _ = bench.shapes[name]
+    assert parser.parse_str(generate(10)).stmts
+
+
+@pytest.mark.parametrize("exponent", [1, 2])
+def test_fit(exponent):
+    sizes = [10, 20, 40, 80]
+    fitted, coefficient = bench.fit(sizes, [3 * x**exponent for x in sizes])
+    assert fitted == pytest.approx(exponent)
+    assert coefficient == pytest.approx(3)
+
+
+def test_compare():
+    baseline = bench.run(["functions"], repeat=1, scale=0.05)
+    baseline["results"]["functions"]["superlinear"] = False
+    assert bench.compare(baseline, baseline) == []
+
+    slower = {"results": {"functions": dict(baseline["results"]["functions"], superlinear=True)}}
+    slower["results"]["functions"]["runs"] = [
+        dict(r, chars_per_second=r["chars_per_second"] / 2) for r in baseline["results"]["functions"]["runs"]
+    ]
+    assert [m.split(":")[0] for m in bench.compare(baseline, slower)] == ["functions", "functions"]
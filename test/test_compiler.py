@@ -1,8 +1,15 @@
+import copy
+import io
+import json
+import os
 import pytest
 import textwrap
 
 from common import compile, compile_full
-from compiler import codegen, ir
+import compiler
+import parser
+from compiler import codegen, ir, passes, traverse_ir, verify
+from compiler.dump import Dump, formats
 
 
 def test_native_type_alias():
@@ -117,3 +124,244 @@ def test_str_literal_cast(code):
 def test_str_literal_cast_fail(code):
     with pytest.raises(Exception):
         assert compile_full(f"func main() -> ():\n" + textwrap.indent(code, "    "))
+
+
+def test_type_table():
+    assert ir.BuiltinType("__int") is ir.BuiltinType("__int") is not ir.BuiltinType("__str")
+    assert ir.VoidType(None) is ir.VoidType(1) and ir.UnknownType() is ir.UnknownType()
+    assert copy.deepcopy(ir.BuiltinType("__str")) is ir.BuiltinType("__str")
+    assert len({ir.BuiltinType("__int"), ir.BuiltinType("__int"), ir.VoidType(None)}) == 2
+
+    module = compile("type a: __integral[i32, i32, array.get]\ntype b: a\ntype c: __integral[i32, i32, array.get]\n")
+    a, b, c = (module.scope.attrs[name] for name in "abc")
+    assert a.super_ is c.super_ and a != c
+    assert b.chain() == (b, a, a.super_) and b.chain() is b.chain()
+    assert b.has_base_class(a.ref()) and b.has_base_class(c.super_) and not a.has_base_class(b)
+    assert b.primitive() is a.super_
+    assert b == b.ref() and hash(b) == hash(b.ref())
+
+
+def test_type_chain_cache():
+    module = compile(
+        "type a: __integral[i32, i32, array.get]\ntype b: a\ntype c: b\n"
+        "type d: __integral[i64, i64, array.get]\n"
+    )
+    a, b, c, d = (module.scope.attrs[name] for name in "abcd")
+    i32, i64 = a.super_, d.super_
+    assert c.chain() == (c, b, a, i32) and c.primitive() is i32
+
+    # Replacing an ancestor's base must not leave descendants with stale answers
+    a.super_ = d.ref()
+    assert c.chain() == (c, b, a, d, i64) and c.has_base_class(d) and not c.has_base_class(i32)
+    assert c.primitive() is b.primitive() is i64
+    a.super_ = None
+    assert c.chain() == (c, b, a) and not c.has_base_class(d) and c.primitive() is a
+
+
+def test_scope_lookup():
+    root = ir.Scope(None, "root")
+    root.add_method("a", ir.Builtin("a"))
+    scopes = [root]
+    for i in range(10):
+        scopes.append(ir.Scope(scopes[-1], f"s{i}"))
+    inner = scopes[-1]
+
+    assert inner.lookup("a") is root.attrs["a"]
+    assert inner.resolve("a") is root and scopes[5]._lookups["a"][1] is root
+    with pytest.raises(KeyError):
+        inner.lookup("b")
+
+    # Adding a name shadows the cached lookups, removing it exposes the outer definition again
+    scopes[3].add_method("a", ir.Builtin("a3"))
+    assert inner.lookup("a").name == "a3" and scopes[2].lookup("a").name == "a"
+    del scopes[3].attrs["a"]
+    assert inner.lookup("a").name == "a"
+
+
+def test_scope_names():
+    root = ir.Scope(None, "root")
+    names = [ir.Scope(root, "__if").name for _ in range(4)]
+    assert names == ["root.__if", "root.__if$1", "root.__if$2", "root.__if$3"]
+    assert ir.Scope(root, "__if$4").name == "root.__if$4"
+    assert ir.Scope(root, "__if").name == "root.__if$5"
+
+    func = ir.Scope(root, "f")
+    func.func = ir.FunctionRef(None, ir.FunctionDef(None, "root.f", ir.FunctionType(None, [], ir.VoidType(None)), func))
+    inner = ir.Scope(func, "__if")
+    vars = [inner.register_local("x", ir.VarDecl(None, "x", ir.UnknownType())) for _ in range(3)]
+    assert [var.name for var in vars] == ["__local.x$0", "__local.x$1", "root.f.x$2"]
+    assert list(func.attrs) == ["root.f.x", "root.f.x$1", "root.f.x$2"]
+
+
+def test_pass_manager(tmp_path):
+    manager = compiler.PassManager(memory=True, nodes=True, functions=True, verbose=False)
+    module = compiler.semantic_pass(parser.parse_str("func f(a: __int) -> __int:\n    a\n"), manager)
+    assert "f" in module.scope.attrs
+
+    names = [pass_.__name__ for pass_ in passes.toplevel_ast_passes + passes.ir_passes]
+    assert [p.name for p in manager.passes] == names
+    assert all(p.seconds >= 0 and p.peak_memory >= 0 for p in manager.passes)
+    for before, after in zip(manager.passes, manager.passes[1:]):
+        assert after.nodes_before == before.nodes_after
+    assert manager.passes[-1].nodes_after["FunctionDef"] == 1
+
+    functions = [f.name for p in manager.passes for f in p.functions]
+    assert "root.f" in functions
+
+    manager.write_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as f:
+        events = json.load(f)["traceEvents"]
+    assert [e["name"] for e in events if e["cat"] == "pass"] == names
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+    assert manager.report().splitlines()[-1].startswith("total")
+
+
+@pytest.mark.parametrize("format", ["text", "jsonl"])
+def test_dump(format, tmp_path, monkeypatch):
+    out = io.StringIO()
+    dump = Dump(["resolve_types", "done"], format, stream=out)
+    manager = compiler.PassManager(verbose=False, dump=dump)
+    compiler.semantic_pass(parser.parse_str("func f(a: __int) -> __int:\n    a\n"), manager)
+
+    if format == "jsonl":
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert {line["pass"] for line in lines} == {"resolve_types", "done"}
+        (func,) = [line["node"] for line in lines if line["pass"] == "done" and line["path"] == "root/f"]
+        assert func["_"] == "FunctionDef" and func["name"] == "root.f"
+    else:
+        text = out.getvalue()
+        assert text.count("# after ") == 2
+        assert "FunctionDef(\n" in text
+
+    # Nothing is written without a dump
+    monkeypatch.chdir(tmp_path)
+    compile_full("func main() -> ():\n    return\n")
+    assert not os.listdir(tmp_path)
+
+    manager = compiler.PassManager(verbose=False, dump=Dump(["done"], format, directory=str(tmp_path / "dumps")))
+    compiler.semantic_pass(parser.parse_str("func f() -> ():\n    return\n"), manager)
+    assert os.listdir(tmp_path / "dumps") == [f"{len(manager.passes) - 1:02}-done{formats[format]}"]
+
+
+def test_verify():
+    verifier = verify.Verifier(each=True)
+    manager = compiler.PassManager(verbose=False, verify=verifier)
+    module = compiler.semantic_pass(parser.parse_str("func f(a: __int) -> __int:\n    let b: __int = a\n    b\n"), manager)
+    assert verifier.invariants == {name for names in verify.stages.values() for name in names}
+    assert compiler.PassManager(verify=False).verify is None
+
+    func = module.scope.attrs["f"]
+    body = func.scope.body
+    for node, message in [
+        (ir.Untranslated(parser.parse_str("0").stmts[0]), "Untranslated node"),
+        (ir.VarRef(None, ir.VarDecl(None, "c", func.type_.ret_type)), "Reference to undeclared variable"),
+        (ir.Block(None, func.type_.ret_type, "block", ir.Scope(None, func.scope.name)), "Duplicate scope name"),
+        (ir.Call(None, ir.FunctionRef(None, func), []), "Unknown type"),
+    ]:
+        body.append(node)
+        with pytest.raises(verify.VerificationError, match=message):
+            verifier.verify(module)
+        body.pop()
+    verifier.verify(module)
+
+
+def test_visitor():
+    visited = []
+    double = traverse_ir.Visitor("double")
+
+    @double.register(ir.IntLiteral)
+    def _(node):
+        visited.append(node.value)
+        return ir.IntLiteral(node.info, node.value * 2)
+
+    @double.register(ir.Expr)
+    def _(node):
+        visited.append(type(node).__name__)
+        return double.traverse(node)
+
+    # Lists are updated in place, items replaced with `None` are removed
+    double.register(ir.Drop)(lambda node: None)
+    inner = ir.TupleExpr(None, ir.UnknownType(), [ir.IntLiteral(None, 2)])
+    args = [ir.IntLiteral(None, 1), inner, ir.Drop(ir.IntLiteral(None, 3))]
+    tuple_ = ir.TupleExpr(None, ir.UnknownType(), args)
+    assert double(tuple_) is tuple_ and tuple_.args is args
+    assert visited == ["TupleExpr", 1, "TupleExpr", 2]
+    assert len(args) == 2 and args[1] is inner
+    assert [args[0].value, inner.args[0].value] == [2, 4]
+
+
+def test_inline():
+    module = compile("macro m(x: __int) -> __int:\n    let y: __int = x\n    return y\nfunc f(a: __int) -> __int:\n    m(a)\n")
+    macro = module.scope.attrs["m"]
+    func = module.scope.attrs["f"]
+    assert macro._unresolved is False
+    body = copy.deepcopy(macro.func.scope.body)
+
+    arg = ir.IntLiteral(None, 5)
+    block = traverse_ir.inline(macro, func.scope, [arg])
+    set_local, break_ = block.scope.body
+    assert set_local.expr is arg
+    assert set_local.var.var is func.scope.attrs["root.m.__inline.m$1.y"]
+    assert isinstance(break_, ir.Break) and break_.block_name == block.name == "root.m.__inline.m$1"
+    assert break_.expr.var is set_local.var.var
+    # The body of the macro is left untouched
+    assert str(macro.func.scope.body) == str(body)
+
+
+def test_resolve_types(monkeypatch):
+    worklists = []
+    run = passes.worklist.Worklist.run
+    monkeypatch.setattr(passes.worklist.Worklist, "run", lambda self, visit: worklists.append(self) or run(self, visit))
+
+    # Every definition is resolved by the first sweep
+    compile("type i32\nimpl i32:\n macro __type_reference() -> (): asm: i32\nfunc f(a: i32) -> i32:\n    a\n")
+    assert not worklists[-1].pending and not worklists[-1].visits
+
+    compile_full("func main() -> ():\n    let a: [u32] = __array[u32].new()\n    a.append(1)\n")
+    worklist = worklists[-1]
+    assert worklist.visits and "root/main" not in worklist.visits
+    assert all(count == 1 for count in worklist.visits.values())
+    # Only generic definitions are left unresolved
+    generic = {ir.TemplateDef, ir.EnumTemplateDef, ir.AstMacroDef, ir.MacroDef}
+    assert {type(entry.node) for entry in worklist.pending} <= generic
+
+
+def test_worklist_changes():
+    module = compile(
+        "type i32\nimpl i32:\n    macro __type_reference() -> (): asm: i32\n"
+        "type T: i32\nimpl T:\n    func m(self) -> i32:\n        asm: (i32.const 1)\n"
+        "func f(a: T) -> i32:\n    asm: (i32.const 2)\n"
+    )
+    changes = 2
+
+    def visit(node, scope):
+        nonlocal changes
+        if node.name == "root.T.m" and changes:
+            # Replaced by a node of the same class
+            node.scope.body[0] = copy.copy(node.scope.body[0])
+            changes -= 1
+        return node
+
+    worklist = passes.worklist.Worklist(module, (ir.Asm,))
+    worklist.run(visit)
+    assert worklist.visits["root.T/m"] == 3
+    # Woken by the second change of a member of T, the first one is visited before `f` stalls
+    assert worklist.visits["root/f"] == 2
+    assert worklist.visits["root.i32/__type_reference"] == 1
+
+
+def test_worklist_interned_changes():
+    module = compile("func f() -> ():\n" + "    asm: (i32.const 1)\n" * 3)
+    func = module.scope.attrs["f"]
+    for node in func.scope.body:
+        node.type_ = ir.UnknownType()
+
+    def visit(node, scope):
+        # Resolves one of the occurrences of the same interned type
+        next(n for n in node.scope.body if n.type_ is ir.UnknownType()).type_ = ir.VoidType(None)
+        return node
+
+    worklist = passes.worklist.Worklist(module, (ir.UnknownType,))
+    worklist.run(visit)
+    assert worklist.visits["root/f"] == 3
+    assert worklist.pending == []
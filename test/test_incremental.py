@@ -0,0 +1,120 @@
+import gc
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser
+from compiler import ast, span
+from parser.combinators import IncompleteParse
+from parser import incremental
+from parser.incremental import IncrementalParser
+
+source = """\
+# header
+type A: i32
+
+func f(a: i32) -> i32:
+    a + 1
+
+:[export]
+func g() -> i32:
+    f(1)
+
+if 1:
+    f(2)
+else:
+    f(3)
+
+x = (1,
+2)
+"""
+
+
+def spans(node):
+    if isinstance(node, list):
+        return [spans(n) for n in node]
+    if isinstance(node, ast.Node):
+        offsets = node.info and (span.start(node.info), span.end(node.info))
+        return [offsets] + [spans(value) for name, value in vars(node).items() if name != "info"]
+    return node
+
+
+@pytest.mark.parametrize(
+    "old, new, parsed",
+    [
+        ("a + 1", "a + 2", 1),
+        ("type A: i32\n", "type A: i32\ntype B: i64\n", 2),
+        (":[export]\n", ":[export, inline]\n", 1),
+        ("else:\n    f(3)", "else:\n    f(4)", 1),
+        ("func f(", "func (infixr 5 ++)(", 4),
+        ("\nx = (1,", "\nx = (2,", 1),
+        ("# header\n", "", 0),
+    ],
+)
+def test_incremental_edit(old, new, parsed):
+    p = IncrementalParser()
+    assert p.parse(source) == parser.parse_str(source)
+    assert p.parsed == 6
+
+    edited = source.replace(old, new, 1)
+    module = p.parse(edited)
+    assert module == parser.parse_str(edited)
+    assert p.parsed == parsed
+    assert spans(module.stmts) == spans(parser.parse_str(edited).stmts)
+
+
+def test_incremental_unchanged():
+    p = IncrementalParser()
+    module = p.parse(source)
+    assert p.parse(source) == module
+    assert p.parsed == 0
+
+
+def test_incremental_error():
+    p = IncrementalParser()
+    p.parse(source)
+    with pytest.raises((ValueError, IncompleteParse)) as e:
+        p.parse(source.replace("f(1)", "f(1"))
+    assert "<input>:9" in str(e.value)
+
+
+def test_incremental_error_recovery():
+    p = IncrementalParser()
+    p.parse(source)
+    edited = source.replace("a + 1", "a + 2")
+    with pytest.raises((ValueError, IncompleteParse)):
+        p.parse(edited.replace("f(1)", "f(1"))
+    assert p.parsed == 1
+
+    edited = edited.replace("f(1)", "f(5)")
+    module = p.parse(edited)
+    assert module == parser.parse_str(edited)
+    assert p.parsed == 1
+    assert spans(module.stmts) == spans(parser.parse_str(edited).stmts)
+
+
+def test_incremental_error_merges_few_chunks(monkeypatch):
+    p = IncrementalParser()
+    lines = ["f(", "a = 1"] + [f"b{i} = {i}" for i in range(20)]
+    calls = []
+    module = p.grammar.module
+    monkeypatch.setattr(p.grammar, "module", lambda: lambda input: calls.append(input) or module()(input))
+    with pytest.raises((ValueError, IncompleteParse)):
+        p.parse("\n".join(lines) + "\n")
+    # One attempt per merged chunk count and the parse of the whole text reporting the error
+    assert len(calls) == incremental.max_chunks + 1
+
+
+def test_incremental_releases_versions():
+    p = IncrementalParser()
+    p.parse(source)
+    gc.collect()
+    registered = len(span.files)
+    for i in range(3):
+        with pytest.raises((ValueError, IncompleteParse)):
+            p.parse(source.replace("f(1)", f"f({i}"))
+        p.parse(source.replace("f(1)", f"f({i})"))
+    gc.collect()
+    assert len(span.files) == registered
@@ -0,0 +1,79 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser
+from parser import lexer
+from parser.lang import *
+
+
+def token_kinds(code):
+    tokens = lexer.tokenize(code)
+    return [tokens[i][0] for i in range(len(tokens))]
+
+
+@pytest.mark.parametrize(
+    "code, kinds",
+    [
+        ("", []),
+        ("a", ["NAME"]),
+        ("a = 0x1f", ["NAME", "OP", "INT"]),
+        ('f("a\\"b", 1)', ["NAME", "LPAR", "STR", "COMMA", "INT", "RPAR"]),
+        ("a # comment\n\n# comment\nb", ["NAME", "NAME"]),
+        ("a:\n    b\n    c\nd", ["NAME", "OP", "NAME", "NAME", "NAME"]),
+        ("f(a,\n    b)\nc", ["NAME", "LPAR", "NAME", "COMMA", "NAME", "RPAR", "NAME"]),
+        ("a ` b", ["NAME", "OP", "NAME"]),
+        ("a ? \x00", ["NAME", "OP", "ERROR"]),
+    ],
+)
+def test_tokenize(code, kinds):
+    assert token_kinds(code) == kinds
+
+
+def test_tokenize_offsets():
+    tokens = lexer.tokenize("let ab = 12")
+    assert [tokens[i][1] for i in range(len(tokens))] == ["let", "ab", "=", "12"]
+    assert list(tokens.starts) == [0, 4, 7, 9]
+
+
+@pytest.mark.parametrize(
+    "code, pos, next_start",
+    [
+        ("a  b", 1, 3),
+        ("a # c\n  b", 1, 8),
+        ("a  ", 1, 3),
+        ("abc", 1, None),
+    ],
+)
+def test_next_start(code, pos, next_start):
+    assert lexer.tokenize(code).next_start(pos) == next_start
+
+
+@pytest.mark.parametrize(
+    "p, code",
+    [
+        (identifier(), "if_"),
+        (identifier(), "a1"),
+        (int_literal(), "0x1f"),
+        (string_literal(), '"a\\"b#"'),
+        (sequence(string("b"), identifier()), "bc"),
+    ],
+)
+def test_token(p, code):
+    assert parser.run_parser(p, code)
+
+
+@pytest.mark.parametrize(
+    "p, code",
+    [
+        (identifier(), "if"),
+        (identifier(), "1a"),
+        (int_literal(), "a"),
+        (string_literal(), '"a\\\nb"'),
+    ],
+)
+def test_token_fail(p, code):
+    with pytest.raises(ValueError):
+        parser.run_parser(p, code)
@@ -1,14 +1,30 @@
+import gc
+import json
 import os
+import pickle
 import sys
+import time
 import pytest
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import parser
-from compiler import traverse_ast
+import parser.profile
+from compiler import span, traverse_ast
 from parser.lang import *
 
 
+@pytest.fixture(autouse=True, params=["interpreted", "generated"])
+def backend(request, monkeypatch):
+    """Run each test against both the combinator grammar and the generated parser module."""
+    if request.param == "generated":
+        generated = parser.codegen.load()
+        for name, value in vars(parser.lang).items():
+            if globals().get(name) is value:
+                monkeypatch.setitem(globals(), name, getattr(generated, name))
+    return request.param
+
+
 def reduce_tuple(node):
     match node:
         case ast.TupleExpr(field_values=[val]):
@@ -120,6 +136,45 @@ def test_op_parser(code, par):
     assert res1 == reduce_tuple(res2)
 
 
+@pytest.mark.parametrize(
+    "decl, code, par",
+    [
+        ("func (infixl 5 ++)(a, b) -> i32", "1 ++ 2 ++ 3", "(1 ++ 2) ++ 3"),
+        ("func (infixr 5 ++)(a, b) -> i32", "1 ++ 2 ++ 3", "1 ++ (2 ++ 3)"),
+        ("func (infixr 5 ++)(a, b) -> i32", "1 ++ 2 + 3", "1 ++ (2 + 3)"),
+        ("func (infixr 9 ++)(a, b) -> i32", "1 * 2 ++ 3", "1 * (2 ++ 3)"),
+        ("func (infixl 1 -)(a, b) -> i32", "1 - 2 * 3 == 4", "1 - ((2 * 3) == 4)"),
+        ("func (unaryl 9 ~)(a) -> i32", "~1 + 2", "(~1) + 2"),
+        ("func (unaryl 5 ~)(a) -> i32", "~1 + 2 | 3", "~(1 + 2) | 3"),
+    ],
+)
+def test_operator_declaration(decl, code, par):
+    res1 = parser.run_parser(module(), f"{decl}\n{code}").stmts[-1]
+    res2 = parser.run_parser(module(), f"{decl}\n{par}").stmts[-1]
+    assert res1 == reduce_tuple(res2)
+
+
+def test_operator_declaration_scope():
+    parser.run_parser(module(), "func (infixr 5 ++)(a, b) -> i32")
+    assert parser.run_parser(expr(), "1 ++2") == reduce_tuple(parser.run_parser(expr(), "1 + (+2)"))
+
+
+@pytest.mark.parametrize("packrat", [False, True])
+def test_operator_declaration_backtrack(packrat):
+    declared = sequence(operator_declaration(), string("!"))
+    p = sequence(choice(declared, string("(infixr 5 ++)")), string(" "), expr(), index=2)
+    res = parser.run_parser(p, "(infixr 5 ++) 1 ++2", packrat=packrat)
+    assert res == reduce_tuple(parser.run_parser(expr(), "1 + (+2)"))
+
+
+@pytest.mark.parametrize("packrat", [False, True])
+def test_operator_declaration_memo(packrat):
+    before = sequence(expr(), string("!"))
+    after = sequence(declare_operator("infixr", 5, "++"), expr(), index=1)
+    res = parser.run_parser(choice(before, after), "1 ++2", packrat=packrat)
+    assert res == ast.BinOp("++", ast.IntLiteral(1), ast.IntLiteral(2))
+
+
 # sep_py
 
 
@@ -228,7 +283,6 @@ def test_impl_parser(code):
 # cast_expr
 
 assert precedence[1] == cast_expr
-cast_expr_parser = cast_expr(precedence[0](expr_term))
 
 
 @pytest.mark.parametrize(
@@ -243,6 +297,7 @@ cast_expr_parser = cast_expr(precedence[0](expr_term))
     ],
 )
 def test_cast_expr(code, par):
+    cast_expr_parser = cast_expr(precedence[0](expr_term))
     res1 = parser.run_parser(cast_expr_parser, code)
     res2 = parser.run_parser(cast_expr_parser, par)
     assert res1 != res2
@@ -262,6 +317,57 @@ def test_statement(code):
     assert parser.run_parser(statement(), code)
 
 
+@pytest.mark.parametrize(
+    "code, node",
+    [
+        ("breakfast = 1", ast.Assignment),
+        ("implement = 1", ast.Assignment),
+        ("type(a)", ast.Call),
+        ("return_value", ast.Identifier),
+        ("a.b = c", ast.Assignment),
+        ("break", ast.Break),
+        ("let a: i32 = 1", ast.VarDecl),
+    ],
+)
+def test_statement_dispatch(code, node):
+    assert type(parser.run_parser(statement(), code)) is node
+
+
+# asm
+
+
+@pytest.mark.parametrize(
+    "code, terms",
+    [
+        ("asm: (i32.add {a} (i32.const 1))", [["i32.add", ast.Identifier("a"), ["i32.const", 1]]]),
+        ("asm:\n    (local $x i32)\n    (local.get $x)", [["local", "$x", "i32"], ["local.get", "$x"]]),
+        ('asm: (data offset=4 "a b" -1 1.5 x(y))', [["data", "offset=4", '"a b"', -1, 1, ".5", "x", ["y"]]]),
+        ("asm: (f\n      a\n       b)", [["f", "a", "b"]]),
+        ("asm: ( {a + 1} )", [[ast.BinOp("+", ast.Identifier("a"), ast.IntLiteral(1))]]),
+        ("asm: ()", [[]]),
+    ],
+)
+def test_asm(code, terms):
+    def unwrap(term):
+        return [unwrap(t) for t in term.terms] if isinstance(term, ast.WasmExpr) else term
+
+    assert unwrap(parser.run_parser(asm(), code).terms) == terms
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "asm: (i32.const 0x10)",
+        "asm: (f {a)",
+        "asm: (f\n a)",
+        "asm: (f a",
+    ],
+)
+def test_asm_fail(code):
+    with pytest.raises(IncompleteParse):
+        parser.run_parser(asm(), code)
+
+
 # comment
 
 
@@ -322,3 +428,419 @@ def test_match_parser(code):
 )
 def test_tuple_expr(code):
     assert parser.run_parser(tuple_expr(), code)
+
+
+# rule construction
+
+
+@pytest.mark.parametrize(
+    "build",
+    [
+        lambda: statement(),
+        lambda: indented_block(statement()),
+        lambda: parens(sep_by(regex(r"\s*,\s*"), expr())),
+        lambda: sequence(regex(r"elif +"), if_block(), index=1),
+        lambda: expr_index(identifier()),
+    ],
+)
+def test_rule_built_once(build):
+    assert build() is build()
+
+
+def test_rule_unhashable_args():
+    @generate
+    def one_of(names):
+        return (yield choice(*map(string, names)))
+
+    assert one_of(["a", "b"]) is not one_of(["a", "b"])
+    assert parser.run_parser(one_of(["a", "b"]), "b") == "b"
+
+
+# packrat
+
+
+prelude_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib/prelude")
+
+
+@pytest.mark.parametrize(
+    "filename",
+    sorted(fname for fname in os.listdir(prelude_path) if fname.endswith(".gi")),
+)
+@pytest.mark.parametrize("packrat", [True, 16])
+def test_packrat_module(filename, packrat):
+    with open(os.path.join(prelude_path, filename), "r", encoding="utf8") as f:
+        code = f.read()
+    assert parser.run_parser(module(), code, packrat=packrat) == parser.run_parser(module(), code)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "a = b",
+        "a.0 = b + c",
+        "a == b",
+    ],
+)
+def test_packrat_statement(code):
+    assert parser.run_parser(statement(), code, packrat=True) == parser.run_parser(statement(), code)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "a = ",
+        "1 +",
+    ],
+)
+def test_packrat_fail(code):
+    with pytest.raises((ValueError, IncompleteParse)):
+        parser.run_parser(statement(), code, packrat=True)
+
+
+# statement stream
+
+
+@pytest.mark.parametrize("packrat", [False, True])
+def test_parse_statements(packrat):
+    with open(os.path.join(prelude_path, "prelude.gi"), "r", encoding="utf8") as f:
+        code = f.read()
+    assert list(parser.parse_statements(code, packrat=packrat)) == parser.run_parser(module(), code).stmts
+
+
+@pytest.mark.parametrize("code", ["", "\n# comment\n", "1\n\n"])
+def test_parse_statements_short(code):
+    assert list(parser.parse_statements(code)) == parser.run_parser(module(), code).stmts
+
+
+@pytest.mark.parametrize("code", ["1 +", "1\n 2", "let = 2"])
+def test_parse_statements_fail(code):
+    with pytest.raises((ValueError, IncompleteParse)) as expected:
+        parser.run_parser(module(), code)
+    with pytest.raises(expected.type) as e:
+        list(parser.parse_statements(code))
+    assert str(e.value) == str(expected.value)
+
+
+def test_parse_statements_lazy():
+    stream = parser.parse_statements("let a: i32 = 1\nlet = 2\n")
+    assert isinstance(next(stream), ast.VarDecl)
+    with pytest.raises(IncompleteParse):
+        next(stream)
+
+
+# spans
+
+
+def source_text(node):
+    file = span.files[span.file_id(node.info)]
+    return file.text[span.start(node.info) : span.end(node.info)]
+
+
+def test_spans():
+    code = "func f(a: i32) -> i32:\n    a + b * 2 - c\n    g x y"
+    source = span.register("<input>", code)
+    func = parser.run_parser(function_def(), code)
+    assert span.file_id(func.info) == source.id
+    binop, call = func.body
+    assert source_text(func) == code
+    assert span.format(func.info) == "<input>:1:1"
+    assert span.format(binop.rhs.info) == "<input>:2:17"
+    assert [source_text(n) for n in [binop, binop.lhs, binop.lhs.rhs]] == ["a + b * 2 - c", "a + b * 2", "b * 2"]
+    assert [source_text(n) for n in [call, call.callee]] == ["g x y", "g x"]
+
+
+def test_spans_postfix():
+    code = "f(a.b[1, 2]).c"
+    source = span.register("<input>", code)
+    node = parser.run_parser(expr(), code)
+    assert span.file_id(node.info) == source.id
+    assert source_text(node) == code
+    get_item = node.obj.arg.field_values[0]
+    assert [source_text(n) for n in [node.obj, node.obj.arg, get_item, get_item.expr, get_item.idx]] == [
+        "f(a.b[1, 2])",
+        "(a.b[1, 2])",
+        "a.b[1, 2]",
+        "a.b",
+        "1, 2",
+    ]
+
+
+@pytest.mark.parametrize(
+    "filename",
+    sorted(fname for fname in os.listdir(prelude_path) if fname.endswith(".gi")),
+)
+def test_spans_prelude(filename):
+    with open(os.path.join(prelude_path, filename), "r", encoding="utf8") as f:
+        prog = parser.run_parser(module(), f.read())
+
+    missing = []
+
+    def visit(value):
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                visit(item)
+        elif isinstance(value, ast.Node):
+            if value.info is None:
+                missing.append(value)
+            for item in vars(value).values():
+                visit(item)
+
+    visit(prog.stmts)
+    assert missing == []
+
+
+def test_spans_files(cache_dir, tmp_path):
+    filenames = [str(tmp_path / "a.gi"), str(tmp_path / "b.gi")]
+    for filename in filenames:
+        with open(filename, "w", encoding="utf8") as f:
+            f.write("let a: i32 = 1\n\nlet b: i32 = 2\n")
+
+    for cache in [False, True, True]:
+        prog = parser.parse_files(filenames, max_workers=2, cache=cache)
+        assert [span.format(stmt.info) for stmt in prog.stmts] == [
+            f"{filename}:{line}:1" for filename in filenames for line in [1, 3]
+        ]
+
+
+def test_spans_released():
+    prog = parser.parse_str("let a: i32 = 1\nlet b: i32 = 2\n# comment\n")
+    info = prog.stmts[1].info
+    assert span.format(info) == "<input>:2:1"
+    assert [source.id for source in prog.sources] == [span.file_id(info)]
+    # Pickled modules do not carry the text, it is registered again where they are loaded
+    assert b"comment" not in pickle.dumps(prog) and pickle.loads(pickle.dumps(prog)) == prog
+
+    del prog
+    gc.collect()
+    assert span.format(info) == "<unknown>"
+
+
+# input
+
+
+@pytest.mark.parametrize(
+    "text, pos, line, column",
+    [
+        ("", 0, 1, 1),
+        ("abc", 2, 1, 3),
+        ("a\nbc", 1, 1, 2),
+        ("a\nbc", 2, 2, 1),
+        ("a\nbc\n", 5, 3, 1),
+        ("\n\n\nabc", 4, 4, 2),
+    ],
+)
+def test_input_position(text, pos, line, column):
+    input = parser.Input(text, "<test>").advance(pos)
+    assert (input.line, input.column) == (line, column)
+
+
+def test_input_context():
+    input = parser.Input("first\nsecond line\nthird", "<test>").advance(9)
+    assert input.context() == "<test>:2\n   2: second line\n         ^"
+
+
+# errors
+
+
+@pytest.mark.parametrize(
+    "p, code, message",
+    [
+        (string("x"), "y", "Expected 'x', found 'y'"),
+        (regex(r"\d+"), "", "Expected pattern /\\d+/, found {eof}"),
+        (sequence(string("x"), eof()), "xy", "Expected {eof}, found 'y'"),
+        (sequence(regex(" *"), same_indent()), "  ", "Expected indent == 1, found 3"),
+    ],
+)
+def test_parse_error(p, code, message):
+    with pytest.raises(ValueError) as e:
+        parser.run_parser(p, code)
+    assert str(e.value).endswith(message)
+
+
+def test_incomplete_parse_error():
+    with pytest.raises(IncompleteParse) as e:
+        parser.run_parser(function_def(), "func fn1() -> i32:\n")
+    assert str(e.value).startswith("In parser indented_block\n")
+    assert str(e.value).endswith("Expected indent > 1, found 1")
+    reason = e.value.reason
+    assert e.value.args[:2] == (reason, "indented_block") and reason.args == (reason.input, reason.expected)
+
+
+# generated parser
+
+
+def test_generated_module_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(parser.codegen, "cache_dir", str(tmp_path))
+    (tmp_path / "lang_0000000000000000.py").write_text("")
+
+    generated = parser.codegen.load.__wrapped__()
+    assert sorted(f.name for f in tmp_path.glob("*.py")) == [f"lang_{parser.codegen.source_hash()}.py"]
+    code = "let a: i32 = 1"
+    assert parser.run_parser(generated.module(), code) == parser.run_parser(parser.lang.module(), code)
+
+
+def test_generated_module_removed(tmp_path, monkeypatch):
+    # The module of the current grammar is removed between the check and the import
+    monkeypatch.setattr(parser.codegen, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(parser.codegen.os.path, "exists", lambda path: True)
+
+    generated = parser.codegen.load.__wrapped__()
+    code = "let a: i32 = 1"
+    assert parser.run_parser(generated.module(), code) == parser.run_parser(parser.lang.module(), code)
+
+
+def test_generated_incomplete_parse_error():
+    messages = []
+    for grammar in [parser.lang, parser.codegen.load()]:
+        with pytest.raises(IncompleteParse) as e:
+            parser.run_parser(grammar.function_def(), "func fn1() -> i32:\n")
+        messages.append(str(e.value))
+    assert messages[0] == messages[1]
+
+
+# files
+
+
+def test_parse_files(tmp_path):
+    filenames = []
+    for i in range(4):
+        filenames.append(str(tmp_path / f"file{i}.gi"))
+        with open(filenames[-1], "w", encoding="utf8") as f:
+            f.write(f"let a{i}: i32 = {i}\nlet b{i}: i32 = a{i}\n")
+
+    prog = parser.parse_files(filenames, max_workers=2)
+    assert prog.stmts == [stmt for filename in filenames for stmt in parser.parse_file(filename).stmts]
+    assert [stmt.name for stmt in prog.stmts] == ["a0", "b0", "a1", "b1", "a2", "b2", "a3", "b3"]
+
+
+def test_parse_files_error(tmp_path):
+    filenames = [str(tmp_path / "ok.gi"), str(tmp_path / "error.gi")]
+    for filename, code in zip(filenames, ["let a: i32 = 1\n", "let b: i32 = 1\nlet = 2\n"]):
+        with open(filename, "w", encoding="utf8") as f:
+            f.write(code)
+
+    with pytest.raises((ValueError, IncompleteParse)) as e:
+        parser.parse_files(filenames, max_workers=2)
+    assert f"{filenames[1]}:2" in str(e.value)
+
+
+# ast cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(parser.ast_cache, "cache_root", str(tmp_path / "ast"))
+    return tmp_path / "ast"
+
+
+def test_ast_cache(cache_dir, tmp_path):
+    filename = str(tmp_path / "file.gi")
+    with open(filename, "w", encoding="utf8") as f:
+        f.write("let a: i32 = 1\n")
+
+    prog = parser.parse_file(filename)
+    assert len(list(cache_dir.glob("*/*.ast"))) == 1
+    assert parser.parse_file(filename) == prog
+    assert parser.parse_file(filename) is not parser.parse_file(filename)
+
+    parser.ast_cache.store("let a: i32 = 1\n", ast.Module([]))
+    assert parser.parse_file(filename) == ast.Module([])
+    assert parser.parse_file(filename, cache=False) == prog
+
+
+def test_ast_cache_version(cache_dir, monkeypatch):
+    parser.ast_cache.store("a", ast.Module([]))
+    (cache_dir / "recent").mkdir()
+    old = time.time() - parser.ast_cache.max_age - 1
+    os.utime(parser.ast_cache.cache_dir(), (old, old))
+    monkeypatch.setattr(parser.ast_cache, "version", lambda: "other")
+    assert parser.ast_cache.load("a") is None
+
+    # Only versions left unused for `max_age` are removed, others may belong to another checkout
+    parser.ast_cache.store("a", ast.Module([]))
+    assert sorted(d.name for d in cache_dir.glob("*")) == ["other", "recent"]
+
+
+@pytest.mark.parametrize("name", parser.ast_cache.dependencies)
+def test_ast_cache_version_dependencies(name, tmp_path, monkeypatch):
+    for dependency in parser.ast_cache.dependencies:
+        (tmp_path / dependency).parent.mkdir(exist_ok=True)
+        (tmp_path / dependency).write_text(dependency)
+    monkeypatch.setattr(parser.ast_cache, "base_dir", str(tmp_path))
+    version = parser.ast_cache.version.__wrapped__()
+
+    (tmp_path / name).write_text("edited")
+    assert parser.ast_cache.version.__wrapped__() != version
+
+
+def test_ast_cache_load_once(cache_dir, tmp_path, monkeypatch):
+    filenames = [str(tmp_path / f"file{i}.gi") for i in range(2)]
+    for filename in filenames:
+        with open(filename, "w", encoding="utf8") as f:
+            f.write(f"let {os.path.basename(filename)[:-3]}: i32 = 1\n")
+
+    loaded = []
+    load = parser.ast_cache.load
+    monkeypatch.setattr(parser.ast_cache, "load", lambda text: loaded.append(text) or load(text))
+    prog = parser.parse_files(filenames, max_workers=1)
+    assert len(prog.stmts) == 2
+    assert len(loaded) == 2
+
+
+def test_ast_cache_corrupt(cache_dir):
+    parser.ast_cache.store("a", ast.Module([]))
+    for path in cache_dir.glob("*/*.ast"):
+        path.write_bytes(b"corrupt")
+    assert parser.ast_cache.load("a") is None
+
+
+# profile
+
+
+def test_profile_counts():
+    with parser.profile.Profile() as prof:
+        parser.run_parser(sep_by(regex(r"\s*,\s*"), expr()), "a, (b), 1")
+    assert parser.combinators.profiler is None
+
+    stats = prof.stats["expr_index"]
+    assert (stats.calls, stats.successes, stats.failures) == (4, 4, 0)
+    assert stats.consumed == len("a") + len("(b)") + len("b") + len("1")
+    assert (prof.stats["parens"].calls, prof.stats["parens"].successes) == (1, 1)
+    assert prof.stats[r"pattern /\s*,\s*/"].failures == 2
+
+    parser.run_parser(expr(), "a")
+    assert prof.stats["expr_index"].calls == 4
+
+
+def test_profile_wasted():
+    @generate
+    def abc():
+        yield string("ab")
+        yield regex(r"\s*c")
+
+    with parser.profile.Profile() as prof:
+        with pytest.raises(IncompleteParse):
+            parser.run_parser(abc(), "ab  d")
+    assert (prof.stats["abc"].failures, prof.stats["abc"].wasted) == (1, 2)
+    assert (prof.stats[r"pattern /\s*c/"].failures, prof.stats[r"pattern /\s*c/"].wasted) == (1, 0)
+
+
+def test_profile_uninstrumented():
+    parsers = [regex(r"x+"), expr()]
+    closures = [[cell.cell_contents for cell in p.__closure__] for p in parsers]
+    with parser.profile.Profile() as prof:
+        assert [[cell.cell_contents for cell in p.__closure__] for p in parsers] != closures
+        parser.run_parser(parsers[0], "xx")
+    assert [[cell.cell_contents for cell in p.__closure__] for p in parsers] == closures
+    assert prof.stats["pattern /x+/"].consumed == 2
+
+
+def test_profile_report():
+    prof = parser.profile.profile("func f(a: i32) -> i32:\n    a + 1\n")
+    calls = [stats["calls"] for stats in prof.as_dict("calls").values()]
+    assert calls == sorted(calls, reverse=True)
+    assert list(json.loads(prof.to_json())) == list(prof.as_dict())
+
+    lines = prof.report("calls", limit=3).splitlines()
+    assert len(lines) == 4
+    assert lines[0].split() == ["name"] + parser.profile.columns